@@ -1,11 +1,21 @@
-cdef extern from "stdlib.h":
-  void *malloc(int size)
+from cpython cimport array
+
+cdef extern from "stdlib.h" nogil:
+  void *malloc(size_t size)
+  void *realloc(void *ptr, size_t size)
   void free(void *)
 
-cdef extern from "string.h":
+  void qsort(void *base, size_t nmemb, size_t size,
+             int (*compar)(const void *, const void *))
+
+cdef extern from "string.h" nogil:
   int strcmp(char *, char *)
+  void *memcpy(void *dest, const void *src, size_t n)
+  void *memset(void *s, int c, size_t n)
+  int memcmp(const void *s1, const void *s2, size_t n)
+  size_t strlen(const char *s)
 
-cdef extern from "cwb/cl.h":
+cdef extern from "cwb/cl.h" nogil:
   int ATT_NONE
   int ATT_POS
   int ATT_STRUC
@@ -14,6 +24,8 @@ cdef extern from "cwb/cl.h":
   int CDA_EALIGN
   char *cdperror_string(int error_num)
   union c_Attribute "_Attribute"
+  struct c_PositionStream "_position_stream_rec_"
+  ctypedef c_PositionStream *PositionStream
   struct c_Corpus "TCorpus":
     pass
   struct c_CorpusProperty "TCorpusProperty":
@@ -49,10 +61,18 @@ cdef extern from "cwb/cl.h":
                   int *target_start, int *target_end)
   int *collect_matching_ids(c_Attribute *attribute, char *pattern,
                             int canonicalize, int *number_of_matches)
+  struct c_CL_Regex "_CL_Regex"
+  ctypedef c_CL_Regex *CL_Regex
+  CL_Regex cl_new_regex(char *regex, int flags, CorpusCharset charset)
+  int cl_regex_match(CL_Regex rx, char *string, int normalize_utf8)
+  void cl_delete_regex(CL_Regex rx)
   int *cl_idlist2cpos(c_Attribute *attribute,
                       int *ids, int number_of_ids,
                       int sort,
                       int *size_of_table)
+  PositionStream cl_new_stream(c_Attribute *attribute, int id)
+  int cl_delete_stream(PositionStream *ps)
+  int cl_read_stream(PositionStream ps, int *buffer, int buffer_size)
   int get_struc_attribute(c_Attribute *attribute, int cpos, int *s_start, int *s_end)
   int get_num_of_struc(c_Attribute *attribute, int cpos, int *s_num)
   int get_bounds_of_nth_struc(c_Attribute *attribute, int struc_num, int *s_start, int *s_end)
@@ -64,32 +84,132 @@ cdef class AlignAttrib
 cdef class Corpus:
   cdef c_Corpus *corpus
   cdef object name
-  cdef object charset_decoder
-  cdef object charset_encoder
+  cdef object registry_name
+  cdef object registry_dir
+  cdef object home
+  cdef object encoding
+  cdef int charset_kind
+  cdef bytes codec_name
   cpdef bytes to_str(self, s)
   cpdef unicode to_unicode(self, s)
+  cdef unicode decode_string(self, const char *s, Py_ssize_t n)
+  cdef unicode decode_c(self, const char *s)
 
 cdef class IDList:
   cdef int *ids
   cdef int length
-  cpdef IDList join(self, IDList other, int offset)
+  cdef object data
+  cdef Py_buffer view
+  cdef bint has_view
+  cdef Py_ssize_t view_shape
+  cdef Py_ssize_t view_stride
+  cpdef join(self, other, int offset)
+
+ctypedef struct PackedData:
+  int length
+  int n_blocks
+  int *firsts
+  Py_ssize_t *offsets
+  unsigned char *data
+  Py_ssize_t size
+
+cdef class PackedIDList:
+  cdef PackedData p
+  cpdef join(self, other, int offset)
+  cpdef IDList unpack(self)
+
+ctypedef struct NGramCount:
+  unsigned long long hi
+  unsigned long long lo
+  long long count
+
+cdef class NGramTable:
+  cdef object path
+  cdef object data
+  cdef Py_buffer view
+  cdef bint has_view
+  cdef readonly int n
+  cdef readonly int bits
+  cdef Py_ssize_t length
+  cdef NGramCount *recs
+  cdef tuple unpack(self, Py_ssize_t i)
+
+cdef class LexiconIndex
 
 cdef class PosAttrib:
   cdef c_Attribute *att
   cdef Corpus parent
   cdef object attname
+  cdef list lexicon_cache
+  cdef object lexicon_lru
+  cdef int lexicon_lru_size
+  cdef array.array freqs
+  cdef LexiconIndex sorted_lexicon
+  cdef bint sorted_lexicon_checked
+  cdef dict folded_indices
+  cdef int loaded
+  cdef bint release_gil
+  cdef object id_data
+  cdef Py_buffer id_view
+  cdef bint has_id_view
+  cdef int *id_stream
+  cdef int ensure_loaded(self, int components) except -1
+  cdef object id2value(self, int tagid)
+  cdef object decode(self, const char *s)
   cpdef cpos2id(self,int offset)
+  cdef int fill_ids(self, int start, int stop, int *out) except -1
+  cdef object positions_for(self, IDList ids)
+  cpdef array.array ids(self, int start, int stop)
+
+cdef class ValueIndex:
+  cdef object data
+  cdef Py_buffer view
+  cdef bint has_view
+  cdef long long n_keys
+  cdef unsigned long long mask
+  cdef long long *key_offsets
+  cdef long long *posting_offsets
+  cdef int *slots
+  cdef int *postings
+  cdef char *blob
+  cdef int find_key(self, const char *s, Py_ssize_t n)
+  cdef IDList postings_for(self, int k)
+
+ctypedef struct LexiconEntry:
+  const char *s
+  int length
+  int tagid
+
+cdef class LexiconIndex:
+  cdef object data
+  cdef Py_buffer view
+  cdef bint has_view
+  cdef PosAttrib attr
+  cdef int n
+  cdef int *by_form
+  cdef int *by_suffix
+  cdef int affix_range(self, bint suffix, const char *p, int m, int *hi) nogil
+  cdef IDList collect(self, bint suffix, int lo, int hi)
 
 cdef class AttStruc:
   cdef c_Attribute *att
   cdef bint has_values
   cdef Corpus parent
   cdef object attname
+  cdef ValueIndex values
+  cdef array.array starts
+  cdef array.array ends
+  cdef int loaded
+  cdef int ensure_loaded(self, int components) except -1
+  cdef int load_regions(self) except -1
 
 cdef class AlignAttrib:
   cdef c_Attribute *att
   cdef bint has_values
   cdef Corpus parent
   cdef object attname
+  cdef tuple beads
+  cdef int loaded
+  cdef int ensure_loaded(self, int components) except -1
 
 
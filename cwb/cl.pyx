@@ -1,29 +1,121 @@
 # cython: language_level=2
 import codecs
+import array
+import functools
+import mmap
+import os
+import re
+import struct
+import unicodedata
+from collections import OrderedDict
+from cwb.registry import corpus_home
 from cpython.version cimport PY_MAJOR_VERSION
+from libc.math cimport log, sqrt
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, \
+     PyObject_CheckBuffer, PyBUF_FORMAT, PyBUF_C_CONTIGUOUS, PyBUF_WRITABLE, \
+     PyBUF_SIMPLE
+from cpython.unicode cimport PyUnicode_Decode, PyUnicode_DecodeUTF8, \
+     PyUnicode_DecodeLatin1, PyUnicode_AsEncodedString, \
+     PyUnicode_AsUTF8String, PyUnicode_AsLatin1String
+from cpython.pythread cimport PyThread_type_lock, PyThread_allocate_lock, \
+     PyThread_acquire_lock, PyThread_release_lock, WAIT_LOCK
 
 cdef public object registry
 
 registry="/usr/local/share/cwb/registry/"
+# index files are written next to the corpus data; if that directory
+# is not writable, they go here instead (or are not persisted at all)
+index_dir=None
 
 cdef class PosAttrib
 cdef class AttStruc
 cdef class AlignAttrib
 
+# Thread safety: libcl loads the components of an attribute (corpus
+# stream, lexicon, index, ...) on first use, and the regex optimizer
+# keeps global state. Components are therefore loaded with ensure_loaded
+# while holding the GIL before a nogil section reads them, and calls to
+# collect_matching_ids are serialized with regex_lock. Huffman-compressed
+# corpus streams cache the last decoded block in the attribute, so they
+# are only read while holding the GIL.
+cdef enum:
+  LOAD_CORPUS=1
+  LOAD_LEXICON=2
+  LOAD_REVCORP=4
+  LOAD_FREQS=8
+  LOAD_REGIONS=16
+  LOAD_VALUES=32
+  LOAD_ALIGN=64
+
+cdef PyThread_type_lock regex_lock=PyThread_allocate_lock()
+
+cdef int *matching_ids(c_Attribute *att, char *pat, int flags, int *n) nogil:
+  cdef int *result
+  PyThread_acquire_lock(regex_lock, WAIT_LOCK)
+  result=collect_matching_ids(att, pat, flags, n)
+  PyThread_release_lock(regex_lock)
+  return result
+
 # TBD:
 # list_corpora => gives a list of all corpora
 
+# canonicalization flags for find_pattern (%c and %d in CQP)
+IGNORE_CASE=1
+IGNORE_DIAC=2
+
 encoding_names={
     'utf8':'UTF-8',
     'latin1':'ISO-8859-15'}
 
+# strings are decoded and encoded with the C API; UTF-8 and Latin-1
+# have their own (faster) functions
+cdef enum:
+  CHARSET_OTHER=0
+  CHARSET_UTF8=1
+  CHARSET_LATIN1=2
+
+cdef array.array int_array_template=array.array('i')
+cdef array.array double_array_template=array.array('d')
+
+cdef array.array new_int_array(Py_ssize_t n):
+  return array.clone(int_array_template, n, False)
+
+cdef bint is_int_buffer(Py_buffer *view):
+  cdef bytes fmt
+  fmt=view.format if view.format!=NULL else b'B'
+  if fmt[:1] in (b'@', b'='):
+    fmt=fmt[1:]
+  return view.ndim<=1 and view.itemsize==sizeof(int) and fmt in (b'i', b'l')
+
+cdef int acquire_int_buffer(obj, Py_buffer *view, int flags=0) except -1:
+  # gets a contiguous one-dimensional buffer of C ints (e.g. an
+  # array.array('i') or a numpy.int32 array) from obj. PackedIDLists
+  # are unpacked (the view keeps the unpacked list alive).
+  if isinstance(obj, PackedIDList):
+    obj=(<PackedIDList>obj).unpack()
+  PyObject_GetBuffer(obj, view, PyBUF_FORMAT|PyBUF_C_CONTIGUOUS|flags)
+  if not is_int_buffer(view):
+    PyBuffer_Release(view)
+    raise TypeError('expected a buffer of C ints, got format %r'%(
+      view.format if view.format!=NULL else b'B',))
+  return 0
+
+cdef int compare_ints(const void *a, const void *b) nogil:
+  cdef int x=(<int *>a)[0], y=(<int *>b)[0]
+  return (x>y)-(x<y)
+
 cdef class Corpus:
   def __cinit__(self, cname, encoding=None, registry_dir=None):
     if registry_dir is None:
       registry_dir=registry
+    if isinstance(registry_dir, bytes):
+      self.registry_dir=registry_dir.decode('ascii')
+    else:
+      self.registry_dir=registry_dir
     if isinstance(registry_dir, unicode):
         registry_dir = registry_dir.encode('ascii')
     self.name=cname
+    self.registry_name=native_name(cname)
     if isinstance(cname, unicode):
         cname = cname.encode('ascii')
     self.corpus=cl_new_corpus(registry_dir,cname)
@@ -31,18 +123,53 @@ cdef class Corpus:
       raise KeyError(cname)
     if encoding is None:
       encoding=self.get_encoding()
-    self.charset_decoder=codecs.getdecoder(encoding)
-    self.charset_encoder=codecs.getencoder(encoding)
+    self.encoding=encoding
+    codec=codecs.lookup(encoding).name
+    self.codec_name=codec.encode('ascii')
+    if codec=='utf-8':
+      self.charset_kind=CHARSET_UTF8
+    elif codec=='iso8859-1':
+      self.charset_kind=CHARSET_LATIN1
+    else:
+      self.charset_kind=CHARSET_OTHER
   cpdef bytes to_str(self, s):
     if isinstance(s,unicode):
-      return self.charset_encoder(s)[0]
+      if self.charset_kind==CHARSET_UTF8:
+        return PyUnicode_AsUTF8String(s)
+      elif self.charset_kind==CHARSET_LATIN1:
+        return PyUnicode_AsLatin1String(s)
+      return PyUnicode_AsEncodedString(s, self.codec_name, NULL)
     else:
       return s
   cpdef unicode to_unicode(self, s):
     if isinstance(s,unicode):
       return s
+    elif isinstance(s,bytes):
+      return self.decode_string(s, len(s))
     else:
-      return self.charset_decoder(s)[0]
+      # other buffers (bytearray, memoryview, ...) go through the codec
+      return codecs.decode(s, self.encoding)
+  cdef unicode decode_string(self, const char *s, Py_ssize_t n):
+    if self.charset_kind==CHARSET_UTF8:
+      return PyUnicode_DecodeUTF8(<char *>s, n, NULL)
+    elif self.charset_kind==CHARSET_LATIN1:
+      return PyUnicode_DecodeLatin1(<char *>s, n, NULL)
+    return PyUnicode_Decode(<char *>s, n, self.codec_name, NULL)
+  cdef unicode decode_c(self, const char *s):
+    # decodes a string returned by the CWB library
+    if s==NULL:
+      raise KeyError('no such string in the lexicon')
+    return self.decode_string(s, strlen(s))
+  def decode_many(self, strings):
+    """decodes a sequence of byte strings with the corpus encoding
+       and returns a list of unicode strings"""
+    cdef list result=[]
+    for s in strings:
+      if type(s) is bytes:
+        result.append(self.decode_string(s, len(s)))
+      else:
+        result.append(self.to_unicode(s))
+    return result
   def get_encoding(self):
     cdef const char *s
     cdef CorpusCharset cset
@@ -57,6 +184,10 @@ cdef class Corpus:
             return s
   def __repr__(self):
       return "CWB.CL.Corpus('%s')"%(self.name)
+  def __reduce__(self):
+    # corpora are pickled by name and reopened when unpickled; the
+    # corpus data is only loaded when it is used
+    return (Corpus, (self.name, self.encoding, self.registry_dir))
   def __dealloc__(self):
     if self.corpus!=NULL:
       cl_delete_corpus(self.corpus)
@@ -69,23 +200,262 @@ cdef class Corpus:
     elif atype=='a':
       return AlignAttrib(self,name)
 
+# set operations on sorted int arrays. When one list is much longer
+# than the other, we use galloping (exponential) search in the longer
+# list instead of stepping through it one element at a time.
+cdef int gallop_ratio=16
+
+cdef inline int gallop(int *a, int lo, int n, int val) nogil:
+  # returns the first index k>=lo with a[k]>=val (or n)
+  cdef int step=1, hi, mid
+  if lo>=n or a[lo]>=val:
+    return lo
+  hi=lo+1
+  while hi<n and a[hi]<val:
+    lo=hi
+    step*=2
+    hi=lo+step
+  if hi>n:
+    hi=n
+  # invariant: a[lo]<val, a[hi]>=val (or hi==n)
+  while hi-lo>1:
+    mid=lo+(hi-lo)/2
+    if a[mid]<val:
+      lo=mid
+    else:
+      hi=mid
+  return hi
+
+cdef int intersect_ids(int *a, int na, int *b, int nb, int offset, int *out) nogil:
+  # writes those values v of a for which v+offset is in b to out
+  cdef int k1=0, k2=0, k=0
+  cdef int val1, val2
+  if na*gallop_ratio<nb:
+    while k1<na and k2<nb:
+      val1=a[k1]
+      k2=gallop(b, k2, nb, val1+offset)
+      if k2<nb and b[k2]==val1+offset:
+        out[k]=val1
+        k+=1
+      k1+=1
+  elif nb*gallop_ratio<na:
+    while k1<na and k2<nb:
+      val2=b[k2]-offset
+      k1=gallop(a, k1, na, val2)
+      if k1<na and a[k1]==val2:
+        out[k]=val2
+        k+=1
+        k1+=1
+      k2+=1
+  else:
+    while k1<na and k2<nb:
+      val1=a[k1]
+      val2=b[k2]-offset
+      if val1<val2:
+        k1+=1
+      elif val2<val1:
+        k2+=1
+      else:
+        out[k]=val1
+        k+=1
+        k1+=1
+        k2+=1
+  return k
+
+cdef int union_ids(int *a, int na, int *b, int nb, int *out) nogil:
+  cdef int k1=0, k2=0, k=0, nxt
+  cdef int val1, val2
+  cdef int *tmp
+  if nb*gallop_ratio<na or na*gallop_ratio<nb:
+    if na<nb:
+      tmp=a; a=b; b=tmp
+      nxt=na; na=nb; nb=nxt
+    # copy runs of the long list a between the elements of b
+    while k2<nb:
+      val2=b[k2]
+      nxt=gallop(a, k1, na, val2)
+      memcpy(out+k, a+k1, (nxt-k1)*sizeof(int))
+      k+=nxt-k1
+      k1=nxt
+      out[k]=val2
+      k+=1
+      if k1<na and a[k1]==val2:
+        k1+=1
+      k2+=1
+    memcpy(out+k, a+k1, (na-k1)*sizeof(int))
+    return k+na-k1
+  while k1<na and k2<nb:
+    val1=a[k1]
+    val2=b[k2]
+    if val1<val2:
+      out[k]=val1
+      k+=1
+      k1+=1
+    elif val2<val1:
+      out[k]=val2
+      k+=1
+      k2+=1
+    else:
+      out[k]=val1
+      k+=1
+      k1+=1
+      k2+=1
+  memcpy(out+k, a+k1, (na-k1)*sizeof(int))
+  k+=na-k1
+  memcpy(out+k, b+k2, (nb-k2)*sizeof(int))
+  return k+nb-k2
+
+cdef int difference_ids(int *a, int na, int *b, int nb, int *out) nogil:
+  cdef int k1=0, k2=0, k=0, nxt
+  cdef int val1, val2
+  if na*gallop_ratio<nb:
+    while k1<na:
+      val1=a[k1]
+      k2=gallop(b, k2, nb, val1)
+      if k2>=nb or b[k2]!=val1:
+        out[k]=val1
+        k+=1
+      k1+=1
+    return k
+  if nb*gallop_ratio<na:
+    while k2<nb:
+      nxt=gallop(a, k1, na, b[k2])
+      memcpy(out+k, a+k1, (nxt-k1)*sizeof(int))
+      k+=nxt-k1
+      k1=nxt
+      if k1<na and a[k1]==b[k2]:
+        k1+=1
+      k2+=1
+    memcpy(out+k, a+k1, (na-k1)*sizeof(int))
+    return k+na-k1
+  while k1<na and k2<nb:
+    val1=a[k1]
+    val2=b[k2]
+    if val1<val2:
+      out[k]=val1
+      k+=1
+      k1+=1
+    elif val2<val1:
+      k2+=1
+    else:
+      k1+=1
+      k2+=1
+  memcpy(out+k, a+k1, (na-k1)*sizeof(int))
+  return k+na-k1
+
+# IDList files (IDList.save) start with a 16-byte header with magic and
+# length, followed by the values as ints or (compressed) as the
+# differences between consecutive values in a variable-length encoding
+# with 7 bits per byte, lowest bits first
+cdef bytes idlist_magic=b'CWBIDLS1'
+cdef bytes idlist_varint_magic=b'CWBIDLV1'
+cdef int idlist_header=16
+
+cdef Py_ssize_t encode_deltas(int *ids, int n, unsigned int prev, unsigned char *out) nogil:
+  # writes the differences between consecutive values (starting from
+  # prev) to out and returns the number of bytes written
+  cdef Py_ssize_t k=0
+  cdef int i
+  cdef unsigned int delta
+  for i from 0<=i<n:
+    delta=<unsigned int>ids[i]-prev
+    prev=<unsigned int>ids[i]
+    while delta>=0x80:
+      out[k]=(delta&0x7f)|0x80
+      delta>>=7
+      k+=1
+    out[k]=delta
+    k+=1
+  return k
+
+cdef Py_ssize_t decode_deltas(const unsigned char *buf, Py_ssize_t size,
+                              unsigned int prev, int *out, int n) nogil:
+  # reads n values written by encode_deltas and returns the number of
+  # bytes read, or -1 if buf is too short
+  cdef Py_ssize_t k=0
+  cdef int i, shift
+  cdef unsigned int delta
+  for i from 0<=i<n:
+    delta=0
+    shift=0
+    while True:
+      if k>=size or shift>28:
+        return -1
+      delta|=(buf[k]&0x7f)<<shift
+      k+=1
+      if buf[k-1]<0x80:
+        break
+      shift+=7
+    prev+=delta
+    out[i]=<int>prev
+  return k
+
 cdef class IDList:
-  def __cinit__(self, seq=None):
-    cdef int i, old_val, is_sorted
+  def __cinit__(self, seq=None, sort=False):
+    cdef Py_buffer view
+    cdef int i, k
+    self.ids=NULL
+    self.length=0
     if seq is None:
-      self.ids=NULL
-      self.length=0
-    else:
+      return
+    if isinstance(seq, PackedIDList):
+      self.length=(<PackedIDList>seq).p.length
+      self.ids=<int *>malloc(self.length*sizeof(int))
+      with nogil:
+        unpack_ids(&(<PackedIDList>seq).p, self.ids)
+      return
+    if PyObject_CheckBuffer(seq):
+      PyObject_GetBuffer(seq, &view, PyBUF_FORMAT|PyBUF_C_CONTIGUOUS)
+      try:
+        if is_int_buffer(&view):
+          self.length=view.len/sizeof(int)
+          self.ids=<int *>malloc(self.length*sizeof(int))
+          memcpy(self.ids, view.buf, self.length*sizeof(int))
+      finally:
+        PyBuffer_Release(&view)
+    if self.ids==NULL:
       self.length=len(seq)
       self.ids=<int *>malloc(self.length*sizeof(int))
-      old_val=-1
-      is_sorted=True
       for i from 0<=i<self.length:
-        if seq[i]<old_val:
-          is_sorted=False
-        old_val=seq[i]
         self.ids[i]=seq[i]
-      assert sorted
+    if sort:
+      with nogil:
+        qsort(self.ids, self.length, sizeof(int), compare_ints)
+        k=0
+        for i from 0<=i<self.length:
+          if k==0 or self.ids[i]!=self.ids[k-1]:
+            self.ids[k]=self.ids[i]
+            k+=1
+        self.length=k
+    else:
+      for i from 1<=i<self.length:
+        if self.ids[i]<self.ids[i-1]:
+          raise ValueError('IDList values must be sorted')
+  def __getbuffer__(self, Py_buffer *buffer, int flags):
+    if flags&PyBUF_WRITABLE:
+      raise BufferError('IDList buffers are read-only')
+    self.view_shape=self.length
+    self.view_stride=sizeof(int)
+    buffer.buf=self.ids
+    buffer.obj=self
+    buffer.len=self.length*sizeof(int)
+    buffer.readonly=1
+    buffer.itemsize=sizeof(int)
+    if flags&PyBUF_FORMAT:
+      buffer.format='i'
+    else:
+      buffer.format=NULL
+    buffer.ndim=1
+    buffer.shape=&self.view_shape
+    buffer.strides=&self.view_stride
+    buffer.suboffsets=NULL
+    buffer.internal=NULL
+  def __releasebuffer__(self, Py_buffer *buffer):
+    pass
+  def to_numpy(self):
+    """returns a read-only numpy array sharing memory with this IDList"""
+    import numpy
+    return numpy.frombuffer(self, dtype=numpy.intc)
   def __len__(self):
     return self.length
   def __getitem__(self,i):
@@ -109,110 +479,940 @@ cdef class IDList:
       return self.ids[lo]==v
     else:
       return False
-  def __and__(IDList self, IDList other):
-    return self.join(other,0)
-  def __or__(IDList self, IDList other):
-    cdef int *result
-    cdef int k1, k2, k
-    cdef int val1, val2
-    cdef IDList r
+  def __and__(self, other):
+    if not isinstance(self, IDList):
+      return combine_lists(self, other, COMBINE_JOIN, 0)
+    return (<IDList>self).join(other,0)
+  def __or__(self, other):
+    cdef IDList a, b, r
+    if not (isinstance(self, IDList) and isinstance(other, IDList)):
+      return combine_lists(self, other, COMBINE_UNION, 0)
+    a=self
+    b=other
     # allocate once, using a conservative estimate on
     # how big the result list is
-    result=<int *>malloc((self.length+other.length)*sizeof(int))
-    k1=k2=k=0
-    while k1<self.length and k2<other.length:
-      val1=self.ids[k1]
-      val2=other.ids[k2]
-      if val1<val2:
-        result[k]=val1
-        k+=1
-        k1+=1
-      elif val2<val1:
-        result[k]=val2
-        k+=1
-        k2+=1
-      else:
-        result[k]=val1
-        k+=1
-        k1+=1
-        k2+=1
-    while k1<self.length:
-      val1=self.ids[k1]
-      result[k]=val1
-      k+=1
-      k1+=1
-    while k2<other.length:
-      val2=other.ids[k2]
-      result[k]=val2
-      k+=1
-      k2+=1
     r=IDList()
+    r.ids=<int *>malloc((a.length+b.length)*sizeof(int))
+    with nogil:
+      r.length=union_ids(a.ids, a.length, b.ids, b.length, r.ids)
+    return r
+  def __sub__(self, other):
+    cdef IDList a, b, r
+    if not (isinstance(self, IDList) and isinstance(other, IDList)):
+      return combine_lists(self, other, COMBINE_DIFFERENCE, 0)
+    a=self
+    b=other
+    r=IDList()
+    r.ids=<int *>malloc(a.length*sizeof(int))
+    with nogil:
+      r.length=difference_ids(a.ids, a.length, b.ids, b.length, r.ids)
+    return r
+  cpdef join(self, other, int offset):
+    cdef IDList b, r
+    if not isinstance(other, IDList):
+      return combine_lists(self, other, COMBINE_JOIN, offset)
+    b=other
+    r=IDList()
+    if b.length<self.length:
+      r.ids=<int *>malloc(b.length*sizeof(int))
+    else:
+      r.ids=<int *>malloc(self.length*sizeof(int))
+    with nogil:
+      r.length=intersect_ids(self.ids, self.length, b.ids, b.length,
+                             offset, r.ids)
+    return r
+  def shifted(self, int offset, size=None):
+    """returns an IDList with *offset* added to all values, leaving out
+       the results that are negative or (if *size* is given) not below
+       *size*"""
+    cdef IDList r=IDList()
+    cdef int i, k=0, val, limit=0
+    cdef bint bounded=size is not None
+    if bounded:
+      limit=size
+    r.ids=<int *>malloc(self.length*sizeof(int))
+    with nogil:
+      for i from 0<=i<self.length:
+        val=self.ids[i]+offset
+        if val>=0 and (not bounded or val<limit):
+          r.ids[k]=val
+          k+=1
     r.length=k
-    r.ids=result
     return r
-  def __sub__(IDList self, IDList other):
-    cdef int *result
-    cdef int k1, k2, k
-    cdef int val1, val2
-    cdef IDList r
-    # allocate once, using a conservative estimate on
-    # how big the result list is
-    result=<int *>malloc(self.length*sizeof(int))
-    k1=k2=k=0
-    while k1<self.length and k2<other.length:
-      val1=self.ids[k1]
-      val2=other.ids[k2]
-      if val1<val2:
-        result[k]=val1
-        k+=1
-        k1+=1
-      elif val2<val1:
-        k2+=1
-      else:
-        k1+=1
-        k2+=1
-    while k1<self.length:
-      result[k]=self.ids[k1]
-      k+=1
-      k1+=1
+  @staticmethod
+  def intersect_all(lists):
+    """returns the intersection of all IDLists in *lists*, going
+       through the shortest list and looking up its values in the others"""
+    cdef list inputs=sorted(lists, key=len)
+    cdef int n=len(inputs), i, j, k, val
+    cdef IDList r, lst
+    cdef int **idss
+    cdef int *lens
+    cdef int *cursors
+    if n==0:
+      raise ValueError('intersect_all needs at least one IDList')
+    if not all([isinstance(x, IDList) for x in inputs]):
+      result=inputs[0]
+      for x in inputs[1:]:
+        result=result&x
+      return result
+    idss=<int **>malloc(n*sizeof(int *))
+    lens=<int *>malloc(n*sizeof(int))
+    cursors=<int *>malloc(n*sizeof(int))
+    for j from 0<=j<n:
+      lst=inputs[j]
+      idss[j]=lst.ids
+      lens[j]=lst.length
+      cursors[j]=0
     r=IDList()
+    r.ids=<int *>malloc(lens[0]*sizeof(int))
+    k=0
+    with nogil:
+      for i from 0<=i<lens[0]:
+        val=idss[0][i]
+        for j from 1<=j<n:
+          cursors[j]=gallop(idss[j], cursors[j], lens[j], val)
+          if cursors[j]>=lens[j] or idss[j][cursors[j]]!=val:
+            break
+        else:
+          r.ids[k]=val
+          k+=1
+    free(idss)
+    free(lens)
+    free(cursors)
     r.length=k
-    r.ids=result
     return r
-  cpdef IDList join(self, IDList other, int offset):
-    cdef int *result
-    cdef int k1, k2, k
-    cdef int val1, val2
-    cdef IDList r
-    # allocate once, using a conservative estimate on
-    # how big the result list is
-    if other.length<self.length:
-      result=<int *>malloc(other.length*sizeof(int))
-    else:
-      result=<int *>malloc(self.length*sizeof(int))
-    k1=k2=k=0
-    while k1<self.length and k2<other.length:
-      val1=self.ids[k1]
-      val2=other.ids[k2]-offset
-      if val1<val2:
-        k1+=1
-      elif val2<val1:
-        k2+=1
-      else:
-        result[k]=val1
-        k+=1
-        k1+=1
-        k2+=1
+  @staticmethod
+  def union_all(lists):
+    """returns the union of all IDLists in *lists* using a k-way merge"""
+    cdef list inputs=[x for x in lists if len(x)>0]
+    cdef int n=len(inputs), i, j, k, top, child, total=0
+    cdef IDList r, lst
+    cdef int **heads
+    cdef int **ends
+    cdef int *tmp
+    if not all([isinstance(x, IDList) for x in inputs]):
+      result=IDList()
+      for x in sorted(inputs, key=len):
+        result=result|x
+      return result
+    for lst in inputs:
+      total+=lst.length
     r=IDList()
+    r.ids=<int *>malloc(total*sizeof(int))
+    heads=<int **>malloc(n*sizeof(int *))
+    ends=<int **>malloc(n*sizeof(int *))
+    # binary min-heap of list cursors, ordered by their current value
+    for i from 0<=i<n:
+      lst=inputs[i]
+      heads[i]=lst.ids
+      ends[i]=lst.ids+lst.length
+      j=i
+      while j>0 and heads[(j-1)/2][0]>heads[j][0]:
+        tmp=heads[j]; heads[j]=heads[(j-1)/2]; heads[(j-1)/2]=tmp
+        tmp=ends[j]; ends[j]=ends[(j-1)/2]; ends[(j-1)/2]=tmp
+        j=(j-1)/2
+    with nogil:
+      k=0
+      while n>0:
+        if k==0 or r.ids[k-1]!=heads[0][0]:
+          r.ids[k]=heads[0][0]
+          k+=1
+        heads[0]+=1
+        if heads[0]==ends[0]:
+          n-=1
+          heads[0]=heads[n]
+          ends[0]=ends[n]
+        top=0
+        while True:
+          child=2*top+1
+          if child>=n:
+            break
+          if child+1<n and heads[child+1][0]<heads[child][0]:
+            child+=1
+          if heads[top][0]<=heads[child][0]:
+            break
+          tmp=heads[top]; heads[top]=heads[child]; heads[child]=tmp
+          tmp=ends[top]; ends[top]=ends[child]; ends[child]=tmp
+          top=child
+    free(heads)
+    free(ends)
     r.length=k
-    r.ids=result
     return r
+  def save(self, path, compress=False):
+    """writes this IDList to the file *path*, which can be read with
+       IDList.load. With compress=True, the differences between
+       consecutive values are stored with a variable-length encoding,
+       which takes less space but cannot be mapped into memory."""
+    cdef unsigned char *buf
+    cdef Py_ssize_t k
+    cdef bytes payload
+    if compress:
+      # at most 5 bytes per value
+      buf=<unsigned char *>malloc(<size_t>self.length*5+1)
+      if buf==NULL:
+        raise MemoryError
+      with nogil:
+        k=encode_deltas(self.ids, self.length, 0, buf)
+      try:
+        payload=(<char *>buf)[:k]
+      finally:
+        free(buf)
+      header=struct.pack('=8sq', idlist_varint_magic, self.length)
+    else:
+      payload=memoryview(self).cast('B').tobytes()
+      header=struct.pack('=8sq', idlist_magic, self.length)
+    tmp_path='%s.%d.tmp'%(path, os.getpid())
+    try:
+      with open(tmp_path, 'wb') as f_out:
+        f_out.write(header)
+        f_out.write(payload)
+      os.rename(tmp_path, path)
+    finally:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+  @staticmethod
+  def load(path, mmap=True):
+    """reads an IDList written by IDList.save. Uncompressed files are
+       mapped into memory (unless mmap=False), so that opening them does
+       not read the values, and processes loading the same file share
+       its pages."""
+    cdef IDList r=IDList()
+    cdef char *base
+    cdef int *ids
+    cdef long long n
+    cdef Py_ssize_t size, status
+    if mmap:
+      r.data=map_file(path)
+    else:
+      with open(path, 'rb') as f_in:
+        r.data=f_in.read()
+    PyObject_GetBuffer(r.data, &r.view, PyBUF_SIMPLE)
+    r.has_view=True
+    base=<char *>r.view.buf
+    if r.view.len<idlist_header:
+      raise ValueError('not an IDList file: %s'%(path,))
+    magic, n=struct.unpack('=8sq', base[:idlist_header])
+    size=r.view.len-idlist_header
+    if n<0 or n>0x7fffffff:
+      raise ValueError('corrupt IDList file: %s'%(path,))
+    if magic==idlist_magic:
+      if size!=n*sizeof(int):
+        raise ValueError('truncated IDList file: %s'%(path,))
+      r.ids=<int *>(base+idlist_header)
+      r.length=n
+    elif magic==idlist_varint_magic:
+      # each value takes at least one byte
+      if n>size:
+        raise ValueError('truncated IDList file: %s'%(path,))
+      ids=<int *>malloc(n*sizeof(int))
+      with nogil:
+        status=decode_deltas(<unsigned char *>base+idlist_header, size,
+                             0, ids, n)
+      PyBuffer_Release(&r.view)
+      r.has_view=False
+      r.data=None
+      if status!=size:
+        free(ids)
+        raise ValueError('corrupt IDList file: %s'%(path,))
+      r.ids=ids
+      r.length=n
+    else:
+      raise ValueError('not an IDList file: %s'%(path,))
+    return r
+  def __reduce__(self):
+    return (IDList, (array.array('i', memoryview(self).cast('B').tobytes()),))
   def __dealloc__(self):
-    if self.ids!=NULL:
+    # ids points into view for IDLists loaded from files
+    if self.has_view:
+      PyBuffer_Release(&self.view)
+    elif self.ids!=NULL:
       free(self.ids)
 
+# PackedIDList stores a sorted list in blocks of PACK_BLOCK values: the
+# first value of each block, and the differences between the following
+# values encoded with encode_deltas. Set operations go through both
+# operands with cursors that decode one block at a time and write the
+# result with an IdBuilder, so that packed lists are never unpacked as
+# a whole.
+cdef enum:
+  PACK_BLOCK=128
+  COMBINE_JOIN=0
+  COMBINE_UNION=1
+  COMBINE_DIFFERENCE=2
+
+# IDLists from PosAttrib.find* with more positions than this are
+# returned as PackedIDList (None: never)
+pack_threshold=None
+
+cdef int decode_block(PackedData *p, int block, int *out) nogil:
+  # decodes a block to out and returns the number of values
+  cdef int n=p.length-block*PACK_BLOCK
+  cdef Py_ssize_t end=p.size
+  if n>PACK_BLOCK:
+    n=PACK_BLOCK
+  if block+1<p.n_blocks:
+    end=p.offsets[block+1]
+  out[0]=p.firsts[block]
+  decode_deltas(p.data+p.offsets[block], end-p.offsets[block],
+                p.firsts[block], out+1, n-1)
+  return n
+
+cdef void unpack_ids(PackedData *p, int *out) nogil:
+  cdef int block
+  for block from 0<=block<p.n_blocks:
+    decode_block(p, block, out+block*PACK_BLOCK)
+
+ctypedef struct IdCursor:
+  # the current value is vals[i] while i<n; packed is NULL for IDLists
+  int *vals
+  int n
+  int i
+  int block
+  PackedData *packed
+  int buf[PACK_BLOCK]
+
+cdef int cursor_init(IdCursor *c, object lst) except -1:
+  c.i=0
+  c.block=0
+  if isinstance(lst, IDList):
+    c.packed=NULL
+    c.vals=(<IDList>lst).ids
+    c.n=(<IDList>lst).length
+  elif isinstance(lst, PackedIDList):
+    c.packed=&(<PackedIDList>lst).p
+    c.vals=c.buf
+    c.n=0
+    if c.packed.n_blocks>0:
+      c.n=decode_block(c.packed, 0, c.buf)
+  else:
+    raise TypeError('expected an IDList or PackedIDList, got %r'%(lst,))
+  return 0
+
+cdef inline void cursor_load(IdCursor *c, int block) nogil:
+  c.block=block
+  c.i=0
+  c.n=decode_block(c.packed, block, c.buf)
+
+cdef inline void cursor_next(IdCursor *c) nogil:
+  c.i+=1
+  if c.i>=c.n and c.packed!=NULL and c.block+1<c.packed.n_blocks:
+    cursor_load(c, c.block+1)
+
+cdef void cursor_skip_to(IdCursor *c, int val) nogil:
+  # moves to the first value >=val
+  cdef int lo, hi, mid
+  if c.i>=c.n or c.vals[c.i]>=val:
+    return
+  if c.packed!=NULL and c.vals[c.n-1]<val:
+    # the last block that starts at or before val (or the next one)
+    lo=c.block+1
+    hi=c.packed.n_blocks
+    if lo>=hi:
+      c.i=c.n
+      return
+    while hi-lo>1:
+      mid=lo+(hi-lo)/2
+      if c.packed.firsts[mid]<=val:
+        lo=mid
+      else:
+        hi=mid
+    cursor_load(c, lo)
+  c.i=gallop(c.vals, c.i, c.n, val)
+  if c.i>=c.n and c.packed!=NULL and c.block+1<c.packed.n_blocks:
+    cursor_load(c, c.block+1)
+
+ctypedef struct IdBuilder:
+  # collects a sorted list of values, either as ints (ids) or packed (p)
+  bint packed
+  int *ids
+  int capacity
+  PackedData p
+  int blocks_capacity
+  Py_ssize_t data_capacity
+  unsigned int prev
+
+cdef void builder_add(IdBuilder *b, int val) nogil:
+  if not b.packed:
+    if b.p.length>=b.capacity:
+      b.capacity=2*b.capacity+16
+      b.ids=<int *>realloc(b.ids, b.capacity*sizeof(int))
+    b.ids[b.p.length]=val
+  elif b.p.length%PACK_BLOCK==0:
+    if b.p.n_blocks>=b.blocks_capacity:
+      b.blocks_capacity=2*b.blocks_capacity+16
+      b.p.firsts=<int *>realloc(b.p.firsts, b.blocks_capacity*sizeof(int))
+      b.p.offsets=<Py_ssize_t *>realloc(b.p.offsets,
+                                        b.blocks_capacity*sizeof(Py_ssize_t))
+    b.p.firsts[b.p.n_blocks]=val
+    b.p.offsets[b.p.n_blocks]=b.p.size
+    b.p.n_blocks+=1
+  else:
+    if b.p.size+5>b.data_capacity:
+      b.data_capacity=2*b.data_capacity+64
+      b.p.data=<unsigned char *>realloc(b.p.data, b.data_capacity)
+    b.p.size+=encode_deltas(&val, 1, b.prev, b.p.data+b.p.size)
+  b.prev=<unsigned int>val
+  b.p.length+=1
+
+cdef object builder_result(IdBuilder *b):
+  cdef IDList lst
+  cdef PackedIDList packed
+  if not b.packed:
+    lst=IDList()
+    lst.ids=b.ids
+    lst.length=b.p.length
+    return lst
+  packed=PackedIDList()
+  packed.p=b.p
+  if packed.p.size<b.data_capacity:
+    packed.p.data=<unsigned char *>realloc(packed.p.data, packed.p.size+1)
+  return packed
+
+cdef object combine_lists(a, b, int op, int offset):
+  # the values v of a for which v+offset is in b (COMBINE_JOIN), the
+  # union or the difference of a and b; the result is packed if the
+  # packed operands are the large ones
+  cdef IdCursor ca, cb
+  cdef IdBuilder out
+  cdef int val
+  if not (isinstance(a, (IDList, PackedIDList)) and
+          isinstance(b, (IDList, PackedIDList))):
+    return NotImplemented
+  memset(&out, 0, sizeof(IdBuilder))
+  cursor_init(&ca, a)
+  cursor_init(&cb, b)
+  if op==COMBINE_JOIN:
+    out.packed=ca.packed!=NULL and cb.packed!=NULL
+  elif op==COMBINE_UNION:
+    out.packed=ca.packed!=NULL or cb.packed!=NULL
+  else:
+    out.packed=ca.packed!=NULL
+  with nogil:
+    if op==COMBINE_JOIN:
+      while ca.i<ca.n and cb.i<cb.n:
+        val=cb.vals[cb.i]-offset
+        if ca.vals[ca.i]<val:
+          cursor_skip_to(&ca, val)
+        elif ca.vals[ca.i]>val:
+          cursor_skip_to(&cb, ca.vals[ca.i]+offset)
+        else:
+          builder_add(&out, val)
+          cursor_next(&ca)
+          cursor_next(&cb)
+    elif op==COMBINE_UNION:
+      while ca.i<ca.n or cb.i<cb.n:
+        if cb.i>=cb.n or (ca.i<ca.n and ca.vals[ca.i]<cb.vals[cb.i]):
+          builder_add(&out, ca.vals[ca.i])
+          cursor_next(&ca)
+        elif ca.i>=ca.n or cb.vals[cb.i]<ca.vals[ca.i]:
+          builder_add(&out, cb.vals[cb.i])
+          cursor_next(&cb)
+        else:
+          builder_add(&out, ca.vals[ca.i])
+          cursor_next(&ca)
+          cursor_next(&cb)
+    else:
+      while ca.i<ca.n:
+        val=ca.vals[ca.i]
+        cursor_skip_to(&cb, val)
+        if cb.i>=cb.n or cb.vals[cb.i]!=val:
+          builder_add(&out, val)
+        cursor_next(&ca)
+  return builder_result(&out)
+
+cdef object pack_large(IDList lst):
+  if pack_threshold is not None and lst.length>pack_threshold:
+    return PackedIDList(lst)
+  return lst
+
+cdef IDList as_idlist(lst, bint none_ok=False):
+  # functions that need the values of a list in memory take both
+  # IDLists and PackedIDLists (as returned by find* for long results)
+  if isinstance(lst, PackedIDList):
+    return (<PackedIDList>lst).unpack()
+  if isinstance(lst, IDList) or (lst is None and none_ok):
+    return lst
+  raise TypeError('expected an IDList, got %s'%(type(lst).__name__,))
+
+cdef class PackedIDList:
+  """a sorted set of numbers like IDList, which takes about a quarter
+     of the memory for lists of frequent items. Supports len(), in,
+     iteration, indexing and the set operations of IDList (also with
+     IDLists) without unpacking the list."""
+  def __cinit__(self, seq=None):
+    cdef IDList lst
+    cdef IdBuilder b
+    cdef int i
+    memset(&self.p, 0, sizeof(PackedData))
+    if seq is None:
+      return
+    lst=seq if isinstance(seq, IDList) else IDList(seq)
+    memset(&b, 0, sizeof(IdBuilder))
+    b.packed=True
+    b.blocks_capacity=(lst.length+PACK_BLOCK-1)/PACK_BLOCK
+    b.p.firsts=<int *>malloc(b.blocks_capacity*sizeof(int))
+    b.p.offsets=<Py_ssize_t *>malloc(b.blocks_capacity*sizeof(Py_ssize_t))
+    with nogil:
+      for i from 0<=i<lst.length:
+        builder_add(&b, lst.ids[i])
+    self.p=b.p
+    self.p.data=<unsigned char *>realloc(self.p.data, self.p.size+1)
+  def __dealloc__(self):
+    free(self.p.firsts)
+    free(self.p.offsets)
+    free(self.p.data)
+  def __len__(self):
+    return self.p.length
+  property nbytes:
+    """the size of the packed data in bytes"""
+    def __get__(self):
+      return (self.p.size+
+              self.p.n_blocks*(sizeof(int)+sizeof(Py_ssize_t)))
+  def __getitem__(self, int i):
+    cdef int buf[PACK_BLOCK]
+    if i<0 or i>=self.p.length:
+      raise IndexError
+    decode_block(&self.p, i/PACK_BLOCK, buf)
+    return buf[i%PACK_BLOCK]
+  def __iter__(self):
+    cdef array.array buf=new_int_array(PACK_BLOCK)
+    cdef int block, i, n
+    for block from 0<=block<self.p.n_blocks:
+      n=decode_block(&self.p, block, buf.data.as_ints)
+      for i from 0<=i<n:
+        yield buf.data.as_ints[i]
+  def __contains__(self, int v):
+    cdef int buf[PACK_BLOCK]
+    cdef int lo=0, hi=self.p.n_blocks, mid, n
+    if hi==0 or v<self.p.firsts[0]:
+      return False
+    while hi-lo>1:
+      mid=lo+(hi-lo)/2
+      if self.p.firsts[mid]<=v:
+        lo=mid
+      else:
+        hi=mid
+    n=decode_block(&self.p, lo, buf)
+    mid=gallop(buf, 0, n, v)
+    return mid<n and buf[mid]==v
+  def __and__(self, other):
+    return combine_lists(self, other, COMBINE_JOIN, 0)
+  def __or__(self, other):
+    return combine_lists(self, other, COMBINE_UNION, 0)
+  def __sub__(self, other):
+    return combine_lists(self, other, COMBINE_DIFFERENCE, 0)
+  cpdef join(self, other, int offset):
+    """like IDList.join"""
+    return combine_lists(self, other, COMBINE_JOIN, offset)
+  cpdef IDList unpack(self):
+    """returns the values as an IDList"""
+    return IDList(self)
+  def __reduce__(self):
+    return (PackedIDList, (self.unpack(),))
+
+# association measures for collocations, computed from the contingency
+# table of the collocate's frequency in the node's context windows (o11),
+# the total size of the context windows (r1), the collocate's corpus
+# frequency (c1) and the corpus size (n)
+association_measures=['log_likelihood', 'mi', 't_score', 'frequency']
+
+ctypedef struct ScoredId:
+  double score
+  int tagid
+  int count
+
+cdef int compare_scores(const void *a, const void *b) nogil:
+  cdef ScoredId *x=<ScoredId *>a
+  cdef ScoredId *y=<ScoredId *>b
+  if x.score>y.score:
+    return -1
+  elif x.score<y.score:
+    return 1
+  return (x.tagid>y.tagid)-(x.tagid<y.tagid)
+
+cdef inline double xlogx(double o, double e) nogil:
+  if o<=0:
+    return 0.0
+  return o*log(o/e)
+
+cdef double association(int measure, double o11, double r1, double c1, double n) nogil:
+  cdef double e11=r1*c1/n, g2
+  if measure==0:
+    g2=2*(xlogx(o11, e11)+xlogx(r1-o11, r1*(n-c1)/n)+
+          xlogx(c1-o11, (n-r1)*c1/n)+xlogx(n-r1-c1+o11, (n-r1)*(n-c1)/n))
+    return g2 if o11>=e11 else -g2
+  elif measure==1:
+    return log(o11/e11)/log(2.0)
+  elif measure==2:
+    return (o11-e11)/sqrt(o11)
+  return o11
+
+# n-gram counting: the ids of an n-gram are packed into a 128-bit key
+# (hi, lo) with *bits* bits per id, the first id in the highest bits,
+# so that sorting the keys sorts the n-grams lexicographically. Counts
+# are written as sorted runs to files (a 32-byte header with magic, n,
+# bits and the number of records, followed by NGramCount records),
+# which can then be merged.
+cdef bytes ngram_magic=b'CWBNGRM1'
+cdef int ngram_header=32
+
+cdef int compare_ngrams(const void *a, const void *b) nogil:
+  cdef NGramCount *x=<NGramCount *>a
+  cdef NGramCount *y=<NGramCount *>b
+  if x.hi!=y.hi:
+    return -1 if x.hi<y.hi else 1
+  if x.lo!=y.lo:
+    return -1 if x.lo<y.lo else 1
+  return 0
+
+cdef inline bint same_ngram(NGramCount *x, NGramCount *y) nogil:
+  return x.hi==y.hi and x.lo==y.lo
+
+def ngram_bits(int n_ids):
+  """number of bits needed to store one id for a lexicon of n_ids values"""
+  cdef int bits=1
+  while (1<<bits)<n_ids:
+    bits+=1
+  return bits
+
+cdef object write_ngram_run(path, int n, int bits, NGramCount *recs, Py_ssize_t k):
+  # sorts the records, merges duplicates and writes them to path
+  cdef Py_ssize_t i, m=0
+  qsort(recs, k, sizeof(NGramCount), compare_ngrams)
+  for i from 0<=i<k:
+    if m>0 and same_ngram(&recs[m-1], &recs[i]):
+      recs[m-1].count+=recs[i].count
+    else:
+      recs[m]=recs[i]
+      m+=1
+  with open(path, 'wb') as f_out:
+    f_out.write(struct.pack('=8sqqq', ngram_magic, n, bits, m))
+    f_out.write((<char *>recs)[:m*sizeof(NGramCount)])
+  return path
+
+cdef class NGramTable:
+  """a sorted table of n-gram counts, as written by
+     PosAttrib.count_ngrams and merge_ngram_runs"""
+  def __cinit__(self, path):
+    cdef char *base
+    self.path=path
+    self.data=map_file(path)
+    PyObject_GetBuffer(self.data, &self.view, PyBUF_SIMPLE)
+    self.has_view=True
+    base=<char *>self.view.buf
+    if self.view.len<ngram_header or base[:8]!=ngram_magic:
+      raise ValueError('not an n-gram table: %s'%(path,))
+    _, self.n, self.bits, self.length=struct.unpack('=8sqqq', base[:32])
+    if self.view.len!=ngram_header+self.length*sizeof(NGramCount):
+      raise ValueError('truncated n-gram table: %s'%(path,))
+    self.recs=<NGramCount *>(base+ngram_header)
+  def __dealloc__(self):
+    if self.has_view:
+      PyBuffer_Release(&self.view)
+  def __len__(self):
+    return self.length
+  cdef tuple unpack(self, Py_ssize_t i):
+    cdef unsigned long long hi=self.recs[i].hi, lo=self.recs[i].lo
+    cdef unsigned long long mask=(1ULL<<self.bits)-1
+    cdef int j
+    cdef list ids=[0]*self.n
+    for j from self.n>j>=0:
+      ids[j]=<int>(lo&mask)
+      lo=(lo>>self.bits)|(hi<<(64-self.bits))
+      hi>>=self.bits
+    return tuple(ids)
+  def __getitem__(self, Py_ssize_t i):
+    if i<0 or i>=self.length:
+      raise IndexError
+    return (self.unpack(i), self.recs[i].count)
+  def __iter__(self):
+    """iterates over (id tuple, count) pairs in lexicographic order"""
+    cdef Py_ssize_t i
+    for i from 0<=i<self.length:
+      yield (self.unpack(i), self.recs[i].count)
+
+def merge_ngram_runs(paths, out_path, long long min_count=1):
+  """merges the sorted runs in *paths* into a single n-gram table
+     at *out_path*, leaving out n-grams with fewer than *min_count*
+     occurrences. Returns the merged NGramTable."""
+  cdef list runs=[NGramTable(path) for path in paths]
+  cdef int n_runs=len(runs), i, j, top, child
+  cdef NGramCount **heads=NULL
+  cdef NGramCount **ends=NULL
+  cdef NGramCount *tmp
+  cdef NGramCount *out=NULL
+  cdef NGramCount cur
+  cdef Py_ssize_t k=0, total=0, buf_size=1<<16
+  cdef NGramTable run
+  cdef bint have_cur=False
+  if not runs:
+    raise ValueError('no n-gram runs to merge')
+  n=runs[0].n
+  bits=runs[0].bits
+  try:
+    heads=<NGramCount **>malloc(n_runs*sizeof(NGramCount *))
+    ends=<NGramCount **>malloc(n_runs*sizeof(NGramCount *))
+    out=<NGramCount *>malloc(buf_size*sizeof(NGramCount))
+    j=0
+    for i from 0<=i<n_runs:
+      run=runs[i]
+      if run.n!=n or run.bits!=bits:
+        raise ValueError('n-gram runs do not match')
+      if run.length>0:
+        heads[j]=run.recs
+        ends[j]=run.recs+run.length
+        j+=1
+    n_runs=j
+    # make a heap of run cursors, ordered by their current key
+    for i from n_runs/2>i>=0:
+      top=i
+      while True:
+        child=2*top+1
+        if child>=n_runs:
+          break
+        if child+1<n_runs and compare_ngrams(heads[child+1], heads[child])<0:
+          child+=1
+        if compare_ngrams(heads[top], heads[child])<=0:
+          break
+        tmp=heads[top]; heads[top]=heads[child]; heads[child]=tmp
+        tmp=ends[top]; ends[top]=ends[child]; ends[child]=tmp
+        top=child
+    with open(out_path, 'wb') as f_out:
+      f_out.write(b'\0'*ngram_header)
+      while n_runs>0 or have_cur:
+        if n_runs>0 and have_cur and same_ngram(&cur, heads[0]):
+          cur.count+=heads[0].count
+        else:
+          if have_cur and cur.count>=min_count:
+            out[k]=cur
+            k+=1
+            if k==buf_size:
+              f_out.write((<char *>out)[:k*sizeof(NGramCount)])
+              total+=k
+              k=0
+          if n_runs==0:
+            break
+          cur=heads[0][0]
+          have_cur=True
+        heads[0]+=1
+        if heads[0]==ends[0]:
+          n_runs-=1
+          heads[0]=heads[n_runs]
+          ends[0]=ends[n_runs]
+        top=0
+        while True:
+          child=2*top+1
+          if child>=n_runs:
+            break
+          if child+1<n_runs and compare_ngrams(heads[child+1], heads[child])<0:
+            child+=1
+          if compare_ngrams(heads[top], heads[child])<=0:
+            break
+          tmp=heads[top]; heads[top]=heads[child]; heads[child]=tmp
+          tmp=ends[top]; ends[top]=ends[child]; ends[child]=tmp
+          top=child
+      f_out.write((<char *>out)[:k*sizeof(NGramCount)])
+      total+=k
+      f_out.seek(0)
+      f_out.write(struct.pack('=8sqqq', ngram_magic, n, bits, total))
+  finally:
+    free(heads)
+    free(ends)
+    free(out)
+  return NGramTable(out_path)
+
 cdef class AttrDictionary
 
+cdef class PatternCache:
+  """keeps the results of regular expression lookups (the matching
+     lexicon ids and the corpus positions) for repeated patterns,
+     dropping the least recently used ones when their total size
+     exceeds max_bytes"""
+  cdef object entries
+  cdef Py_ssize_t limit
+  cdef readonly Py_ssize_t size
+  cdef readonly long long hits
+  cdef readonly long long misses
+  def __cinit__(self, max_bytes=64<<20):
+    self.entries=OrderedDict()
+    self.limit=max_bytes
+  property max_bytes:
+    def __get__(self):
+      return self.limit
+    def __set__(self, Py_ssize_t max_bytes):
+      self.limit=max_bytes
+      if max_bytes<=0:
+        self.clear()
+      else:
+        self.shrink(max_bytes)
+  def __len__(self):
+    return len(self.entries)
+  cdef object get(self, key):
+    cdef object result=self.entries.get(key)
+    if result is None:
+      self.misses+=1
+    else:
+      self.hits+=1
+      self.entries.move_to_end(key)
+    return result
+  cdef put(self, key, lst):
+    cdef Py_ssize_t nbytes
+    if self.limit<=0 or key in self.entries:
+      return
+    nbytes=list_nbytes(lst)
+    if nbytes>self.limit:
+      return
+    self.shrink(self.limit-nbytes)
+    self.entries[key]=lst
+    self.size+=nbytes
+  cdef shrink(self, Py_ssize_t max_bytes):
+    while self.size>max_bytes and self.entries:
+      self.size-=list_nbytes(self.entries.popitem(last=False)[1])
+  def clear(self, attribute=None):
+    """removes all entries, or only those for *attribute* (a PosAttrib)"""
+    cdef PosAttrib att
+    if attribute is None:
+      self.entries.clear()
+      self.size=0
+      return
+    att=attribute
+    prefix=pattern_key(att)
+    for key in [k for k in self.entries if k[:3]==prefix]:
+      self.size-=list_nbytes(self.entries.pop(key))
+  def stats(self):
+    """returns a dict with the number of hits, misses and entries,
+       and the size of the cached IDLists in bytes"""
+    return {'hits': self.hits, 'misses': self.misses,
+            'entries': len(self.entries), 'bytes': self.size,
+            'max_bytes': self.limit}
+
+pattern_cache=PatternCache()
+
+cdef Py_ssize_t list_nbytes(lst):
+  if isinstance(lst, PackedIDList):
+    return lst.nbytes
+  return (<IDList>lst).length*sizeof(int)
+
+cdef inline tuple pattern_key(PosAttrib att):
+  return (att.parent.registry_dir, att.parent.name, att.attname)
+
+cdef IDList matching_id_list(PosAttrib att, bytes pat_s, int flags):
+  # the lexicon ids matching pat_s, going through the pattern cache
+  cdef PatternCache cache=pattern_cache
+  cdef tuple key=pattern_key(att)+('ids', pat_s, flags)
+  cdef IDList lst=cache.get(key)
+  cdef char *pat_c=pat_s
+  if lst is None:
+    if flags==0:
+      lst=lexicon_lookup(att, pat_s)
+    elif flags&~(IGNORE_CASE|IGNORE_DIAC)==0:
+      affixes=pattern_affixes(att.parent.to_unicode(pat_s))
+      if affixes is not None and affixes[2]=='exact':
+        lst=folded_ids(att, affixes[0], flags)
+    if lst is None:
+      att.ensure_loaded(LOAD_LEXICON)
+      lst=IDList()
+      with nogil:
+        lst.ids=matching_ids(att.att, pat_c, flags, &lst.length)
+    cache.put(key, lst)
+  return lst
+
+def fold_value(s, int flags):
+  """folds the unicode string *s* for lookups with IGNORE_CASE
+     and/or IGNORE_DIAC in *flags*"""
+  if flags&IGNORE_CASE:
+    s=s.casefold() if PY_MAJOR_VERSION>=3 else s.lower()
+  if flags&IGNORE_DIAC:
+    s=unicodedata.normalize('NFC', u''.join([
+      c for c in unicodedata.normalize('NFD', s)
+      if not unicodedata.combining(c)]))
+  return s
+
+cdef IDList folded_ids(PosAttrib att, tag, int flags):
+  # the ids of the values that are equal to tag after folding
+  cdef ValueIndex index=att.folded_index(flags)
+  cdef bytes key=fold_value(att.parent.to_unicode(tag), flags).encode('utf-8')
+  if key in index:
+    return index[key]
+  return IDList()
+
+cdef void cpos2id_range(c_Attribute *att, int start, int stop, int *out) nogil:
+  cdef int i
+  for i from start<=i<stop:
+    out[i-start]=cl_cpos2id(att,i)
+
+cdef int cpos2id_list(c_Attribute *att, int *stream, int *pos, Py_ssize_t n,
+                      int max_cpos, int *out) nogil:
+  # returns -1 if one of the positions is out of bounds; reads the
+  # ids from stream (an id index) unless it is NULL
+  cdef Py_ssize_t i
+  for i from 0<=i<n:
+    if pos[i]<0 or pos[i]>=max_cpos:
+      return -1
+    if stream!=NULL:
+      out[i]=stream[pos[i]]
+    else:
+      out[i]=cl_cpos2id(att,pos[i])
+  return 0
+
+cdef int filter_by_ids(c_Attribute *att, int *pos, int n, int max_cpos,
+                       char *member, int *out) nogil:
+  # copies the positions whose id is marked in member to out and returns
+  # their number, or -1 if one of the positions is out of bounds
+  cdef int i, k=0
+  for i from 0<=i<n:
+    if pos[i]<0 or pos[i]>=max_cpos:
+      return -1
+    if member[cl_cpos2id(att,pos[i])]:
+      out[k]=pos[i]
+      k+=1
+  return k
+
+cdef long long count_window_ids(c_Attribute *att, int *hits, int n_hits,
+                                int left, int right, int max_cpos,
+                                bint use_regions, int *reg_starts,
+                                int *reg_ends, int n_regions,
+                                int *counts, int *touched, int *n_touched) nogil:
+  # counts the ids in the windows around hits (see PosAttrib.collocates)
+  # and returns the total size of the windows
+  cdef int i, j=0, k=0, h, lo, hi, p, tagid, covered=-1
+  cdef long long window_size=0
+  for i from 0<=i<n_hits:
+    h=hits[i]
+    lo=h-left
+    hi=h+right
+    if use_regions:
+      k=gallop(reg_ends, k, n_regions, h)
+      if k>=n_regions or reg_starts[k]>h:
+        continue
+      if lo<reg_starts[k]:
+        lo=reg_starts[k]
+      if hi>reg_ends[k]:
+        hi=reg_ends[k]
+    # overlapping windows count each position only once
+    if lo<covered+1:
+      lo=covered+1
+    if lo<0:
+      lo=0
+    if hi>=max_cpos:
+      hi=max_cpos-1
+    for p from lo<=p<=hi:
+      # node positions are not counted as collocates
+      while j<n_hits and hits[j]<p:
+        j+=1
+      if j<n_hits and hits[j]==p:
+        continue
+      tagid=cl_cpos2id(att,p)
+      if counts[tagid]==0:
+        touched[n_touched[0]]=tagid
+        n_touched[0]+=1
+      counts[tagid]+=1
+      window_size+=1
+    if hi>covered:
+      covered=hi
+  return window_size
+
 cdef class PosAttrib:
   def __repr__(self):
     return "CWB.Attribute(%s,'%s')"%(self.parent,self.attname)
@@ -224,49 +1424,297 @@ cdef class PosAttrib:
     self.att=cl_new_attribute(parent.corpus,attname,ATT_POS)
     if self.att==NULL:
       raise KeyError
+  cdef int ensure_loaded(self, int components) except -1:
+    # loads the given components (LOAD_*) while holding the GIL
+    cdef int n
+    cdef object home
+    components&=~self.loaded
+    if components&LOAD_CORPUS:
+      if cl_max_cpos(self.att)>0:
+        cl_cpos2id(self.att,0)
+      home=corpus_data_dir(self.parent)
+      self.release_gil=(home is not None and not
+                        os.path.exists(os.path.join(home, native_name(self.attname)+'.huf')))
+    if components&LOAD_LEXICON:
+      if cl_max_id(self.att)>0:
+        cl_id2str(self.att,0)
+      cl_str2id(self.att,"")
+    if components&LOAD_REVCORP:
+      if cl_max_id(self.att)>0:
+        free(cl_id2cpos(self.att,0,&n))
+    if components&LOAD_FREQS:
+      if cl_max_id(self.att)>0:
+        cl_id2freq(self.att,0)
+    self.loaded|=components
+    return 0
+  cdef int fill_ids(self, int start, int stop, int *out) except -1:
+    self.ensure_loaded(LOAD_CORPUS)
+    if self.id_stream!=NULL:
+      with nogil:
+        memcpy(out, self.id_stream+start, (stop-start)*sizeof(int))
+    elif self.release_gil:
+      with nogil:
+        cpos2id_range(self.att, start, stop, out)
+    else:
+      cpos2id_range(self.att, start, stop, out)
+    return 0
+  def __dealloc__(self):
+    if self.has_id_view:
+      PyBuffer_Release(&self.id_view)
+  def __reduce__(self):
+    return (PosAttrib, (self.parent, self.attname))
+  cdef object positions_for(self, IDList ids):
+    cdef IDList lst=IDList()
+    self.ensure_loaded(LOAD_REVCORP)
+    with nogil:
+      lst.ids=cl_idlist2cpos(self.att, ids.ids, ids.length, 1, &lst.length)
+    return pack_large(lst)
   def getName(self):
     return self.attname
   def getDictionary(self):
     return AttrDictionary(self)
+  def id_index(self, build=True):
+    """returns the ids of all corpus positions as a read-only
+       memoryview of C ints, mapped from an index file that is built
+       with a sequential scan on first use and stored next to the corpus
+       data. With build=False, an existing index is used, or None is
+       returned. While the index is open, ids, ids_at, cpos2id and scan
+       read from it instead of decoding the corpus stream."""
+    cdef object data
+    cdef int n=cl_max_cpos(self.att)
+    if not self.has_id_view:
+      base=native_name(self.attname)
+      fname=base+'.ids.idx'
+      sources=[base+ext for ext in ('.corpus', '.huf', '.hcd', '.huf.syn')]
+      data=index_file(self.parent, fname, sources)
+      if data is None and build:
+        data=store_index_file(self.parent, fname,
+                              functools.partial(_id_index_chunks, self))
+      if data is None:
+        return None
+      PyObject_GetBuffer(data, &self.id_view, PyBUF_SIMPLE)
+      if (self.id_view.len!=id_index_header+n*sizeof(int) or
+          (<char *>self.id_view.buf)[:8]!=id_index_magic):
+        PyBuffer_Release(&self.id_view)
+        raise ValueError('invalid id index for %s'%(self.attname,))
+      self.has_id_view=True
+      self.id_data=data
+      self.id_stream=<int *>(<char *>self.id_view.buf+id_index_header)
+    return memoryview(self.id_data)[id_index_header:].cast('i')
+  def scan(self, int start=0, stop=None, int chunk_size=1<<16, id_index=False):
+    """returns a ScanCursor over the ids of the corpus positions
+       start..stop-1 (by default, up to the end of the corpus), which
+       reads them in chunks of *chunk_size* ids. With id_index=True, the
+       id index is built (see id_index) if it does not exist yet."""
+    if stop is None:
+      stop=cl_max_cpos(self.att)
+    self.id_index(build=id_index)
+    return ScanCursor(self, start, stop, chunk_size)
+  def lexicon_index(self, build=True):
+    """returns the LexiconIndex for this attribute, which find_pattern
+       uses for patterns with a literal prefix or suffix. It is built
+       on first use and stored next to the corpus data; with
+       build=False, an existing index is used, or None is returned."""
+    cdef object data
+    if self.sorted_lexicon is None and (build or not self.sorted_lexicon_checked):
+      self.sorted_lexicon_checked=True
+      base=native_name(self.attname)
+      fname=base+'.lexsort.idx'
+      sources=[base+ext for ext in ('.lexicon', '.lexicon.idx')]
+      data=index_file(self.parent, fname, sources)
+      if data is None and build:
+        data=store_index_file(self.parent, fname, build_lexicon_index(self))
+      if data is not None:
+        self.sorted_lexicon=LexiconIndex(self, data)
+    return self.sorted_lexicon
+  def folded_index(self, int flags=IGNORE_CASE|IGNORE_DIAC):
+    """returns a ValueIndex that maps the values of this attribute,
+       folded with fold_value(value, flags) and encoded as UTF-8, to
+       their ids. It is built on first use and stored next to the
+       corpus data."""
+    cdef ValueIndex index
+    cdef object data
+    cdef int i
+    if self.folded_indices is None:
+      self.folded_indices={}
+    index=self.folded_indices.get(flags)
+    if index is None:
+      base=native_name(self.attname)
+      fname='%s.fold%d.idx'%(base, flags)
+      sources=[base+ext for ext in ('.lexicon', '.lexicon.idx')]
+      data=index_file(self.parent, fname, sources)
+      if data is None:
+        self.ensure_loaded(LOAD_LEXICON)
+        data=build_value_index([
+          fold_value(self.parent.decode_c(cl_id2str(self.att,i)),
+                     flags).encode('utf-8')
+          for i in range(cl_max_id(self.att))])
+        data=store_index_file(self.parent, fname, data)
+      index=ValueIndex(data)
+      self.folded_indices[flags]=index
+    return index
+  def cache_lexicon(self, maxsize=None):
+    """keeps decoded attribute values around so that they are
+       only decoded once. With maxsize=None (or a maxsize that is
+       at least the size of the lexicon), all values are kept;
+       otherwise, the maxsize most recently used ones are kept.
+       maxsize=0 switches the cache off."""
+    cdef int n_ids=cl_max_id(self.att)
+    self.lexicon_cache=None
+    self.lexicon_lru=None
+    if maxsize is None or maxsize>=n_ids:
+      self.lexicon_cache=[None]*n_ids
+    elif maxsize>0:
+      self.lexicon_lru=OrderedDict()
+      self.lexicon_lru_size=maxsize
+  cdef object id2value(self, int tagid):
+    # decoded value for tagid, going through the lexicon cache if enabled
+    cdef object val
+    if self.lexicon_cache is not None:
+      val=self.lexicon_cache[tagid]
+      if val is None:
+        val=self.decode(cl_id2str(self.att, tagid))
+        self.lexicon_cache[tagid]=val
+      return val
+    elif self.lexicon_lru is not None:
+      val=self.lexicon_lru.get(tagid)
+      if val is None:
+        val=self.decode(cl_id2str(self.att, tagid))
+        self.lexicon_lru[tagid]=val
+        if len(self.lexicon_lru)>self.lexicon_lru_size:
+          self.lexicon_lru.popitem(last=False)
+      else:
+        self.lexicon_lru.move_to_end(tagid)
+      return val
+    return self.decode(cl_id2str(self.att, tagid))
+  cdef object decode(self, const char *s):
+    if PY_MAJOR_VERSION >= 3:
+      return self.parent.decode_c(s)
+    else:
+      return s
   def __getitem__(self,offset):
     cdef int i
-    cdef bytes _result
+    cdef Corpus corpus=self.parent
+    cdef bint cached=(self.lexicon_cache is not None or
+                      self.lexicon_lru is not None)
     if isinstance(offset,int):
       if offset<0 or offset>=len(self):
         raise IndexError('P-attribute offset out of bounds')
-      _result = cl_cpos2str(self.att, offset)
+      if cached:
+        return self.id2value(cl_cpos2id(self.att, offset))
       if PY_MAJOR_VERSION >= 3:
-          return self.parent.to_unicode(_result)
+          return corpus.decode_c(cl_cpos2str(self.att, offset))
       else:
-          return _result
+          return cl_cpos2str(self.att, offset)
     else:
       result=[]
       if offset.start<0 or offset.stop<offset.start or offset.stop>len(self):
         raise IndexError('P-attribute offset out of bounds')
-      if PY_MAJOR_VERSION >= 3:
+      if cached:
         for i from offset.start<=i<offset.stop:
-            _result = cl_cpos2str(self.att, i)
-            result.append(self.parent.to_unicode(_result))
+            result.append(self.id2value(cl_cpos2id(self.att, i)))
+      elif PY_MAJOR_VERSION >= 3:
+        for i from offset.start<=i<offset.stop:
+            result.append(corpus.decode_c(cl_cpos2str(self.att, i)))
       else:
         for i from offset.start<=i<offset.stop:
             result.append(cl_cpos2str(self.att,i))
       return result
   cpdef cpos2id(self,int offset):
+    if self.id_stream!=NULL and 0<=offset<cl_max_cpos(self.att):
+      return self.id_stream[offset]
     return cl_cpos2id(self.att,offset)
-  def find(self,tag):
+  cpdef array.array ids(self, int start, int stop):
+    """returns the ids for corpus positions start..stop-1
+       as an array.array('i')"""
+    cdef array.array result
+    if start<0 or stop<start or stop>len(self):
+      raise IndexError('P-attribute offset out of bounds')
+    result=new_int_array(stop-start)
+    self.fill_ids(start, stop, result.data.as_ints)
+    return result
+  def ids_at(self, positions):
+    """returns the ids at the given corpus positions (an IDList or
+       a buffer of C ints) as an array.array('i')"""
+    cdef array.array result
+    cdef Py_buffer view
+    cdef int *pos
+    cdef int *out
+    cdef Py_ssize_t n
+    cdef int status
+    cdef int max_cpos=cl_max_cpos(self.att)
+    self.ensure_loaded(LOAD_CORPUS)
+    acquire_int_buffer(positions, &view)
+    try:
+      n=view.len/sizeof(int)
+      pos=<int *>view.buf
+      result=new_int_array(n)
+      out=result.data.as_ints
+      if self.release_gil or self.id_stream!=NULL:
+        with nogil:
+          status=cpos2id_list(self.att, self.id_stream, pos, n, max_cpos, out)
+      else:
+        status=cpos2id_list(self.att, NULL, pos, n, max_cpos, out)
+    finally:
+      PyBuffer_Release(&view)
+    if status<0:
+      raise IndexError('P-attribute offset out of bounds')
+    return result
+  def values_for(self, ids):
+    """returns the (decoded) values for the given lexicon ids
+       (an IDList or a buffer of C ints) as a list"""
+    cdef Py_buffer view
+    cdef int *tagids
+    cdef Py_ssize_t i, n
+    cdef int n_ids=cl_max_id(self.att)
+    cdef dict cache={}
+    cdef list result
+    self.ensure_loaded(LOAD_LEXICON)
+    acquire_int_buffer(ids, &view)
+    try:
+      n=view.len/sizeof(int)
+      tagids=<int *>view.buf
+      for i from 0<=i<n:
+        if tagids[i]<0 or tagids[i]>=n_ids:
+          raise IndexError('lexicon id out of bounds')
+      result=[attr_value(self, tagids[i], cache) for i in range(n)]
+    finally:
+      PyBuffer_Release(&view)
+    return result
+  def values_at(self, positions):
+    """returns the (decoded) values at the given corpus positions
+       (an IDList or a buffer of C ints) as a list"""
+    return self.values_for(self.ids_at(positions))
+  def find(self,tag,int flags=0):
     cdef int tagid
     cdef IDList lst
     cdef bytes tag_s=self.parent.to_str(tag)
-    tagid=cl_str2id(self.att,tag_s)
+    cdef char *tag_c=tag_s
+    if flags:
+      lst=folded_ids(self, tag, flags)
+      if lst.length==0:
+        raise KeyError
+      return self.positions_for(lst)
+    self.ensure_loaded(LOAD_LEXICON|LOAD_REVCORP)
+    lst=IDList()
+    with nogil:
+      tagid=cl_str2id(self.att,tag_c)
+      if tagid>=0:
+        lst.ids=cl_id2cpos(self.att,tagid,&lst.length)
     if tagid<0:
       raise KeyError
-    lst=IDList()
-    lst.ids=cl_id2cpos(self.att,tagid,&lst.length)
-    return lst
-  def find_list(self, tags):
+    return pack_large(lst)
+  def find_list(self, tags, int flags=0):
+    return self.positions_for(self.lexicon_ids(tags, flags))
+  def lexicon_ids(self, tags, int flags=0):
+    """returns an IDList with the lexicon ids of the values in *tags*
+       (or of the values that are equal to one of them after folding,
+       if *flags* are given)"""
     cdef int tagid
     cdef bytes tag_s
-    cdef IDList lst, lst_result
+    if flags:
+      return IDList.union_all([folded_ids(self, tag, flags) for tag in tags])
+    self.ensure_loaded(LOAD_LEXICON)
     ids_set=set()
     for tag in tags:
       tag_s=self.parent.to_str(tag)
@@ -274,27 +1722,498 @@ cdef class PosAttrib:
       if tagid<0:
         continue
       ids_set.add(tagid)
-    lst=IDList(sorted(ids_set))
-    lst_result=IDList()
-    lst_result.ids=cl_idlist2cpos(self.att, lst.ids, lst.length, 1, &lst_result.length)
-    return lst_result
-  def find_pattern(self, pat, flags=0):
-    cdef IDList lst, lst_result
+    return IDList(sorted(ids_set))
+  def find_ids(self, ids):
+    """returns an IDList with the positions of all tokens whose
+       value has one of the lexicon ids in *ids*"""
+    return self.positions_for(as_idlist(ids))
+  def filter_positions(self, positions, ids, bint negate=False):
+    """returns an IDList with those corpus positions from *positions*
+       whose value has one of the lexicon ids in *ids* (or none of them,
+       with negate=True). This reads the values at the given positions
+       and is cheaper than find_ids when there are few positions."""
+    cdef int n_ids=cl_max_id(self.att), i
+    cdef char *member
+    cdef IDList result=IDList()
+    cdef IDList pos_list=as_idlist(positions), id_list=as_idlist(ids)
+    self.ensure_loaded(LOAD_CORPUS)
+    member=<char *>malloc(n_ids)
+    for i from 0<=i<n_ids:
+      member[i]=negate
+    for i from 0<=i<id_list.length:
+      if id_list.ids[i]<0 or id_list.ids[i]>=n_ids:
+        free(member)
+        raise IndexError('lexicon id out of bounds')
+      member[id_list.ids[i]]=not negate
+    result.ids=<int *>malloc(pos_list.length*sizeof(int))
+    if self.release_gil:
+      with nogil:
+        result.length=filter_by_ids(self.att, pos_list.ids, pos_list.length,
+                                    cl_max_cpos(self.att), member, result.ids)
+    else:
+      result.length=filter_by_ids(self.att, pos_list.ids, pos_list.length,
+                                  cl_max_cpos(self.att), member, result.ids)
+    free(member)
+    if result.length<0:
+      result.length=0
+      raise IndexError('P-attribute offset out of bounds')
+    return result
+  def find_pattern(self, pat, int flags=0):
+    """returns an IDList with the positions of all values matching
+       the regular expression *pat*. Results are kept in the
+       pattern_cache."""
+    cdef IDList lst
+    cdef object lst_result
     cdef bytes pat_s=self.parent.to_str(pat)
-    lst=IDList()
-    lst.ids=collect_matching_ids(self.att, pat_s, flags, &lst.length)
-    lst_result=IDList()
-    lst_result.ids=cl_idlist2cpos(self.att, lst.ids, lst.length, 1, &lst_result.length)
+    cdef PatternCache cache=pattern_cache
+    cdef tuple key=pattern_key(self)+('cpos', pat_s, flags)
+    lst_result=cache.get(key)
+    if lst_result is not None:
+      return lst_result
+    lst=matching_id_list(self, pat_s, flags)
+    lst_result=self.positions_for(lst)
+    cache.put(key, lst_result)
     return lst_result
+  def cursor(self, tag, int flags=0):
+    """returns a PositionCursor over the positions of the value *tag*
+       (like find, but reading the positions as they are needed)"""
+    cdef int tagid
+    cdef bytes tag_s
+    if flags:
+      return PositionCursor(self, folded_ids(self, tag, flags))
+    tag_s=self.parent.to_str(tag)
+    tagid=cl_str2id(self.att,tag_s)
+    if tagid<0:
+      raise KeyError
+    return PositionCursor(self, IDList([tagid]))
+  def cursor_list(self, tags, int flags=0):
+    """returns a PositionCursor over the positions of the values in
+       *tags* (like find_list)"""
+    return PositionCursor(self, self.lexicon_ids(tags, flags))
+  def cursor_ids(self, ids):
+    """returns a PositionCursor over the positions of the lexicon
+       ids in *ids* (like find_ids)"""
+    return PositionCursor(self, ids)
+  def cursor_pattern(self, pat, int flags=0):
+    """returns a PositionCursor over the positions of the values
+       matching the regular expression *pat* (like find_pattern)"""
+    return PositionCursor(self, matching_id_list(self, self.parent.to_str(pat),
+                                                 flags))
   def frequency(self, tag):
     cdef bytes tag_s=self.parent.to_str(tag)
     cdef int tagid=cl_str2id(self.att,tag_s)
     if tagid<0:
       raise KeyError(cdperror_string(tagid))
     return cl_id2freq(self.att,tagid)
+  def frequency_by_id(self, int tagid):
+    if tagid<0 or tagid>=cl_max_id(self.att):
+      raise IndexError('lexicon id out of bounds')
+    if self.freqs is not None:
+      return self.freqs.data.as_ints[tagid]
+    return cl_id2freq(self.att,tagid)
+  def total_frequency(self, ids):
+    """returns the sum of the frequencies of the lexicon ids in *ids*"""
+    cdef IDList id_list=as_idlist(ids)
+    cdef array.array freqs=self.frequencies()
+    cdef int n_ids=len(freqs), i
+    cdef long long total=0
+    for i from 0<=i<id_list.length:
+      if id_list.ids[i]<0 or id_list.ids[i]>=n_ids:
+        raise IndexError('lexicon id out of bounds')
+      total+=freqs.data.as_ints[id_list.ids[i]]
+    return total
+  def frequencies(self, persist=False):
+    """returns an array.array('i') with the frequencies of all
+       attribute values, indexed by their id. The array is cached
+       and shared, and should not be modified. With persist=True,
+       it is also stored in an index file next to the corpus data."""
+    cdef int i, n
+    cdef array.array freqs
+    cdef object data
+    if self.freqs is None:
+      n=cl_max_id(self.att)
+      base=native_name(self.attname)
+      fname=base+'.cnt.idx'
+      sources=[base+ext for ext in ('.corpus.cnt', '.lexicon')]
+      data=index_file(self.parent, fname, sources) if persist else None
+      # a file that does not match the lexicon is rebuilt
+      if data is not None and not valid_freq_index(data, n):
+        data=None
+      if data is not None:
+        freqs=array.array('i')
+        freqs.frombytes(memoryview(data)[freq_index_header:])
+      else:
+        self.ensure_loaded(LOAD_FREQS)
+        freqs=new_int_array(n)
+        with nogil:
+          for i from 0<=i<n:
+            freqs.data.as_ints[i]=cl_id2freq(self.att,i)
+        if persist:
+          store_index_file(self.parent, fname,
+                           struct.pack('=8sq', freq_index_magic, n)+
+                           freqs.tobytes())
+      self.freqs=freqs
+    return self.freqs
+  def collocates(self, hits, int left=5, int right=5,
+                 AttStruc within=None, measure='log_likelihood',
+                 int min_count=1):
+    """counts the values of this attribute in a window of *left* and
+       *right* tokens around each position in *hits* (not crossing the
+       boundaries of *within*, if given), and scores them with one of
+       the association_measures. Returns three arrays with the ids,
+       the scores and the co-occurrence counts of the collocates,
+       sorted by descending score."""
+    cdef int n_ids=cl_max_id(self.att), max_cpos=cl_max_cpos(self.att)
+    cdef int *counts
+    cdef int *touched
+    cdef int *reg_starts=NULL
+    cdef int *reg_ends=NULL
+    cdef int n_regions=0, n_touched=0, n_scored=0
+    cdef int i, tagid, m
+    cdef long long window_size
+    cdef bint use_regions
+    cdef ScoredId *scored
+    cdef IDList hit_list=as_idlist(hits)
+    cdef array.array freqs, ids_out, counts_out, scores_out
+    if measure not in association_measures:
+      raise ValueError('unknown association measure: %s'%(measure,))
+    m=association_measures.index(measure)
+    freqs=self.frequencies()
+    if within is not None:
+      within.load_regions()
+      reg_starts=within.starts.data.as_ints
+      reg_ends=within.ends.data.as_ints
+      n_regions=len(within.starts)
+    self.ensure_loaded(LOAD_CORPUS)
+    counts=<int *>malloc(n_ids*sizeof(int))
+    touched=<int *>malloc(n_ids*sizeof(int))
+    for i from 0<=i<n_ids:
+      counts[i]=0
+    use_regions=within is not None
+    if self.release_gil:
+      with nogil:
+        window_size=count_window_ids(self.att, hit_list.ids, hit_list.length,
+                                     left, right, max_cpos, use_regions,
+                                     reg_starts, reg_ends, n_regions,
+                                     counts, touched, &n_touched)
+    else:
+      window_size=count_window_ids(self.att, hit_list.ids, hit_list.length,
+                                   left, right, max_cpos, use_regions,
+                                   reg_starts, reg_ends, n_regions,
+                                   counts, touched, &n_touched)
+    scored=<ScoredId *>malloc(n_touched*sizeof(ScoredId))
+    for i from 0<=i<n_touched:
+      tagid=touched[i]
+      if counts[tagid]>=min_count:
+        scored[n_scored].tagid=tagid
+        scored[n_scored].count=counts[tagid]
+        scored[n_scored].score=association(m, counts[tagid], window_size,
+                                           freqs.data.as_ints[tagid], max_cpos)
+        n_scored+=1
+    free(counts)
+    free(touched)
+    qsort(scored, n_scored, sizeof(ScoredId), compare_scores)
+    ids_out=new_int_array(n_scored)
+    counts_out=new_int_array(n_scored)
+    scores_out=array.clone(double_array_template, n_scored, False)
+    for i from 0<=i<n_scored:
+      ids_out.data.as_ints[i]=scored[i].tagid
+      counts_out.data.as_ints[i]=scored[i].count
+      scores_out.data.as_doubles[i]=scored[i].score
+    free(scored)
+    return (ids_out, scores_out, counts_out)
+  def count_ngrams(self, int n, path_prefix, int start=0, stop=None,
+                   AttStruc within=None, int run_size=1<<22):
+    """counts the n-grams of this attribute that start at the corpus
+       positions start..stop-1 and do not cross the boundaries of
+       *within* (e.g., sentences), if given. The counts are written
+       as sorted runs of at most *run_size* distinct n-grams to files
+       named path_prefix.0, path_prefix.1, ... (to be combined with
+       merge_ngram_runs); returns the list of file names."""
+    cdef int max_cpos=cl_max_cpos(self.att)
+    cdef int bits=ngram_bits(cl_max_id(self.att)), chunk=1<<16
+    cdef int *reg_starts=NULL
+    cdef int *reg_ends=NULL
+    cdef int n_regions=0, k=0, c0, c1, p, i, end
+    cdef int *buf
+    cdef NGramCount *recs
+    cdef Py_ssize_t n_recs=0
+    cdef unsigned long long hi, lo
+    cdef list paths=[]
+    if n<1 or n*bits>128:
+      raise ValueError('cannot pack %d-grams of %d-bit ids'%(n, bits))
+    end=max_cpos if stop is None else stop
+    if start<0 or end<start or end>max_cpos:
+      raise IndexError('P-attribute offset out of bounds')
+    if within is not None:
+      within.load_regions()
+      reg_starts=within.starts.data.as_ints
+      reg_ends=within.ends.data.as_ints
+      n_regions=len(within.starts)
+    buf=<int *>malloc((chunk+n-1)*sizeof(int))
+    recs=<NGramCount *>malloc(run_size*sizeof(NGramCount))
+    try:
+      for c0 from start<=c0<end by chunk:
+        # ids for the positions c0..c1-1, plus the n-1 positions after
+        # them that n-grams starting in the chunk can extend to
+        c1=c0+chunk
+        if c1>end:
+          c1=end
+        self.fill_ids(c0, min(c1+n-1, max_cpos), buf)
+        for p from c0<=p<c1:
+          if p+n>max_cpos:
+            break
+          if within is not None:
+            k=gallop(reg_ends, k, n_regions, p)
+            if k>=n_regions or reg_starts[k]>p or reg_ends[k]<p+n-1:
+              continue
+          hi=0
+          lo=0
+          for i from 0<=i<n:
+            hi=(hi<<bits)|(lo>>(64-bits))
+            lo=(lo<<bits)|<unsigned long long>buf[p-c0+i]
+          recs[n_recs].hi=hi
+          recs[n_recs].lo=lo
+          recs[n_recs].count=1
+          n_recs+=1
+          if n_recs==run_size:
+            paths.append(write_ngram_run('%s.%d'%(path_prefix, len(paths)),
+                                         n, bits, recs, n_recs))
+            n_recs=0
+      if n_recs>0 or not paths:
+        paths.append(write_ngram_run('%s.%d'%(path_prefix, len(paths)),
+                                     n, bits, recs, n_recs))
+    finally:
+      free(buf)
+      free(recs)
+    return paths
   def __len__(self):
     return cl_max_cpos(self.att)
 
+ctypedef struct StreamState:
+  PositionStream ps
+  int *buf
+  int n
+  int i
+
+# the chunks read from position streams take up to this many ints in all
+cdef int stream_buffer_size=1<<16
+
+cdef class PositionCursor:
+  """iterates over the corpus positions of one or more lexicon ids in
+     ascending order, reading them from the attribute's index in chunks
+     (merging the positions of several ids on the fly), so that the
+     positions are never all in memory"""
+  cdef PosAttrib attr
+  cdef StreamState *states
+  cdef int n_states
+  cdef int *heap
+  cdef int n_heap
+  cdef int chunk
+  def __cinit__(self, PosAttrib attr not None, ids):
+    cdef StreamState *s
+    cdef int j
+    cdef IDList id_list=as_idlist(ids)
+    self.attr=attr
+    self.chunk=stream_buffer_size/id_list.length if id_list.length>0 else 16
+    if self.chunk<16:
+      self.chunk=16
+    elif self.chunk>1024:
+      self.chunk=1024
+    self.states=<StreamState *>malloc(id_list.length*sizeof(StreamState))
+    self.heap=<int *>malloc(id_list.length*sizeof(int))
+    for j from 0<=j<id_list.length:
+      if id_list.ids[j]<0 or id_list.ids[j]>=cl_max_id(attr.att):
+        raise IndexError('lexicon id out of bounds')
+      s=&self.states[j]
+      s.ps=cl_new_stream(attr.att, id_list.ids[j])
+      s.buf=<int *>malloc(self.chunk*sizeof(int))
+      self.n_states+=1
+      if s.ps!=NULL and self.fill(s):
+        self.heap[self.n_heap]=j
+        self.n_heap+=1
+    for j from self.n_heap/2>j>=0:
+      self.sift_down(j)
+  def __dealloc__(self):
+    cdef int j
+    for j from 0<=j<self.n_states:
+      if self.states[j].ps!=NULL:
+        cl_delete_stream(&self.states[j].ps)
+      free(self.states[j].buf)
+    free(self.states)
+    free(self.heap)
+  cdef bint fill(self, StreamState *s):
+    # reads the next chunk of s, returns False at its end
+    s.i=0
+    s.n=cl_read_stream(s.ps, s.buf, self.chunk)
+    return s.n>0
+  cdef inline int head(self, int k):
+    cdef StreamState *s=&self.states[self.heap[k]]
+    return s.buf[s.i]
+  cdef void sift_down(self, int k):
+    cdef int child, tmp
+    while True:
+      child=2*k+1
+      if child>=self.n_heap:
+        break
+      if child+1<self.n_heap and self.head(child+1)<self.head(child):
+        child+=1
+      if self.head(k)<=self.head(child):
+        break
+      tmp=self.heap[k]; self.heap[k]=self.heap[child]; self.heap[child]=tmp
+      k=child
+  cdef int pop(self):
+    # returns the next position, or -1 at the end
+    cdef StreamState *s
+    cdef int val
+    if self.n_heap==0:
+      return -1
+    s=&self.states[self.heap[0]]
+    val=s.buf[s.i]
+    s.i+=1
+    if s.i>=s.n and not self.fill(s):
+      self.n_heap-=1
+      self.heap[0]=self.heap[self.n_heap]
+    self.sift_down(0)
+    return val
+  def __iter__(self):
+    return self
+  def __next__(self):
+    cdef int val=self.pop()
+    if val<0:
+      raise StopIteration
+    return val
+  def next(self):
+    """returns the next position, raises StopIteration at the end"""
+    return self.__next__()
+  def skip_to(self, int cpos):
+    """skips the positions before *cpos* and returns the next one
+       (which is consumed, like with next), or None at the end.
+       Chunks that end before *cpos* are skipped without merging them."""
+    cdef StreamState *s
+    cdef int j, k=0, val
+    for j from 0<=j<self.n_heap:
+      s=&self.states[self.heap[j]]
+      while s.buf[s.n-1]<cpos:
+        if not self.fill(s):
+          break
+      else:
+        s.i=gallop(s.buf, s.i, s.n, cpos)
+        self.heap[k]=self.heap[j]
+        k+=1
+    self.n_heap=k
+    for j from k/2>j>=0:
+      self.sift_down(j)
+    val=self.pop()
+    return None if val<0 else val
+  def read(self, int n=4096):
+    """returns the next (up to) *n* positions as an array.array('i'),
+       which is empty at the end"""
+    cdef array.array result=new_int_array(n)
+    cdef int k=self.read_into(result.data.as_ints, n)
+    array.resize(result, k)
+    return result
+  def readinto(self, buf):
+    """fills the writable buffer of C ints *buf* (e.g. an
+       array.array('i')) with the next positions and returns their
+       number, which is smaller than len(buf) only at the end"""
+    cdef Py_buffer view
+    cdef int k
+    acquire_int_buffer(buf, &view, PyBUF_WRITABLE)
+    try:
+      k=self.read_into(<int *>view.buf, view.len/sizeof(int))
+    finally:
+      PyBuffer_Release(&view)
+    return k
+  cdef int read_into(self, int *out, int n):
+    cdef StreamState *s
+    cdef int k=0, m
+    while k<n and self.n_heap>0:
+      if self.n_heap==1:
+        # copy whole chunks of the last stream
+        s=&self.states[self.heap[0]]
+        m=s.n-s.i
+        if m>n-k:
+          m=n-k
+        memcpy(out+k, s.buf+s.i, m*sizeof(int))
+        k+=m
+        s.i+=m
+        if s.i>=s.n and not self.fill(s):
+          self.n_heap=0
+      else:
+        out[k]=self.pop()
+        k+=1
+    return k
+
+cdef class ScanCursor:
+  """reads the ids of the corpus positions start..stop-1 of a PosAttrib
+     in order. Iterating gives array.array('i') chunks of chunk_size
+     ids; position is the next corpus position to be read."""
+  cdef PosAttrib attr
+  cdef readonly int position
+  cdef readonly int stop
+  cdef int chunk_size
+  def __cinit__(self, PosAttrib attr not None, int start, int stop, int chunk_size):
+    if start<0 or stop<start or stop>cl_max_cpos(attr.att):
+      raise IndexError('P-attribute offset out of bounds')
+    if chunk_size<=0:
+      raise ValueError('chunk_size must be positive')
+    self.attr=attr
+    self.position=start
+    self.stop=stop
+    self.chunk_size=chunk_size
+  def __iter__(self):
+    return self
+  def __next__(self):
+    if self.position>=self.stop:
+      raise StopIteration
+    return self.read(self.chunk_size)
+  def read(self, int n):
+    """returns the ids of the next (up to) *n* positions as an
+       array.array('i'), which is empty at the end"""
+    cdef array.array result
+    if n>self.stop-self.position:
+      n=self.stop-self.position
+    result=new_int_array(max(n, 0))
+    if n>0:
+      self.attr.fill_ids(self.position, self.position+n, result.data.as_ints)
+      self.position+=n
+    return result
+  def readinto(self, buf):
+    """fills the writable buffer of C ints *buf* with the ids of the
+       next positions and returns their number"""
+    cdef Py_buffer view
+    cdef Py_ssize_t n
+    acquire_int_buffer(buf, &view, PyBUF_WRITABLE)
+    try:
+      n=min(view.len/sizeof(int), self.stop-self.position)
+      self.attr.fill_ids(self.position, self.position+n, <int *>view.buf)
+      self.position+=n
+    finally:
+      PyBuffer_Release(&view)
+    return n
+
+# id indexes (PosAttrib.id_index) have a 16-byte header with magic and
+# the number of corpus positions, followed by the ids as C ints
+cdef bytes id_index_magic=b'CWBIDSQ1'
+cdef int id_index_header=16
+
+# frequency indexes (PosAttrib.frequencies) have the same header, with
+# the number of lexicon ids, followed by the frequencies
+cdef bytes freq_index_magic=b'CWBFREQ1'
+cdef int freq_index_header=16
+
+cdef bint valid_freq_index(data, int n):
+  return (len(data)==freq_index_header+n*sizeof(int) and
+          data[:8]==freq_index_magic and
+          struct.unpack('=q', data[8:16])[0]==n)
+
+def _id_index_chunks(PosAttrib att):
+  cdef int n=cl_max_cpos(att.att)
+  yield struct.pack('=8sq', id_index_magic, n)
+  for ids in ScanCursor(att, 0, n, 1<<20):
+    yield ids.tobytes()
+
 cdef class AttrDictionary:
   cdef PosAttrib attr
   def __cinit__(self,d):
@@ -312,11 +2231,8 @@ cdef class AttrDictionary:
     cdef char *s
     s=cl_id2str(self.attr.att,n)
     return s
-  def get_matching(self,pat,flags=0):
-    cdef IDList lst
-    lst=IDList()
-    lst.ids=collect_matching_ids(self.attr.att,pat,flags,&lst.length)
-    return lst
+  def get_matching(self,pat,int flags=0):
+    return matching_id_list(self.attr, self.attr.parent.to_str(pat), flags)
   def expand_pattern(self,pat,flags=0):
     cdef IDList lst
     cdef i
@@ -326,6 +2242,514 @@ cdef class AttrDictionary:
       result.append(cl_id2str(self.attr.att,lst.ids[i]))
     return result
 
+# Value indices map byte strings (such as s-attribute values) to sorted
+# lists of numbers (such as struc numbers). They are stored in a binary
+# file that can be memory-mapped and looked up directly:
+#   header (64 bytes): magic, n_keys, n_slots, n_postings, blob_size
+#   long long key_offsets[n_keys+1]       (into blob)
+#   long long posting_offsets[n_keys+1]   (into postings)
+#   int slots[n_slots]                    (hash table of key numbers, -1=empty)
+#   int postings[n_postings]
+#   char blob[blob_size]                  (the keys themselves)
+cdef bytes value_index_magic=b'CWBVIDX1'
+cdef int value_index_header=64
+
+cdef unsigned long long hash_bytes(const char *s, Py_ssize_t n) nogil:
+  # 64-bit FNV-1a
+  cdef unsigned long long h=14695981039346656037ULL
+  cdef Py_ssize_t i
+  for i from 0<=i<n:
+    h=(h^<unsigned char>s[i])*1099511628211ULL
+  return h
+
+def build_value_index(values):
+  """builds the contents of a value index file mapping each of the
+     (byte string) *values* to the positions at which it occurs"""
+  cdef dict groups={}
+  cdef list keys, lst
+  cdef bytes key
+  cdef long long n_slots=2, n_postings=0, pos_blob=0, pos_post=0
+  cdef unsigned long long mask, h
+  cdef array.array slots, key_offsets, posting_offsets, postings
+  cdef int i, k, n
+  for i, key in enumerate(values):
+    lst=groups.get(key)
+    if lst is None:
+      groups[key]=[i]
+    else:
+      lst.append(i)
+    n_postings+=1
+  keys=list(groups)
+  n=len(keys)
+  while n_slots<2*n:
+    n_slots*=2
+  mask=n_slots-1
+  slots=array.array('i', [-1])*n_slots
+  key_offsets=array.array('q', [0])*(n+1)
+  posting_offsets=array.array('q', [0])*(n+1)
+  postings=new_int_array(n_postings)
+  for k from 0<=k<n:
+    key=keys[k]
+    h=hash_bytes(key, len(key))&mask
+    while slots.data.as_ints[h]!=-1:
+      h=(h+1)&mask
+    slots.data.as_ints[h]=k
+    lst=groups[key]
+    for i in lst:
+      postings.data.as_ints[pos_post]=i
+      pos_post+=1
+    pos_blob+=len(key)
+    key_offsets.data.as_longlongs[k+1]=pos_blob
+    posting_offsets.data.as_longlongs[k+1]=pos_post
+  header=struct.pack('=8sqqqq', value_index_magic, n, n_slots,
+                     n_postings, pos_blob)
+  return b''.join([header.ljust(value_index_header, b'\0'),
+                   key_offsets, posting_offsets, slots, postings]+keys)
+
+cdef class ValueIndex:
+  """a value index, as written by build_value_index, in a buffer
+     (e.g., bytes or a memory-mapped file)"""
+  def __cinit__(self, data):
+    cdef char *base
+    cdef long long n_slots, n_postings, blob_size, expected
+    PyObject_GetBuffer(data, &self.view, PyBUF_SIMPLE)
+    self.has_view=True
+    self.data=data
+    base=<char *>self.view.buf
+    if self.view.len<value_index_header or base[:8]!=value_index_magic:
+      raise ValueError('not a value index')
+    _, self.n_keys, n_slots, n_postings, blob_size=struct.unpack(
+      '=8sqqqq', base[:40])
+    expected=(value_index_header+(self.n_keys+1)*2*sizeof(long long)+
+              (n_slots+n_postings)*sizeof(int)+blob_size)
+    if self.view.len!=expected:
+      raise ValueError('truncated value index')
+    self.mask=n_slots-1
+    self.key_offsets=<long long *>(base+value_index_header)
+    self.posting_offsets=self.key_offsets+self.n_keys+1
+    self.slots=<int *>(self.posting_offsets+self.n_keys+1)
+    self.postings=self.slots+n_slots
+    self.blob=<char *>(self.postings+n_postings)
+  def __dealloc__(self):
+    if self.has_view:
+      PyBuffer_Release(&self.view)
+  cdef int find_key(self, const char *s, Py_ssize_t n):
+    # key number for s, or -1 if it is not in the index
+    cdef unsigned long long h=hash_bytes(s, n)&self.mask
+    cdef int k
+    cdef long long start
+    while True:
+      k=self.slots[h]
+      if k==-1:
+        return -1
+      start=self.key_offsets[k]
+      if (self.key_offsets[k+1]-start==n and
+          memcmp(self.blob+start, s, n)==0):
+        return k
+      h=(h+1)&self.mask
+  cdef IDList postings_for(self, int k):
+    cdef IDList lst=IDList()
+    cdef long long start=self.posting_offsets[k]
+    lst.length=self.posting_offsets[k+1]-start
+    lst.ids=<int *>malloc(lst.length*sizeof(int))
+    memcpy(lst.ids, self.postings+start, lst.length*sizeof(int))
+    return lst
+  def __len__(self):
+    return self.n_keys
+  def __contains__(self, bytes key):
+    return self.find_key(key, len(key))>=0
+  def __getitem__(self, bytes key):
+    cdef int k=self.find_key(key, len(key))
+    if k<0:
+      raise KeyError(key)
+    return self.postings_for(k)
+  def keys(self):
+    """iterates over all values in the index"""
+    cdef int k
+    for k from 0<=k<self.n_keys:
+      yield self.blob[self.key_offsets[k]:self.key_offsets[k+1]]
+  def find_matching(self, match):
+    """returns an IDList with the positions of all values
+       for which match(value) is true"""
+    cdef int k
+    cdef list found=[]
+    for k from 0<=k<self.n_keys:
+      if match(self.blob[self.key_offsets[k]:self.key_offsets[k+1]]):
+        found.append(self.postings_for(k))
+    return IDList.union_all(found)
+
+# Lexicon indices list the ids of the values of a p-attribute sorted
+# by their byte strings and by their reversed byte strings, so that the
+# values with a given prefix (or suffix) form a contiguous range:
+#   header (16 bytes): magic, n
+#   int by_form[n]
+#   int by_suffix[n]
+cdef bytes lexicon_index_magic=b'CWBLXSRT'
+cdef int lexicon_index_header=16
+
+cdef int compare_forms(const void *a, const void *b) nogil:
+  cdef LexiconEntry *x=<LexiconEntry *>a
+  cdef LexiconEntry *y=<LexiconEntry *>b
+  cdef int c=memcmp(x.s, y.s, x.length if x.length<y.length else y.length)
+  if c==0:
+    c=(x.length>y.length)-(x.length<y.length)
+  return c
+
+cdef int compare_suffixes(const void *a, const void *b) nogil:
+  cdef LexiconEntry *x=<LexiconEntry *>a
+  cdef LexiconEntry *y=<LexiconEntry *>b
+  return compare_suffix(x.s, x.length, y.s, y.length, False)
+
+cdef inline int compare_prefix(const char *s, int n, const char *p, int m) nogil:
+  # compares s with p, treating strings that start with p as equal
+  cdef int c=memcmp(s, p, n if n<m else m)
+  if c==0 and n<m:
+    c=-1
+  return c
+
+cdef inline int compare_suffix(const char *s, int n, const char *p, int m,
+                               bint affix) nogil:
+  # compares the reversal of s with the reversal of p (treating strings
+  # that end with p as equal, if affix is set)
+  cdef int i=n-1, j=m-1
+  while i>=0 and j>=0:
+    if s[i]!=p[j]:
+      return (<unsigned char>s[i]>(<unsigned char>p[j]))*2-1
+    i-=1
+    j-=1
+  if j>=0:
+    return -1
+  if i>=0 and not affix:
+    return 1
+  return 0
+
+def build_lexicon_index(PosAttrib attr not None):
+  """returns the contents (as bytes) of a LexiconIndex for the
+     p-attribute *attr*"""
+  cdef int n=cl_max_id(attr.att), i
+  cdef LexiconEntry *entries
+  cdef array.array by_form, by_suffix
+  attr.ensure_loaded(LOAD_LEXICON)
+  by_form=new_int_array(n)
+  by_suffix=new_int_array(n)
+  entries=<LexiconEntry *>malloc(n*sizeof(LexiconEntry))
+  with nogil:
+    for i from 0<=i<n:
+      entries[i].s=cl_id2str(attr.att,i)
+      entries[i].length=strlen(entries[i].s)
+      entries[i].tagid=i
+    qsort(entries, n, sizeof(LexiconEntry), compare_forms)
+    for i from 0<=i<n:
+      by_form.data.as_ints[i]=entries[i].tagid
+    qsort(entries, n, sizeof(LexiconEntry), compare_suffixes)
+    for i from 0<=i<n:
+      by_suffix.data.as_ints[i]=entries[i].tagid
+  free(entries)
+  return b''.join([struct.pack('=8sq', lexicon_index_magic, n),
+                   by_form, by_suffix])
+
+cdef class LexiconIndex:
+  """a lexicon index for the p-attribute attr, as written by
+     build_lexicon_index, in a buffer (e.g., bytes or a memory-mapped
+     file)"""
+  def __cinit__(self, PosAttrib attr not None, data):
+    cdef char *base
+    cdef long long n
+    PyObject_GetBuffer(data, &self.view, PyBUF_SIMPLE)
+    self.has_view=True
+    self.data=data
+    self.attr=attr
+    base=<char *>self.view.buf
+    if self.view.len<lexicon_index_header or base[:8]!=lexicon_index_magic:
+      raise ValueError('not a lexicon index')
+    _, n=struct.unpack('=8sq', base[:16])
+    if (n!=cl_max_id(attr.att) or
+        self.view.len!=lexicon_index_header+2*n*sizeof(int)):
+      raise ValueError('lexicon index does not match the lexicon')
+    self.n=n
+    self.by_form=<int *>(base+lexicon_index_header)
+    self.by_suffix=self.by_form+n
+  def __dealloc__(self):
+    if self.has_view:
+      PyBuffer_Release(&self.view)
+  def __len__(self):
+    return self.n
+  cdef int affix_range(self, bint suffix, const char *p, int m, int *hi) nogil:
+    # returns the range lo..hi-1 of by_form (or by_suffix) with
+    # the values that start (or end) with p
+    cdef int *order=self.by_suffix if suffix else self.by_form
+    cdef int lo=0, up=self.n, mid, start, c
+    cdef const char *s
+    cdef bint upper=False
+    while True:
+      while lo<up:
+        mid=lo+(up-lo)/2
+        s=cl_id2str(self.attr.att, order[mid])
+        if suffix:
+          c=compare_suffix(s, strlen(s), p, m, True)
+        else:
+          c=compare_prefix(s, strlen(s), p, m)
+        if c<0 or (upper and c==0):
+          lo=mid+1
+        else:
+          up=mid
+      if upper:
+        hi[0]=lo
+        return start
+      start=lo
+      up=self.n
+      upper=True
+  cdef IDList collect(self, bint suffix, int lo, int hi):
+    cdef IDList lst=IDList()
+    lst.length=hi-lo
+    lst.ids=<int *>malloc(lst.length*sizeof(int))
+    memcpy(lst.ids, (self.by_suffix if suffix else self.by_form)+lo,
+           lst.length*sizeof(int))
+    with nogil:
+      qsort(lst.ids, lst.length, sizeof(int), compare_ints)
+    return lst
+  def with_prefix(self, bytes prefix):
+    """returns an IDList with the ids of all values starting with *prefix*"""
+    cdef int lo, hi
+    lo=self.affix_range(False, prefix, len(prefix), &hi)
+    return self.collect(False, lo, hi)
+  def with_suffix(self, bytes suffix):
+    """returns an IDList with the ids of all values ending with *suffix*"""
+    cdef int lo, hi
+    lo=self.affix_range(True, suffix, len(suffix), &hi)
+    return self.collect(True, lo, hi)
+
+cdef object regex_meta=frozenset('.^$*+?{}[]\\|()')
+
+def pattern_affixes(pat):
+  """splits a regular expression into its literal prefix and suffix.
+     Returns (prefix, suffix, kind), where kind is 'exact' if *pat*
+     only matches the literal prefix, 'prefix' or 'suffix' for
+     patterns of the form prefix.* and .*suffix, and 'regex'
+     otherwise; returns None for patterns with groups, alternatives,
+     anchors or escapes other than escaped metacharacters."""
+  cdef list atoms=[]
+  cdef int i=0, j, k, m, n=len(pat)
+  # atoms are (literal character or None, source text) pairs
+  while i<n:
+    c=pat[i]
+    if c=='\\':
+      if i+1>=n:
+        return None
+      if pat[i+1] not in regex_meta:
+        # \d, \xHH, \p{..} etc. are left to libcl
+        return None
+      atoms.append((pat[i+1], pat[i:i+2]))
+      i+=2
+    elif c=='[':
+      j=i+1
+      if pat[j:j+1]=='^':
+        j+=1
+      if pat[j:j+1]==']':
+        j+=1
+      while j<n and pat[j]!=']':
+        if pat[j]=='\\':
+          j+=1
+        j+=1
+      if j>=n:
+        return None
+      atoms.append((None, pat[i:j+1]))
+      i=j+1
+    elif c in '*+?{':
+      j=pat.find('}', i)+1 if c=='{' else i+1
+      if j==0 or not atoms:
+        return None
+      atoms[-1]=(None, atoms[-1][1]+pat[i:j])
+      i=j
+    elif c=='.':
+      atoms.append((None, c))
+      i+=1
+    elif c in regex_meta:
+      return None
+    else:
+      atoms.append((c, c))
+      i+=1
+  k=0
+  while k<len(atoms) and atoms[k][0] is not None:
+    k+=1
+  prefix=pat[:0].join([a[0] for a in atoms[:k]])
+  if k==len(atoms):
+    return (prefix, prefix, 'exact')
+  m=len(atoms)
+  while atoms[m-1][0] is not None:
+    m-=1
+  suffix=pat[:0].join([a[0] for a in atoms[m:]])
+  if m==k+1 and atoms[k][1]=='.*' and not (prefix and suffix):
+    return (prefix, suffix, 'suffix' if suffix else 'prefix')
+  return (prefix, suffix, 'regex')
+
+cdef IDList lexicon_lookup(PosAttrib att, bytes pat_s):
+  # the lexicon ids matching pat_s, found with the lexicon index if
+  # pat_s has a literal prefix or suffix; None if the pattern has to
+  # be matched against the whole lexicon
+  cdef LexiconIndex index
+  cdef IDList lst
+  cdef bytes prefix_s, suffix_s
+  cdef int tagid, lo, hi, lo2, hi2
+  cdef bint suffix
+  pat=att.parent.to_unicode(pat_s)
+  affixes=pattern_affixes(pat)
+  if affixes is None:
+    return None
+  prefix, suffix_u, kind=affixes
+  prefix_s=att.parent.to_str(prefix)
+  suffix_s=att.parent.to_str(suffix_u)
+  if kind=='exact':
+    att.ensure_loaded(LOAD_LEXICON)
+    tagid=cl_str2id(att.att, prefix_s)
+    return IDList([tagid] if tagid>=0 else [])
+  if not prefix_s and not suffix_s:
+    return None
+  index=att.lexicon_index(build=False)
+  if index is None:
+    return None
+  att.ensure_loaded(LOAD_LEXICON)
+  lo=index.affix_range(False, prefix_s, len(prefix_s), &hi)
+  lo2=index.affix_range(True, suffix_s, len(suffix_s), &hi2)
+  suffix=hi2-lo2<hi-lo
+  if suffix:
+    lst=index.collect(True, lo2, hi2)
+  else:
+    lst=index.collect(False, lo, hi)
+  if kind=='regex':
+    lst=filter_matching_ids(att, pat_s, lst)
+  return lst
+
+cdef IDList filter_matching_ids(PosAttrib att, bytes pat_s, IDList lst):
+  # the ids in lst whose values match pat_s, checked with the regex
+  # engine of libcl (so that the result is the same as that of
+  # collect_matching_ids); None if libcl does not accept the pattern
+  cdef IDList result=IDList()
+  cdef CL_Regex rx
+  cdef char *pat_c=pat_s
+  cdef CorpusCharset charset=cl_corpus_charset(att.parent.corpus)
+  cdef int i, k=0
+  result.ids=<int *>malloc(lst.length*sizeof(int))
+  with nogil:
+    PyThread_acquire_lock(regex_lock, WAIT_LOCK)
+    rx=cl_new_regex(pat_c, 0, charset)
+    if rx!=NULL:
+      for i from 0<=i<lst.length:
+        if cl_regex_match(rx, cl_id2str(att.att, lst.ids[i]), 0):
+          result.ids[k]=lst.ids[i]
+          k+=1
+      cl_delete_regex(rx)
+    PyThread_release_lock(regex_lock)
+  if rx==NULL:
+    return None
+  result.length=k
+  return result
+
+cdef object native_name(name):
+  # corpus and attribute names can be given as bytes or as unicode;
+  # file names are always built from the (native) str version
+  if PY_MAJOR_VERSION >= 3 and isinstance(name, bytes):
+    return (<bytes>name).decode('ascii')
+  return name
+
+cdef object corpus_data_dir(Corpus corpus):
+  if corpus.home is None:
+    try:
+      corpus.home=corpus_home(corpus.registry_name, corpus.registry_dir)
+    except (KeyError, IOError, OSError):
+      corpus.home=''
+  return corpus.home or None
+
+cdef object index_file(Corpus corpus, fname, sources):
+  # returns a buffer with the (up-to-date) contents of the index file
+  # fname, or None if it has to be (re-)built
+  cdef object home=corpus_data_dir(corpus)
+  cdef object path
+  cdef double mtime
+  for path in index_file_candidates(corpus, fname):
+    try:
+      mtime=os.path.getmtime(path)
+    except OSError:
+      continue
+    if home is not None:
+      for src in sources:
+        src=os.path.join(home, src)
+        if os.path.exists(src) and os.path.getmtime(src)>mtime:
+          break
+      else:
+        return map_file(path)
+    else:
+      return map_file(path)
+  return None
+
+cdef object store_index_file(Corpus corpus, fname, data):
+  # writes data to the index file fname (if possible) and returns a
+  # buffer with its contents. data can also be a function that returns
+  # the contents as a sequence of chunks, in which case None is returned
+  # if the file cannot be written.
+  cdef object path, tmp_path
+  for path in index_file_candidates(corpus, fname):
+    tmp_path='%s.%d.tmp'%(path, os.getpid())
+    try:
+      with open(tmp_path, 'wb') as f_out:
+        if isinstance(data, bytes):
+          f_out.write(data)
+        else:
+          for chunk in data():
+            f_out.write(chunk)
+      os.rename(tmp_path, path)
+      return map_file(path)
+    except (IOError, OSError):
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+  return data if isinstance(data, bytes) else None
+
+cdef list index_file_candidates(Corpus corpus, fname):
+  cdef object home=corpus_data_dir(corpus)
+  cdef list result=[]
+  if home is not None:
+    result.append(os.path.join(home, fname))
+  if index_dir is not None:
+    result.append(os.path.join(index_dir, '%s.%s'%(corpus.registry_name.lower(), fname)))
+  return result
+
+cdef object map_file(path):
+  with open(path, 'rb') as f:
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+cdef array.array find_regions(array.array starts, array.array ends, positions):
+  # for each of the corpus positions in positions, finds the number
+  # of the region (out of non-overlapping, sorted regions) that contains
+  # it, or -1 if there is none
+  cdef Py_buffer view
+  cdef array.array result
+  cdef int *pos
+  cdef int *out
+  cdef Py_ssize_t i, n
+  cdef int k=0, n_regions=len(starts)
+  cdef int *reg_starts=starts.data.as_ints
+  cdef int *reg_ends=ends.data.as_ints
+  acquire_int_buffer(positions, &view)
+  try:
+    n=view.len/sizeof(int)
+    pos=<int *>view.buf
+    result=new_int_array(n)
+    out=result.data.as_ints
+    with nogil:
+      for i from 0<=i<n:
+        # positions are usually sorted, so we continue the search
+        # where the last one ended
+        if i>0 and pos[i]<pos[i-1]:
+          k=0
+        k=gallop(reg_ends, k, n_regions, pos[i])
+        if k<n_regions and reg_starts[k]<=pos[i]:
+          out[i]=k
+        else:
+          out[i]=-1
+  finally:
+    PyBuffer_Release(&view)
+  return result
+
 cdef class AttStruc:
   def __repr__(self):
     return "CWB.CL.AttrStruct(%s,'%s')"%(self.parent,self.attname)
@@ -338,19 +2762,60 @@ cdef class AttStruc:
     if self.att==NULL:
       raise KeyError
     self.has_values=cl_struc_values(self.att)
+  cdef int ensure_loaded(self, int components) except -1:
+    # loads the given components (LOAD_*) while holding the GIL
+    cdef int start, end
+    components&=~self.loaded
+    if components&LOAD_REGIONS:
+      if cl_max_struc(self.att)>0:
+        cl_struc2cpos(self.att,0,&start,&end)
+        cl_cpos2struc(self.att,start)
+    if components&LOAD_VALUES:
+      if self.has_values and cl_max_struc(self.att)>0:
+        cl_struc2str(self.att,0)
+    self.loaded|=components
+    return 0
+  def __reduce__(self):
+    return (AttStruc, (self.parent, self.attname))
   def getName(self):
     return self.attname
-  def find_all(self,tags):
-    # s-attr string attributes are not indexed
-    # so we just do the stupid thing here.
+  def value_index(self):
+    """returns the ValueIndex for the values of this attribute. It is
+       built on first use and stored next to the corpus data, so that
+       later uses only need to map the index file into memory."""
     cdef int i
-    strucs=[]
+    cdef object data
     if not self.has_values: raise TypeError
-    for i from 0<=i<cl_max_struc(self.att):
-      struc_id=cl_struc2str(self.att,i)
-      if struc_id in tags:
-        strucs.append(i)
-    return strucs
+    if self.values is None:
+      base=native_name(self.attname)
+      fname=base+'.avs.idx'
+      sources=[base+ext for ext in ('.avs', '.avx', '.rng')]
+      data=index_file(self.parent, fname, sources)
+      if data is None:
+        data=build_value_index([cl_struc2str(self.att,i)
+                                for i in range(cl_max_struc(self.att))])
+        data=store_index_file(self.parent, fname, data)
+      self.values=ValueIndex(data)
+    return self.values
+  def find_value(self, value):
+    """returns an IDList with the numbers of all structures
+       whose value is *value*"""
+    return self.value_index()[self.parent.to_str(value)]
+  def find_value_pattern(self, pat):
+    """returns an IDList with the numbers of all structures
+       whose value matches the regular expression *pat*"""
+    to_unicode=self.parent.to_unicode
+    rx=re.compile('(?:%s)\\Z'%(self.parent.to_unicode(pat),))
+    return self.value_index().find_matching(lambda v: rx.match(to_unicode(v)))
+  def find_all(self,tags):
+    cdef ValueIndex index=self.value_index()
+    cdef list found=[]
+    cdef bytes tag_s
+    for tag in tags:
+      tag_s=self.parent.to_str(tag)
+      if tag_s in index:
+        found.append(index[tag_s])
+    return list(IDList.union_all(found))
   def find_pos(self,offset):
     return self[cl_cpos2struc(self.att,offset)]
   def cpos2struc(self,offset):
@@ -359,22 +2824,174 @@ cdef class AttStruc:
     if val==CDA_ESTRUC:
       raise KeyError("no structure at this position")
     return val
-  def map_idlist(self, IDList lst not None):
+  def map_idlist(self, lst):
     """returns an IDList with (unique) struc offsets instead of
        corpus positions"""
+    cdef IDList positions=as_idlist(lst)
     cdef IDList result=IDList()
-    cdef int i, k, val, lastval
-    result.ids=<int *>malloc(lst.length*sizeof(int))
-    k=0
-    lastval=-1
-    for i from 0<=i<lst.length:
-      val=cl_cpos2struc(self.att,lst.ids[i])
-      if val>=0 and val!=lastval:
-        result.ids[k]=val
-        k+=1
-        lastval=val
+    cdef int i, k=0, r=0, n_regions
+    cdef int *starts
+    cdef int *ends
+    self.load_regions()
+    starts=self.starts.data.as_ints
+    ends=self.ends.data.as_ints
+    n_regions=len(self.starts)
+    result.ids=<int *>malloc(positions.length*sizeof(int))
+    with nogil:
+      for i from 0<=i<positions.length:
+        r=gallop(ends, r, n_regions, positions.ids[i])
+        if r>=n_regions:
+          break
+        if starts[r]<=positions.ids[i] and (k==0 or result.ids[k-1]!=r):
+          result.ids[k]=r
+          k+=1
     result.length=k
     return result
+  def filter_within(self, positions, strucs=None):
+    """returns an IDList with those of the corpus *positions* that are
+       inside one of the structures numbered in *strucs* (or inside any
+       structure, if strucs is None)"""
+    cdef IDList result=IDList()
+    cdef int i=0, j, r=0, k=0, n_regions
+    cdef int *starts
+    cdef int *ends
+    cdef IDList pos_list=as_idlist(positions)
+    cdef IDList struc_list=as_idlist(strucs, True)
+    cdef int *pos=pos_list.ids
+    cdef int n=pos_list.length
+    self.load_regions()
+    starts=self.starts.data.as_ints
+    ends=self.ends.data.as_ints
+    n_regions=len(self.starts)
+    if struc_list is not None and struc_list.length>0 and (
+        struc_list.ids[0]<0 or struc_list.ids[struc_list.length-1]>=n_regions):
+      raise IndexError('structure number out of bounds')
+    result.ids=<int *>malloc(n*sizeof(int))
+    with nogil:
+      if struc_list is None:
+        for i from 0<=i<n:
+          r=gallop(ends, r, n_regions, pos[i])
+          if r>=n_regions:
+            break
+          if starts[r]<=pos[i]:
+            result.ids[k]=pos[i]
+            k+=1
+      else:
+        # go through the selected regions, skipping to the first
+        # position in each of them
+        for j from 0<=j<struc_list.length:
+          r=struc_list.ids[j]
+          i=gallop(pos, i, n, starts[r])
+          while i<n and pos[i]<=ends[r]:
+            result.ids[k]=pos[i]
+            k+=1
+            i+=1
+          if i>=n:
+            break
+    result.length=k
+    return result
+  def group_by_region(self, positions):
+    """groups the corpus *positions* by the structure that contains
+       them. Returns three arrays (array.array('i')): the numbers of the
+       structures that contain at least one position, and for each of
+       them, the index range lo..hi-1 of its positions in *positions*.
+       Positions outside of any structure are left out."""
+    cdef array.array strucs, lo, hi
+    cdef int i, r=0, k=0, n_regions
+    cdef int *starts
+    cdef int *ends
+    cdef IDList pos_list=as_idlist(positions)
+    cdef int *pos=pos_list.ids
+    cdef int n=pos_list.length
+    self.load_regions()
+    starts=self.starts.data.as_ints
+    ends=self.ends.data.as_ints
+    n_regions=len(self.starts)
+    strucs=new_int_array(n)
+    lo=new_int_array(n)
+    hi=new_int_array(n)
+    with nogil:
+      for i from 0<=i<n:
+        r=gallop(ends, r, n_regions, pos[i])
+        if r>=n_regions:
+          break
+        if starts[r]>pos[i]:
+          continue
+        if k>0 and strucs.data.as_ints[k-1]==r:
+          hi.data.as_ints[k-1]=i+1
+        else:
+          strucs.data.as_ints[k]=r
+          lo.data.as_ints[k]=i
+          hi.data.as_ints[k]=i+1
+          k+=1
+    array.resize(strucs, k)
+    array.resize(lo, k)
+    array.resize(hi, k)
+    return (strucs, lo, hi)
+  def cooccur(self, a, b):
+    """returns an IDList with the numbers of the structures that
+       contain positions from both *a* and *b*"""
+    return self.map_idlist(a) & self.map_idlist(b)
+  cdef int load_regions(self) except -1:
+    cdef int i, n
+    cdef array.array starts, ends
+    if self.starts is None:
+      self.ensure_loaded(LOAD_REGIONS)
+      n=cl_max_struc(self.att)
+      starts=new_int_array(n)
+      ends=new_int_array(n)
+      with nogil:
+        for i from 0<=i<n:
+          cl_struc2cpos(self.att, i, &starts.data.as_ints[i], &ends.data.as_ints[i])
+      self.starts=starts
+      self.ends=ends
+    return 0
+  def regions(self):
+    """returns two arrays (array.array('i')) with the start
+       and end positions of all structures. These are cached
+       and shared, and should not be modified."""
+    self.load_regions()
+    return (self.starts, self.ends)
+  def cpos2struc_many(self, positions):
+    """returns an array.array('i') with the structure numbers
+       for the corpus positions in *positions* (an IDList or a
+       buffer of C ints), with -1 for positions outside any structure"""
+    self.load_regions()
+    return find_regions(self.starts, self.ends, positions)
+  def bounds_many(self, strucs):
+    """returns two arrays (array.array('i')) with the start and
+       end positions of the structures in *strucs* (an IDList or
+       a buffer of C ints)"""
+    cdef Py_buffer view
+    cdef array.array starts, ends
+    cdef int *idx
+    cdef int *all_starts
+    cdef int *all_ends
+    cdef Py_ssize_t i, n
+    cdef int n_strucs
+    cdef bint ok=True
+    self.load_regions()
+    n_strucs=len(self.starts)
+    all_starts=self.starts.data.as_ints
+    all_ends=self.ends.data.as_ints
+    acquire_int_buffer(strucs, &view)
+    try:
+      n=view.len/sizeof(int)
+      idx=<int *>view.buf
+      starts=new_int_array(n)
+      ends=new_int_array(n)
+      with nogil:
+        for i from 0<=i<n:
+          if idx[i]<0 or idx[i]>=n_strucs:
+            ok=False
+            break
+          starts.data.as_ints[i]=all_starts[idx[i]]
+          ends.data.as_ints[i]=all_ends[idx[i]]
+    finally:
+      PyBuffer_Release(&view)
+    if not ok:
+      raise IndexError('structure number out of bounds')
+    return (starts, ends)
   def __getitem__(self,index):
     cdef int start, end
     if index<0 or index>=cl_max_struc(self.att):
@@ -399,6 +3016,17 @@ cdef class AlignAttrib:
     if self.att==NULL:
       raise KeyError
     self.has_values=cl_struc_values(self.att)
+  cdef int ensure_loaded(self, int components) except -1:
+    # loads the given components (LOAD_*) while holding the GIL
+    cdef int start_a, end_a, start_b, end_b
+    components&=~self.loaded
+    if components&LOAD_ALIGN:
+      if cl_max_alg(self.att)>0:
+        cl_alg2cpos(self.att,0,&start_a,&end_a,&start_b,&end_b)
+    self.loaded|=components
+    return 0
+  def __reduce__(self):
+    return (AlignAttrib, (self.parent, self.attname))
   def getName(self):
     return self.attname
   def cpos2alg(self,cpos):
@@ -407,6 +3035,33 @@ cdef class AlignAttrib:
     if val==CDA_EALIGN:
       raise KeyError("no alignment at this position")
     return val
+  def to_arrays(self):
+    """returns four arrays (array.array('i')) with the source start,
+       source end, target start and target end positions of all
+       alignment beads. These are cached and shared, and should not
+       be modified."""
+    cdef int i, n
+    cdef array.array start_a, end_a, start_b, end_b
+    if self.beads is None:
+      self.ensure_loaded(LOAD_ALIGN)
+      n=cl_max_alg(self.att)
+      start_a=new_int_array(n)
+      end_a=new_int_array(n)
+      start_b=new_int_array(n)
+      end_b=new_int_array(n)
+      with nogil:
+        for i from 0<=i<n:
+          cl_alg2cpos(self.att, i,
+                      &start_a.data.as_ints[i], &end_a.data.as_ints[i],
+                      &start_b.data.as_ints[i], &end_b.data.as_ints[i])
+      self.beads=(start_a, end_a, start_b, end_b)
+    return self.beads
+  def cpos2alg_many(self, positions):
+    """returns an array.array('i') with the alignment bead numbers
+       for the (source) corpus positions in *positions* (an IDList
+       or a buffer of C ints), with -1 for unaligned positions"""
+    beads=self.to_arrays()
+    return find_regions(beads[0], beads[1], positions)
   def __getitem__(self,index):
     cdef int start_a,end_a,start_b,end_b
     if index<0 or index>=cl_max_alg(self.att):
@@ -419,6 +3074,112 @@ cdef class AlignAttrib:
     return cl_max_alg(self.att)
 
 
+def concordance(hits, attrs, int left=5, int right=5, AttStruc context=None,
+                ends=None, sep='/'):
+  """builds KWIC concordance lines for the matches starting at the
+     corpus positions in *hits* (and ending at the positions in *ends*,
+     if given). Tokens are shown with the values of all attributes in
+     *attrs*, joined by *sep*. The context consists of *left* and *right*
+     tokens or, if *context* is an AttStruc, of the structure(s) that
+     contain the match plus *left* and *right* more structures.
+     Returns a list of (left context, match, right context) strings."""
+  cdef Py_buffer hits_view, ends_view
+  cdef bint have_ends=False
+  cdef int *starts
+  cdef int *match_ends
+  cdef int *reg_starts=NULL
+  cdef int *reg_ends=NULL
+  cdef int n_regions=0, max_cpos, k, k2, lo, hi, p, m0, m1, seg_lo, seg_hi
+  cdef Py_ssize_t i, n
+  cdef list attributes=list(attrs), caches, lines=[], tokens
+  cdef list segments
+  cdef PosAttrib attr
+  cdef dict cache
+  cdef int n_attrs=len(attributes), j
+  if n_attrs==0:
+    raise ValueError('concordance needs at least one attribute')
+  for j from 0<=j<n_attrs:
+    if not isinstance(attributes[j], PosAttrib):
+      raise TypeError('concordance attributes must be PosAttribs')
+  attr=attributes[0]
+  max_cpos=cl_max_cpos(attr.att)
+  # values are looked up through the attribute's lexicon cache, if it
+  # has one, and a per-call cache otherwise
+  caches=[{} for j in range(n_attrs)]
+  if context is not None:
+    context.load_regions()
+    reg_starts=context.starts.data.as_ints
+    reg_ends=context.ends.data.as_ints
+    n_regions=len(context.starts)
+  acquire_int_buffer(hits, &hits_view)
+  try:
+    if ends is not None:
+      acquire_int_buffer(ends, &ends_view)
+      have_ends=True
+    n=hits_view.len/sizeof(int)
+    starts=<int *>hits_view.buf
+    if have_ends:
+      if ends_view.len/sizeof(int)!=n:
+        raise ValueError('hits and ends differ in length')
+      match_ends=<int *>ends_view.buf
+    else:
+      match_ends=starts
+    k=0
+    for i from 0<=i<n:
+      m0=starts[i]
+      m1=match_ends[i]
+      if m0<0 or m1<m0 or m1>=max_cpos:
+        raise IndexError('match out of bounds')
+      if context is None:
+        lo=m0-left
+        hi=m1+right
+      else:
+        if i>0 and m0<starts[i-1]:
+          k=0
+        k=gallop(reg_ends, k, n_regions, m0)
+        k2=gallop(reg_ends, k, n_regions, m1)
+        if k<n_regions and reg_starts[k]<=m0:
+          lo=reg_starts[k-left if k>=left else 0]
+        else:
+          lo=m0
+        if k2<n_regions and reg_starts[k2]<=m1:
+          hi=reg_ends[k2+right if k2+right<n_regions else n_regions-1]
+        else:
+          hi=m1
+      if lo<0:
+        lo=0
+      if hi>=max_cpos:
+        hi=max_cpos-1
+      segments=[]
+      for (seg_lo, seg_hi) in ((lo, m0-1), (m0, m1), (m1+1, hi)):
+        tokens=[]
+        for p from seg_lo<=p<=seg_hi:
+          if n_attrs==1:
+            tokens.append(attr_value(attr, cl_cpos2id(attr.att, p), caches[0]))
+          else:
+            tokens.append(sep.join([attr_value(attributes[j],
+                                               cl_cpos2id((<PosAttrib>attributes[j]).att, p),
+                                               caches[j])
+                                    for j in range(n_attrs)]))
+        segments.append(' '.join(tokens))
+      lines.append(tuple(segments))
+  finally:
+    PyBuffer_Release(&hits_view)
+    if have_ends:
+      PyBuffer_Release(&ends_view)
+  return lines
+
+cdef inline object attr_value(PosAttrib attr, int tagid, dict cache):
+  cdef object val
+  if attr.lexicon_cache is not None or attr.lexicon_lru is not None:
+    return attr.id2value(tagid)
+  val=cache.get(tagid)
+  if val is None:
+    val=attr.decode(cl_id2str(attr.att, tagid))
+    cache[tagid]=val
+  return val
+
+
 # def test():
 #     cdef Corpus corpus
 #     cdef c_Attribute *att
@@ -0,0 +1,62 @@
+"""
+Counting n-grams over a positional attribute with several processes.
+
+The corpus is split into ranges of corpus positions, and each worker
+process counts the n-grams starting in its ranges with
+PosAttrib.count_ngrams, which writes sorted runs to disk. The runs
+are then merged (and pruned) into a single NGramTable::
+
+    table = count_ngrams('DICKENS', 'word', 3, within='s', min_count=5)
+    lexicon = Corpus('DICKENS').attribute('word', 'p').getDictionary()
+    for ids, count in table:
+        print(count, ' '.join(lexicon.get_word(i) for i in ids))
+"""
+
+import os
+import shutil
+import tempfile
+
+from cwb.cl import Corpus, merge_ngram_runs
+from cwb.parallel import parallel_map
+
+
+def _count_shard(att, start, stop, n, within, run_dir, run_size):
+    path_prefix = os.path.join(run_dir, 'shard%d' % (start,))
+    return att.count_ngrams(n, path_prefix, start, stop, within,
+                            run_size=run_size)
+
+
+def count_ngrams(corpus_name, att_name, n, within=None, min_count=1,
+                 registry_dir=None, processes=None, shards=None,
+                 run_size=1 << 22, out_path=None, tmp_dir=None):
+    """
+    counts the n-grams of the p-attribute *att_name* in corpus
+    *corpus_name* that do not cross the boundaries of the s-attribute
+    *within* (if given), using *processes* worker processes (default:
+    the number of CPUs). N-grams with fewer than *min_count* occurrences
+    are left out. Returns an NGramTable stored at *out_path* (by default,
+    a file in a new temporary directory).
+    """
+    corpus = Corpus(corpus_name, registry_dir=registry_dir)
+    att = corpus.attribute(att_name, 'p')
+    if within is not None:
+        within = corpus.attribute(within, 's')
+    work_dir = tempfile.mkdtemp(prefix='ngrams', dir=tmp_dir)
+    # the work directory is kept if it contains the table
+    keep_work_dir = out_path is None
+    if keep_work_dir:
+        out_path = os.path.join(work_dir, 'ngrams.%d' % (n,))
+    run_dir = os.path.join(work_dir, 'runs')
+    os.mkdir(run_dir)
+    try:
+        results = parallel_map(_count_shard, att, shards=shards,
+                               processes=processes,
+                               args=(n, within, run_dir, run_size))
+        paths = [path for result in results for path in result]
+        table = merge_ngram_runs(paths, out_path, min_count)
+    finally:
+        if keep_work_dir:
+            shutil.rmtree(run_dir)
+        else:
+            shutil.rmtree(work_dir)
+    return table
@@ -0,0 +1,536 @@
+"""
+Reading CWB corpora with NumPy, without the CWB library.
+
+The binary files of a corpus are memory-mapped as NumPy arrays, so
+opening a corpus is cheap and worker processes share its pages through
+the page cache. The classes follow the interface of cwb.cl, but return
+sorted NumPy arrays (of dtype int32) where cwb.cl returns IDLists, and
+bulk operations work on whole arrays::
+
+    corpus = Corpus('DICKENS')
+    word = corpus.attribute('word', 'p')
+    s = corpus.attribute('s', 's')
+    hits = word.find('London')
+    sentences = numpy.unique(s.cpos2struc_many(hits))
+    left = word.ids_at(hits - 1)
+
+Only uncompressed corpus streams can be read; attributes compressed
+with cwb-huffcode need cwb.cl. For attributes whose index has been
+compressed with cwb-compress-rdx, positions are found by scanning the
+corpus stream.
+"""
+
+import mmap
+import os
+import re
+import unicodedata
+
+import numpy
+
+from cwb.registry import corpus_home, corpus_attributes, corpus_properties
+
+registry = '/usr/local/share/cwb/registry/'
+
+encoding_names = {
+    'utf8': 'UTF-8',
+    'latin1': 'ISO-8859-15'}
+
+IGNORE_CASE = 1
+IGNORE_DIAC = 2
+
+_empty = numpy.zeros(0, dtype=numpy.int32)
+
+
+def _map_ints(path):
+    # CWB stores numbers as big-endian 32-bit ints
+    if os.path.getsize(path) == 0:
+        return numpy.zeros(0, dtype='>i4')
+    return numpy.memmap(path, dtype='>i4', mode='r')
+
+
+def _map_bytes(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _native(a):
+    return numpy.asarray(a, dtype=numpy.int32)
+
+
+def _strip_diacritics(s):
+    return unicodedata.normalize('NFC', u''.join(
+        c for c in unicodedata.normalize('NFD', s)
+        if not unicodedata.combining(c)))
+
+
+class Corpus(object):
+    """
+    a corpus, found by its name in the (colon-separated) registry
+    directories *registry_dir*
+    """
+
+    def __init__(self, cname, encoding=None, registry_dir=None):
+        if registry_dir is None:
+            registry_dir = registry
+        self.name = cname
+        self.registry_dir = registry_dir
+        self.home = corpus_home(cname, registry_dir)
+        self.declared = dict(corpus_attributes(cname, registry_dir))
+        if encoding is None:
+            encoding = self.get_encoding()
+        self.encoding = encoding
+
+    def get_encoding(self):
+        charset = corpus_properties(self.name, self.registry_dir).get(
+            'charset', 'latin1')
+        return encoding_names.get(charset, charset)
+
+    def to_str(self, s):
+        if isinstance(s, bytes):
+            return s
+        return s.encode(self.encoding)
+
+    def to_unicode(self, s):
+        if isinstance(s, bytes):
+            return s.decode(self.encoding)
+        return s
+
+    def attribute(self, name, atype):
+        if self.declared.get(name) != atype:
+            raise KeyError(name)
+        if atype == 'p':
+            return PosAttrib(self, name)
+        elif atype == 's':
+            return AttStruc(self, name)
+        raise ValueError('cannot read %s attributes: %s' % (atype, name))
+
+    def __repr__(self):
+        return "cwb.npcl.Corpus('%s')" % (self.name,)
+
+    def __reduce__(self):
+        return (Corpus, (self.name, self.encoding, self.registry_dir))
+
+
+class _Files(object):
+    # maps the files of an attribute on first use
+
+    def __init__(self, corpus, attname):
+        self.corpus = corpus
+        self.attname = attname
+        self.prefix = os.path.join(corpus.home, attname)
+        self.mapped = {}
+
+    def exists(self, ext):
+        return os.path.exists(self.prefix + ext)
+
+    def ints(self, ext):
+        if ext not in self.mapped:
+            self.mapped[ext] = _map_ints(self.prefix + ext)
+        return self.mapped[ext]
+
+    def bytes(self, ext):
+        if ext not in self.mapped:
+            self.mapped[ext] = _map_bytes(self.prefix + ext)
+        return self.mapped[ext]
+
+
+class PosAttrib(object):
+    """
+    a positional attribute, read from the files <name>.corpus,
+    <name>.lexicon(.idx/.srt), <name>.corpus.cnt and (if present)
+    <name>.corpus.rev/.rdx
+    """
+
+    def __init__(self, parent, attname):
+        self.parent = parent
+        self.attname = attname
+        self.files = _Files(parent, attname)
+        if not self.files.exists('.lexicon'):
+            raise KeyError(attname)
+        self._values = None
+        self._ids = None
+        self._freqs = None
+
+    def __repr__(self):
+        return "cwb.npcl.PosAttrib(%s,'%s')" % (self.parent, self.attname)
+
+    def __reduce__(self):
+        return (PosAttrib, (self.parent, self.attname))
+
+    def getName(self):
+        return self.attname
+
+    def getDictionary(self):
+        return AttrDictionary(self)
+
+    def stream(self):
+        """
+        returns the ids of all corpus positions as a read-only,
+        memory-mapped array of big-endian ints (dtype '>i4')
+        """
+        if not self.files.exists('.corpus'):
+            if self.files.exists('.huf'):
+                raise ValueError('%s is Huffman-compressed, which cwb.npcl '
+                                 'cannot read' % (self.attname,))
+            raise KeyError(self.attname)
+        return self.files.ints('.corpus')
+
+    def __len__(self):
+        return len(self.stream())
+
+    def __getitem__(self, offset):
+        if isinstance(offset, slice):
+            if (offset.start < 0 or offset.stop < offset.start or
+                    offset.stop > len(self)):
+                raise IndexError('P-attribute offset out of bounds')
+            return [self.id2value(i)
+                    for i in self.stream()[offset.start:offset.stop]]
+        if offset < 0 or offset >= len(self):
+            raise IndexError('P-attribute offset out of bounds')
+        return self.id2value(self.stream()[offset])
+
+    def cpos2id(self, offset):
+        return int(self.stream()[offset])
+
+    def ids(self, start, stop):
+        """
+        returns the ids for corpus positions start..stop-1 as an int32 array
+        """
+        if start < 0 or stop < start or stop > len(self):
+            raise IndexError('P-attribute offset out of bounds')
+        return _native(self.stream()[start:stop])
+
+    def ids_at(self, positions):
+        """
+        returns the ids at the corpus positions in the array
+        *positions* as an int32 array
+        """
+        positions = numpy.asarray(positions)
+        if len(positions) and (positions.min() < 0 or
+                               positions.max() >= len(self)):
+            raise IndexError('P-attribute offset out of bounds')
+        return _native(self.stream()[positions])
+
+    # lexicon
+
+    def lexicon_size(self):
+        return len(self.files.ints('.lexicon.idx'))
+
+    def id2str(self, tagid):
+        """
+        returns the value with lexicon id *tagid* as a byte string
+        """
+        lexicon = self.files.bytes('.lexicon')
+        start = int(self.files.ints('.lexicon.idx')[tagid])
+        return lexicon[start:lexicon.find(b'\0', start)]
+
+    def id2value(self, tagid):
+        if self._values is not None:
+            return self._values[tagid]
+        return self.parent.to_unicode(self.id2str(tagid))
+
+    def values(self):
+        """
+        returns the (decoded) values of all lexicon ids as a list,
+        which is cached
+        """
+        if self._values is None:
+            self._values = [self.parent.to_unicode(self.id2str(i))
+                            for i in range(self.lexicon_size())]
+        return self._values
+
+    def str2id(self, tag):
+        """
+        returns the lexicon id of the value *tag*, or -1 if it
+        does not occur
+        """
+        tag_s = self.parent.to_str(tag)
+        if not self.files.exists('.lexicon.srt'):
+            if self._ids is None:
+                self._ids = dict((v, i) for i, v in enumerate(self.values()))
+            return self._ids.get(self.parent.to_unicode(tag_s), -1)
+        order = self.files.ints('.lexicon.srt')
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.id2str(order[mid]) < tag_s:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(order) and self.id2str(order[lo]) == tag_s:
+            return int(order[lo])
+        return -1
+
+    def lexicon_ids(self, tags, flags=0):
+        """
+        returns a sorted int32 array with the lexicon ids of the values
+        in *tags* (or of the values that are equal to one of them after
+        folding, if *flags* are given)
+        """
+        if flags:
+            wanted = set(self._fold(self.parent.to_unicode(tag), flags)
+                         for tag in tags)
+            return numpy.array([i for i, v in enumerate(self.values())
+                                if self._fold(v, flags) in wanted],
+                               dtype=numpy.int32)
+        ids = set(self.str2id(tag) for tag in tags)
+        ids.discard(-1)
+        return numpy.array(sorted(ids), dtype=numpy.int32)
+
+    def matching_ids(self, pat, flags=0):
+        """
+        returns a sorted int32 array with the lexicon ids of the values
+        matching the regular expression *pat*
+        """
+        pat = self.parent.to_unicode(pat)
+        if flags & IGNORE_DIAC:
+            pat = _strip_diacritics(pat)
+        rx = re.compile(u'(?:%s)\\Z' % (pat,),
+                        re.IGNORECASE if flags & IGNORE_CASE else 0)
+        return numpy.array([i for i, v in enumerate(self.values())
+                            if rx.match(self._fold(v, flags & IGNORE_DIAC))],
+                           dtype=numpy.int32)
+
+    @staticmethod
+    def _fold(s, flags):
+        # the same folding as cwb.cl.fold_value
+        if flags & IGNORE_CASE:
+            s = s.casefold()
+        if flags & IGNORE_DIAC:
+            s = _strip_diacritics(s)
+        return s
+
+    # frequencies and positions
+
+    def frequencies(self):
+        """
+        returns the frequencies of all lexicon ids as an int32 array
+        """
+        if self._freqs is None:
+            if self.files.exists('.corpus.cnt'):
+                self._freqs = _native(self.files.ints('.corpus.cnt'))
+            else:
+                self._freqs = numpy.bincount(
+                    self.stream(), minlength=self.lexicon_size()
+                ).astype(numpy.int32)
+        return self._freqs
+
+    def frequency(self, tag):
+        tagid = self.str2id(tag)
+        if tagid < 0:
+            raise KeyError(tag)
+        return int(self.frequencies()[tagid])
+
+    def find(self, tag, flags=0):
+        """
+        returns a sorted int32 array with the positions of the value *tag*
+        """
+        if flags:
+            ids = self.lexicon_ids([tag], flags)
+            if len(ids) == 0:
+                raise KeyError(tag)
+            return self.find_ids(ids)
+        tagid = self.str2id(tag)
+        if tagid < 0:
+            raise KeyError(tag)
+        return self.find_ids([tagid])
+
+    def find_list(self, tags, flags=0):
+        return self.find_ids(self.lexicon_ids(tags, flags))
+
+    def find_pattern(self, pat, flags=0):
+        return self.find_ids(self.matching_ids(pat, flags))
+
+    def find_ids(self, ids):
+        """
+        returns a sorted int32 array with the positions of all tokens
+        whose value has one of the lexicon ids in *ids*
+        """
+        ids = numpy.asarray(ids, dtype=numpy.int32)
+        if len(ids) == 0:
+            return _empty
+        if not (self.files.exists('.corpus.rev') and
+                self.files.exists('.corpus.rdx')):
+            # compressed (or no) index: scan the corpus stream
+            return numpy.flatnonzero(
+                numpy.isin(self.stream(), ids)).astype(numpy.int32)
+        rev = self.files.ints('.corpus.rev')
+        starts = self.files.ints('.corpus.rdx')[ids]
+        freqs = self.frequencies()[ids]
+        parts = [rev[start:start + freq] for start, freq in zip(starts, freqs)]
+        result = _native(numpy.concatenate(parts))
+        if len(parts) > 1:
+            result.sort()
+        return result
+
+
+class AttrDictionary(object):
+    """
+    the values of a PosAttrib
+    """
+
+    def __init__(self, attr):
+        self.attr = attr
+
+    def __len__(self):
+        return self.attr.lexicon_size()
+
+    def __getitem__(self, s):
+        tagid = self.attr.str2id(s)
+        if tagid < 0:
+            raise KeyError(s)
+        return tagid
+
+    def get_word(self, n):
+        return self.attr.id2str(n)
+
+    def get_matching(self, pat, flags=0):
+        return self.attr.matching_ids(pat, flags)
+
+    def expand_pattern(self, pat, flags=0):
+        return [self.attr.id2str(i) for i in self.get_matching(pat, flags)]
+
+
+class AttStruc(object):
+    """
+    a structural attribute, read from the files <name>.rng and
+    (for attributes with values) <name>.avs/.avx
+    """
+
+    def __init__(self, parent, attname):
+        self.parent = parent
+        self.attname = attname
+        self.files = _Files(parent, attname)
+        if not self.files.exists('.rng'):
+            raise KeyError(attname)
+        self.has_values = (self.files.exists('.avs') and
+                           self.files.exists('.avx'))
+        self._regions = None
+        self._value_index = None
+
+    def __repr__(self):
+        return "cwb.npcl.AttStruc(%s,'%s')" % (self.parent, self.attname)
+
+    def __reduce__(self):
+        return (AttStruc, (self.parent, self.attname))
+
+    def getName(self):
+        return self.attname
+
+    def regions(self):
+        """
+        returns two int32 arrays with the start and end positions of
+        all structures
+        """
+        if self._regions is None:
+            rng = self.files.ints('.rng').reshape(-1, 2)
+            self._regions = (_native(rng[:, 0]), _native(rng[:, 1]))
+        return self._regions
+
+    def __len__(self):
+        return len(self.files.ints('.rng')) // 2
+
+    def value(self, index):
+        """
+        returns the value of structure *index* as a byte string
+        """
+        if not self.has_values:
+            raise TypeError('%s has no values' % (self.attname,))
+        avs = self.files.bytes('.avs')
+        start = int(self.files.ints('.avx')[2 * index + 1])
+        return avs[start:avs.find(b'\0', start)]
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError
+        starts, ends = self.regions()
+        if self.has_values:
+            return (int(starts[index]), int(ends[index]), self.value(index))
+        return (int(starts[index]), int(ends[index]))
+
+    def cpos2struc_many(self, positions):
+        """
+        returns an int32 array with the structure numbers for the corpus
+        positions in *positions*, with -1 for positions outside any
+        structure
+        """
+        starts, ends = self.regions()
+        positions = numpy.asarray(positions)
+        result = numpy.searchsorted(starts, positions, 'right') - 1
+        inside = result >= 0
+        inside[inside] = positions[inside] <= ends[result[inside]]
+        result[~inside] = -1
+        return result.astype(numpy.int32)
+
+    def cpos2struc(self, offset):
+        struc = int(self.cpos2struc_many([offset])[0])
+        if struc < 0:
+            raise KeyError('no structure at this position')
+        return struc
+
+    def find_pos(self, offset):
+        return self[self.cpos2struc(offset)]
+
+    def bounds_many(self, strucs):
+        """
+        returns two int32 arrays with the start and end positions of
+        the structures in *strucs*
+        """
+        starts, ends = self.regions()
+        strucs = numpy.asarray(strucs)
+        if len(strucs) and (strucs.min() < 0 or strucs.max() >= len(self)):
+            raise IndexError('structure number out of bounds')
+        return starts[strucs], ends[strucs]
+
+    def map_idlist(self, positions):
+        """
+        returns a sorted int32 array with the numbers of the structures
+        that contain at least one of *positions*
+        """
+        strucs = self.cpos2struc_many(positions)
+        return numpy.unique(strucs[strucs >= 0])
+
+    def value_index(self):
+        """
+        returns a dict that maps the values (byte strings) to sorted
+        int32 arrays of the numbers of the structures with that value
+        """
+        if not self.has_values:
+            raise TypeError('%s has no values' % (self.attname,))
+        if self._value_index is None:
+            avs = self.files.bytes('.avs')
+            values = {}
+            index = {}
+            for struc, offset in enumerate(
+                    self.files.ints('.avx')[1::2].tolist()):
+                value = values.get(offset)
+                if value is None:
+                    value = values[offset] = avs[offset:avs.find(b'\0',
+                                                                 offset)]
+                index.setdefault(value, []).append(struc)
+            self._value_index = dict(
+                (value, numpy.array(strucs, dtype=numpy.int32))
+                for value, strucs in index.items())
+        return self._value_index
+
+    def find_value(self, value):
+        """
+        returns a sorted int32 array with the numbers of all structures
+        whose value is *value*
+        """
+        return self.value_index().get(self.parent.to_str(value), _empty)
+
+    def find_value_pattern(self, pat):
+        """
+        returns a sorted int32 array with the numbers of all structures
+        whose value matches the regular expression *pat*
+        """
+        to_unicode = self.parent.to_unicode
+        rx = re.compile(u'(?:%s)\\Z' % (to_unicode(pat),))
+        parts = [strucs for value, strucs in self.value_index().items()
+                 if rx.match(to_unicode(value))]
+        if not parts:
+            return _empty
+        return numpy.sort(numpy.concatenate(parts))
@@ -0,0 +1,91 @@
+"""
+Running a function over parts of a corpus with several processes.
+
+Corpus and attribute objects from cwb.cl can be pickled (they are
+reopened by name in the receiving process), so they can be handed to
+worker processes. parallel_map splits a range of corpus positions
+(or of structure numbers) into shards, calls a function for each shard
+in a pool of worker processes and collects the results::
+
+    def count_long(att, start, stop):
+        return sum(1 for i in range(start, stop) if len(att[i]) > 10)
+
+    word = Corpus('DICKENS').attribute('word', 'p')
+    total = parallel_map(count_long, word, reduce=operator.add)
+"""
+
+import functools
+import os
+from multiprocessing import Pool
+
+_worker = None
+
+
+def _init_worker(func, handle, args):
+    global _worker
+    _worker = (func, handle, args)
+
+
+def _run_shard(shard):
+    func, handle, args = _worker
+    return func(handle, shard[0], shard[1], *args)
+
+
+def shard_ranges(start, stop, shards):
+    """
+    splits start..stop-1 into (at most) *shards* consecutive
+    ranges of about the same size, as a list of (start, stop) pairs.
+    An empty range gives a single empty shard.
+    """
+    size = max(1, -(-(stop - start) // max(shards, 1)))
+    return ([(lo, min(lo + size, stop)) for lo in range(start, stop, size)]
+            or [(start, stop)])
+
+
+def parallel_imap(func, handle, over=None, start=0, stop=None, shards=None,
+                  processes=None, args=()):
+    """
+    calls ``func(handle, lo, hi, *args)`` for consecutive ranges lo..hi-1
+    that cover start..stop-1 and yields the results in order. The ranges
+    go over the corpus positions of *over* if it is a PosAttrib, or over
+    its structure numbers if it is an AttStruc (by default, *over* is
+    *handle*, and *stop* is its length). *handle* and *args* are sent to
+    each of the *processes* worker processes (default: the number of
+    CPUs) once; *func* has to be a module-level function.
+    """
+    if over is None:
+        over = handle
+    if stop is None:
+        stop = len(over)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if shards is None:
+        shards = 4 * processes
+    ranges = shard_ranges(start, stop, shards)
+    if processes > 1 and len(ranges) > 1:
+        pool = Pool(processes, _init_worker, (func, handle, args))
+        try:
+            for result in pool.imap(_run_shard, ranges):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for lo, hi in ranges:
+            yield func(handle, lo, hi, *args)
+
+
+def parallel_map(func, handle, over=None, start=0, stop=None, shards=None,
+                 processes=None, args=(), reduce=None, initial=None):
+    """
+    like parallel_imap, but returns the list of results or, if a
+    *reduce* function is given, combines them with
+    ``functools.reduce(reduce, results[, initial])``
+    """
+    results = parallel_imap(func, handle, over, start, stop, shards,
+                            processes, args)
+    if reduce is None:
+        return list(results)
+    if initial is None:
+        return functools.reduce(reduce, results)
+    return functools.reduce(reduce, results, initial)
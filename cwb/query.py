@@ -0,0 +1,406 @@
+"""
+Boolean queries over the positional attributes of a corpus.
+
+A query combines constraints on single tokens with ``&``, ``|`` and
+``~`` (negation, only inside a conjunction)::
+
+    word = corpus.attribute('word', 'p')
+    pos = corpus.attribute('pos', 'p')
+    lemma = corpus.attribute('lemma', 'p')
+    query = Match(lemma, 'house.*') & Eq(pos, 'NN') & ~Eq(word, 'housing')
+    hits = evaluate(query)
+
+The number of matching positions of each constraint is known from the
+frequencies of its lexicon ids, so conjunctions are evaluated starting
+with the most selective constraint. Once few candidate positions are
+left, the remaining constraints are checked by reading the attribute
+values at these positions instead of looking up (and intersecting)
+all positions of frequent values.
+
+Sequences of constraints (with gaps) are matched with find_sequence::
+
+    starts, ends = find_sequence([Eq(word, 'the'), Gap(0, 2),
+                                  Match(pos, 'NN.*')], within=s)
+"""
+
+import array
+from abc import ABC, abstractmethod
+
+from cwb.cl import IDList, PackedIDList
+
+
+class Node(ABC):
+    """
+    base class for query expressions
+    """
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    @abstractmethod
+    def size(self):
+        """
+        returns the size of the corpus that the query refers to
+        """
+
+    @abstractmethod
+    def estimate(self):
+        """
+        returns the (estimated) number of matching positions
+        """
+
+
+class Term(Node):
+    """
+    a constraint on a single positional attribute, given by a set
+    of lexicon ids (see Eq, In and Match)
+    """
+
+    def __init__(self, attr):
+        self.attr = attr
+        self._ids = None
+        self._count = None
+
+    @abstractmethod
+    def lexicon_ids(self):
+        """
+        returns an IDList with the lexicon ids of the matching values
+        """
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            self._ids = self.lexicon_ids()
+        return self._ids
+
+    def size(self):
+        return len(self.attr)
+
+    def estimate(self):
+        # exact: the number of occurrences of the matching values
+        if self._count is None:
+            self._count = self.attr.total_frequency(self.ids)
+        return self._count
+
+
+class Eq(Term):
+    """
+    tokens whose value is *value* (after folding, with *flags*)
+    """
+
+    def __init__(self, attr, value, flags=0):
+        Term.__init__(self, attr)
+        self.value = value
+        self.flags = flags
+
+    def lexicon_ids(self):
+        return self.attr.lexicon_ids([self.value], self.flags)
+
+    def __repr__(self):
+        return 'Eq(%s, %r)' % (self.attr.getName(), self.value)
+
+
+class In(Term):
+    """
+    tokens whose value is one of *values*
+    """
+
+    def __init__(self, attr, values, flags=0):
+        Term.__init__(self, attr)
+        self.values = list(values)
+        self.flags = flags
+
+    def lexicon_ids(self):
+        return self.attr.lexicon_ids(self.values, self.flags)
+
+    def __repr__(self):
+        return 'In(%s, %r)' % (self.attr.getName(), self.values)
+
+
+class Match(Term):
+    """
+    tokens whose value matches the regular expression *pattern*
+    """
+
+    def __init__(self, attr, pattern, flags=0):
+        Term.__init__(self, attr)
+        self.pattern = pattern
+        self.flags = flags
+
+    def lexicon_ids(self):
+        return self.attr.getDictionary().get_matching(self.pattern,
+                                                      self.flags)
+
+    def __repr__(self):
+        return 'Match(%s, %r)' % (self.attr.getName(), self.pattern)
+
+
+class And(Node):
+    def __init__(self, *parts):
+        self.parts = []
+        for part in parts:
+            if isinstance(part, And):
+                self.parts.extend(part.parts)
+            else:
+                self.parts.append(part)
+
+    def size(self):
+        return self.parts[0].size()
+
+    def estimate(self):
+        # assuming that the constraints are independent
+        size = float(self.size())
+        result = size
+        for part in self.parts:
+            result *= part.estimate() / size if size else 0.0
+        return result
+
+    def __repr__(self):
+        return 'And(%s)' % (', '.join(repr(part) for part in self.parts),)
+
+
+class Or(Node):
+    def __init__(self, *parts):
+        self.parts = []
+        for part in parts:
+            if isinstance(part, Or):
+                self.parts.extend(part.parts)
+            else:
+                self.parts.append(part)
+
+    def size(self):
+        return self.parts[0].size()
+
+    def estimate(self):
+        return min(self.size(), sum(part.estimate() for part in self.parts))
+
+    def __repr__(self):
+        return 'Or(%s)' % (', '.join(repr(part) for part in self.parts),)
+
+
+class Not(Node):
+    def __init__(self, part):
+        self.part = part
+
+    def size(self):
+        return self.part.size()
+
+    def estimate(self):
+        return self.size() - self.part.estimate()
+
+    def __repr__(self):
+        return 'Not(%r)' % (self.part,)
+
+
+def evaluate(query, candidates=None, verify_ratio=8, trace=None):
+    """
+    returns an IDList with the positions that match *query* (out of
+    *candidates*, if given). Constraints are checked on the candidate
+    positions when there are fewer than 1/*verify_ratio* as many
+    candidates as matching positions. If *trace* is a list, the steps
+    of the evaluation are appended to it as (step, node, count) tuples.
+    """
+    return _evaluate(query, candidates, verify_ratio, trace)
+
+
+def _evaluate(node, candidates, verify_ratio, trace):
+    if isinstance(node, Term):
+        if (candidates is not None and
+                len(candidates) * verify_ratio < node.estimate()):
+            if trace is not None:
+                trace.append(('verify', node, len(candidates)))
+            return node.attr.filter_positions(candidates, node.ids)
+        if trace is not None:
+            trace.append(('lookup', node, node.estimate()))
+        result = node.attr.find_ids(node.ids)
+        if candidates is not None:
+            result = candidates & result
+        return result
+    elif isinstance(node, Not):
+        if candidates is None:
+            raise ValueError('cannot evaluate a negation on its own')
+        inner = node.part
+        if (isinstance(inner, Term) and
+                len(candidates) * verify_ratio < inner.estimate()):
+            if trace is not None:
+                trace.append(('verify', node, len(candidates)))
+            return inner.attr.filter_positions(candidates, inner.ids,
+                                               negate=True)
+        return candidates - _evaluate(inner, candidates, verify_ratio, trace)
+    elif isinstance(node, And):
+        # most selective constraints first, negations last
+        parts = sorted(node.parts, key=lambda part: (isinstance(part, Not),
+                                                     part.estimate()))
+        result = candidates
+        for part in parts:
+            result = _evaluate(part, result, verify_ratio, trace)
+            if len(result) == 0:
+                break
+        return result
+    elif isinstance(node, Or):
+        return IDList.union_all([_evaluate(part, candidates, verify_ratio,
+                                           trace)
+                                 for part in node.parts])
+    if isinstance(node, Node):
+        raise TypeError('unsupported query node: %s' % (
+            type(node).__name__,))
+    raise TypeError('not a query: %r' % (node,))
+
+
+class Gap(object):
+    """
+    between *min_len* and *max_len* (default: *min_len*) arbitrary
+    tokens in a sequence
+    """
+
+    def __init__(self, min_len=0, max_len=None):
+        if max_len is None:
+            max_len = min_len
+        if min_len < 0 or max_len < min_len:
+            raise ValueError('invalid gap: %s..%s' % (min_len, max_len))
+        self.min_len = min_len
+        self.max_len = max_len
+
+    def __repr__(self):
+        return 'Gap(%d, %d)' % (self.min_len, self.max_len)
+
+
+def _unpacked(lst):
+    # PosAttrib.find* return PackedIDLists for long results (see
+    # cwb.cl.pack_threshold), which cannot be shifted
+    if isinstance(lst, PackedIDList):
+        return lst.unpack()
+    return lst
+
+
+def _check(step, candidates, verify_ratio):
+    # the positions out of candidates that match step
+    if isinstance(step, (IDList, PackedIDList)):
+        return candidates & step
+    return evaluate(step, candidates, verify_ratio)
+
+
+def _estimate(step):
+    if isinstance(step, (IDList, PackedIDList)):
+        return len(step)
+    return step.estimate()
+
+
+def _to_array(lst):
+    return array.array('i', memoryview(lst).tobytes())
+
+
+def find_sequence(steps, within=None, verify_ratio=8):
+    """
+    finds the sequences of adjacent tokens that match *steps*, a list
+    of constraints (query nodes or IDLists of positions), optionally
+    with Gap objects between them. If *within* is an AttStruc, matches
+    have to be inside one of its structures. Returns two arrays
+    (array.array('i')) with the start and end positions of the matches,
+    sorted by start and end.
+
+    The search starts with the most selective constraint; the other
+    constraints are then checked at the positions next to its matches.
+    """
+    parts = []
+    gaps = []
+    gap = (0, 0)
+    for step in steps:
+        if isinstance(step, Gap):
+            gap = (gap[0] + step.min_len, gap[1] + step.max_len)
+        elif not isinstance(step, (Node, IDList, PackedIDList)):
+            raise TypeError('not a query: %r' % (step,))
+        else:
+            if parts:
+                gaps.append(gap)
+            elif gap != (0, 0):
+                raise ValueError('a sequence cannot start with a gap')
+            parts.append(step)
+            gap = (0, 0)
+    if not parts:
+        raise ValueError('empty sequence')
+    if gap != (0, 0):
+        raise ValueError('a sequence cannot end with a gap')
+    size = None
+    for part in parts:
+        if isinstance(part, Node):
+            size = part.size()
+            break
+    if all(lo == hi for lo, hi in gaps):
+        starts, ends = _find_fixed(parts, gaps, size, verify_ratio)
+    else:
+        starts, ends = _find_variable(parts, gaps, size, verify_ratio)
+    if within is not None:
+        start_regions = within.cpos2struc_many(starts)
+        end_regions = within.cpos2struc_many(ends)
+        keep = [i for i in range(len(starts))
+                if start_regions[i] >= 0 and
+                start_regions[i] == end_regions[i]]
+        starts = array.array('i', [starts[i] for i in keep])
+        ends = array.array('i', [ends[i] for i in keep])
+    return starts, ends
+
+
+def _find_fixed(parts, gaps, size, verify_ratio):
+    # with fixed gaps, each part is at a fixed offset from the start,
+    # and the start positions can be computed with IDList joins
+    offsets = [0]
+    for lo, hi in gaps:
+        offsets.append(offsets[-1] + 1 + lo)
+    order = sorted(range(len(parts)), key=lambda i: _estimate(parts[i]))
+    anchor = order[0]
+    if isinstance(parts[anchor], (IDList, PackedIDList)):
+        found = parts[anchor]
+    else:
+        found = evaluate(parts[anchor], None, verify_ratio)
+    starts = _unpacked(found).shifted(-offsets[anchor])
+    for i in order[1:]:
+        if len(starts) == 0:
+            break
+        found = _check(parts[i], starts.shifted(offsets[i], size),
+                       verify_ratio)
+        starts = starts.join(found, offsets[i])
+    return _to_array(starts), _to_array(starts.shifted(offsets[-1]))
+
+
+def _find_variable(parts, gaps, size, verify_ratio):
+    # partial matches are (start, end) pairs, which are extended to the
+    # right and then to the left of the most selective part
+    anchor = min(range(len(parts)), key=lambda i: _estimate(parts[i]))
+    if isinstance(parts[anchor], (IDList, PackedIDList)):
+        found = parts[anchor]
+    else:
+        found = evaluate(parts[anchor], None, verify_ratio)
+    matches = [(pos, pos) for pos in found]
+    for i in range(anchor + 1, len(parts)):
+        dists = range(1 + gaps[i - 1][0], 2 + gaps[i - 1][1])
+        matches = _extend(matches, parts[i], dists, 1, size, verify_ratio)
+    for i in range(anchor - 1, -1, -1):
+        dists = range(1 + gaps[i][0], 2 + gaps[i][1])
+        matches = _extend(matches, parts[i], dists, 0, size, verify_ratio)
+    matches = sorted(set(matches))
+    return (array.array('i', [start for start, end in matches]),
+            array.array('i', [end for start, end in matches]))
+
+
+def _extend(matches, part, dists, right, size, verify_ratio):
+    if not matches:
+        return matches
+    if right:
+        candidates = set(end + d for start, end in matches for d in dists)
+    else:
+        candidates = set(start - d for start, end in matches for d in dists)
+    candidates = IDList(sorted(pos for pos in candidates
+                               if pos >= 0 and (size is None or pos < size)))
+    found = set(_check(part, candidates, verify_ratio))
+    if right:
+        return [(start, end + d) for start, end in matches for d in dists
+                if end + d in found]
+    return [(start - d, end) for start, end in matches for d in dists
+            if start - d in found]
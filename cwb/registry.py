@@ -0,0 +1,76 @@
+"""
+Reading CWB registry files.
+"""
+
+import os
+import re
+
+
+def registry_file(cname, registry_dir):
+    """
+    returns the path of the registry file for corpus *cname*, looking
+    through the (colon-separated) directories in *registry_dir*
+    """
+    fname = cname.lower()
+    for dirname in registry_dir.split(':'):
+        path = os.path.join(dirname, fname)
+        if os.path.isfile(path):
+            return path
+    raise KeyError(cname)
+
+
+def read_registry(cname, registry_dir):
+    """
+    returns the declarations of a registry file as a list of
+    (keyword, value) pairs, e.g. ``('HOME', '/data/corpora/foo')``
+    or ``('ATTRIBUTE', 'word')``
+    """
+    entries = []
+    with open(registry_file(cname, registry_dir)) as f_reg:
+        for line in f_reg:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            parts = line.split(None, 1)
+            value = parts[1].strip() if len(parts) > 1 else ''
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            entries.append((parts[0], value))
+    return entries
+
+
+def corpus_home(cname, registry_dir):
+    """
+    returns the data directory (HOME) of corpus *cname*
+    """
+    for key, value in read_registry(cname, registry_dir):
+        if key == 'HOME':
+            return value
+    raise KeyError('no HOME directory for corpus %s' % (cname,))
+
+
+def corpus_attributes(cname, registry_dir):
+    """
+    returns the attributes declared in the registry file of corpus
+    *cname* as a list of (name, type) pairs, where type is 'p' for
+    positional attributes (ATTRIBUTE), 's' for structural attributes
+    (STRUCTURE) and 'a' for alignments (ALIGNED)
+    """
+    types = {'ATTRIBUTE': 'p', 'STRUCTURE': 's', 'ALIGNED': 'a'}
+    return [(value.split()[0], types[key])
+            for key, value in read_registry(cname, registry_dir)
+            if key in types and value]
+
+
+def corpus_properties(cname, registry_dir):
+    """
+    returns the corpus properties in the registry file of corpus
+    *cname* (lines such as ``##:: charset = "utf8"``) as a dict
+    """
+    properties = {}
+    with open(registry_file(cname, registry_dir)) as f_reg:
+        for line in f_reg:
+            m = re.match(r'##::\s*(\w+)\s*=\s*"([^"]*)"', line)
+            if m:
+                properties[m.group(1)] = m.group(2)
+    return properties
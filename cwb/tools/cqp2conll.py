@@ -1,8 +1,10 @@
 from __future__ import print_function
 
 import sys
+import io
 import optparse
 from cwb.cl import Corpus
+from cwb.parallel import parallel_imap
 
 try:
     from pathconfig import load_configuration
@@ -25,9 +27,9 @@ def output_sentences(sent_attr, attrs, sent_start=0, sent_end=None, f_out=None):
         sent_end = len(sent_attr)
     if f_out is None:
         f_out = sys.stdout
-    for sent_no in xrange(sent_start, sent_end):
+    for sent_no in range(sent_start, sent_end):
         (off_start, off_end) = sent_attr[sent_no][:2]
-        for i in xrange(off_start, off_end + 1):
+        for i in range(off_start, off_end + 1):
             line = [str(i + 1 - off_start)]
             for (k, att) in enumerate(attrs):
                 if att is None:
@@ -40,8 +42,8 @@ def output_sentences(sent_attr, attrs, sent_start=0, sent_end=None, f_out=None):
                         elif s == 'ROOT':
                             s = '0'
                     line.append(s)
-            print('\t'.join(line))
-        print()
+            print('\t'.join(line), file=f_out)
+        print(file=f_out)
 
 
 def output_sentences_line(sent_attr, attrs, sent_start=0, sent_end=None, f_out=None):
@@ -49,7 +51,7 @@ def output_sentences_line(sent_attr, attrs, sent_start=0, sent_end=None, f_out=N
         sent_end = len(sent_attr)
     if f_out is None:
         f_out = sys.stdout
-    for sent_no in xrange(sent_start, sent_end):
+    for sent_no in range(sent_start, sent_end):
         (off_start, off_end) = sent_attr[sent_no][:2]
         line = attrs[0][off_start:off_end + 1]
         print(' '.join(line), file=f_out)
@@ -61,7 +63,7 @@ def output_sentences_bllip(sent_attr, attrs, sent_start=0, sent_end=None,
         sent_end = len(sent_attr)
     if f_out is None:
         f_out = sys.stdout
-    for sent_no in xrange(sent_start, sent_end):
+    for sent_no in range(sent_start, sent_end):
         (off_start, off_end) = sent_attr[sent_no][:2]
         if max_len is not None and off_end - off_start >= max_len:
             continue
@@ -70,6 +72,19 @@ def output_sentences_bllip(sent_attr, attrs, sent_start=0, sent_end=None,
                                      sent_no, ' '.join(line)),
               file=f_out)
 
+output_functions = {
+    'conll': output_sentences,
+    'line': output_sentences_line,
+    'bllip': output_sentences_bllip}
+
+
+def format_sentences(handle, sent_start, sent_end, fmt, kwargs):
+    sent_attr, attrs = handle
+    f_out = io.StringIO()
+    output_functions[fmt](sent_attr, attrs, sent_start, sent_end,
+                          f_out=f_out, **kwargs)
+    return f_out.getvalue()
+
 oparse = optparse.OptionParser(usage='''%prog [options] CORPUS
 extracts parts of a corpus in CoNLL (or other) format''')
 oparse.add_option('--fmt', dest='fmt',
@@ -80,9 +95,12 @@ oparse.add_option('--fmt', dest='fmt',
 ##                  default=None)
 oparse.add_option('-P', dest='xcolumns',
                   help='add an attribute to print out (with N=ATT for Nth column)',
-                  default=[], action='append')
+                  default=None, action='append')
 oparse.add_option('-l', '--max-length', dest='max_len',
                   help='do not print sentences longer than MAX_LEN')
+oparse.add_option('-j', '--processes', dest='processes', type='int',
+                  help='number of worker processes (default: 1)',
+                  default=1)
 
 
 def main(argv=None):
@@ -106,7 +124,7 @@ def main(argv=None):
     sent_attr = corpus.attribute('s', 's')
     if opts.fmt == 'conll':
         idx = 1
-        for col in opts.xcolumns:
+        for col in opts.xcolumns or []:
             if '=' in col:
                 s_idx, att_name = col.split('=')
                 s_idx = int(s_idx)
@@ -115,12 +133,18 @@ def main(argv=None):
                 att_name = col
             columns[s_idx] = corpus.attribute(att_name, 'p')
             idx = s_idx + 1
-        output_sentences(sent_attr, columns, sent_start, sent_end)
-    elif opts.fmt == 'line':
-        output_sentences_line(sent_attr, columns, sent_start, sent_end)
-    elif opts.fmt == 'bllip':
-        output_sentences_bllip(sent_attr, columns, sent_start, sent_end,
-                               corpus_name=corpus_name, max_len=opts.max_len)
+    kwargs = {}
+    if opts.fmt == 'bllip':
+        kwargs = dict(corpus_name=corpus_name, max_len=opts.max_len)
+    if opts.processes > 1:
+        for text in parallel_imap(format_sentences, (sent_attr, columns),
+                                  over=sent_attr, start=sent_start,
+                                  stop=sent_end, processes=opts.processes,
+                                  args=(opts.fmt, kwargs)):
+            sys.stdout.write(text)
+    else:
+        output_functions[opts.fmt](sent_attr, columns, sent_start, sent_end,
+                                   **kwargs)
 
 if __name__ == '__main__':
     main()
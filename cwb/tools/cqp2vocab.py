@@ -49,9 +49,9 @@ def cqp2vocab_main(argv=None):
         else:
             recode = lambda x: x
         dic = att.getDictionary()
+        freqs = att.frequencies()
         for i in xrange(len(dic)):
-            word = dic.get_word(i)
-            frequencies[recode(word)] += att.frequency(word)
+            frequencies[recode(dic.get_word(i))] += freqs[i]
     for word in frequencies.keys():
         if frequencies[word] < opts.threshold:
             del frequencies[word]
@@ -33,14 +33,11 @@ class CorpusInfo:
         self.corpus = Corpus(corpus_name, registry_dir=CQP_REGISTRY)
         self.words = self.corpus.attribute('word', 'p')
         self.sentences = self.corpus.attribute('s', 's')
-        id_to_start = {}
-        text_ids = self.corpus.attribute('file_id', 's')
-        for start, end, fname in text_ids:
-            id_to_start[fname] = start
-        self.id_to_start = id_to_start
+        self.text_ids = self.corpus.attribute('file_id', 's')
 
     def __getitem__(self, fname):
-        return self.sentences.cpos2struc(self.id_to_start[fname])
+        text_no = self.text_ids.find_value(fname)[0]
+        return self.sentences.cpos2struc(self.text_ids[text_no][0])
 
 
 def get_alignments(corpus1, corpus2,
@@ -48,9 +45,10 @@ def get_alignments(corpus1, corpus2,
     att_align = corpus1.corpus.attribute(corpus2.name.lower(), 'a')
     seq1 = corpus1.corpus.attribute(att1, 'p')
     seq2 = corpus2.corpus.attribute(att2, 'p')
-    for start1, end1, start2, end2 in att_align:
-        line1 = ' '.join(seq1[start1:end1 + 1])
-        line2 = ' '.join(seq2[start2:end2 + 1])
+    starts1, ends1, starts2, ends2 = att_align.to_arrays()
+    for i in range(len(starts1)):
+        line1 = ' '.join(seq1[starts1[i]:ends1[i] + 1])
+        line2 = ' '.join(seq2[starts2[i]:ends2[i] + 1])
         yield line1, line2
 
 
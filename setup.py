@@ -19,6 +19,11 @@ VERSION = '0.3.0'
 REQUIRED = [
 ]
 
+# cwb.npcl and IDList.to_numpy need NumPy
+EXTRAS = {
+    'numpy': ['numpy'],
+}
+
 here = os.path.abspath(os.path.dirname(__file__))
 
 # for CWB >= 3.0
@@ -71,6 +76,7 @@ setup(
     packages=find_packages(exclude=["tests", "test_*"]),
     ext_modules=extensions,
     install_requires=REQUIRED,
+    extras_require=EXTRAS,
     include_package_data=True,
     py_modules=['cqp'],
     entry_points={
@@ -0,0 +1,88 @@
+import struct
+
+import pytest
+
+
+def write_ints(path, values):
+    with open(str(path), 'wb') as f:
+        f.write(struct.pack('>%di' % len(values), *values))
+
+
+def write_strings(path, strings):
+    offsets = []
+    with open(str(path), 'wb') as f:
+        for s in strings:
+            offsets.append(f.tell())
+            f.write(s + b'\0')
+    return offsets
+
+
+def write_pos_attribute(data, name, tokens, encoding='utf-8'):
+    lexicon = []
+    ids = []
+    for token in tokens:
+        value = token.encode(encoding)
+        if value not in lexicon:
+            lexicon.append(value)
+        ids.append(lexicon.index(value))
+    write_ints(data / (name + '.corpus'), ids)
+    write_ints(data / (name + '.lexicon.idx'),
+               write_strings(data / (name + '.lexicon'), lexicon))
+    write_ints(data / (name + '.lexicon.srt'),
+               sorted(range(len(lexicon)), key=lexicon.__getitem__))
+    freqs = [ids.count(i) for i in range(len(lexicon))]
+    write_ints(data / (name + '.corpus.cnt'), freqs)
+    rev = [cpos for i in range(len(lexicon))
+           for cpos, tagid in enumerate(ids) if tagid == i]
+    write_ints(data / (name + '.corpus.rev'), rev)
+    write_ints(data / (name + '.corpus.rdx'),
+               [sum(freqs[:i]) for i in range(len(lexicon))])
+
+
+def write_struc_attribute(data, name, regions, encoding='utf-8'):
+    write_ints(data / (name + '.rng'), [x for start, end, _ in regions
+                                        for x in (start, end)])
+    offsets = write_strings(data / (name + '.avs'),
+                            [value.encode(encoding)
+                             for _, _, value in regions])
+    write_ints(data / (name + '.avx'), [x for i, offset in enumerate(offsets)
+                                        for x in (i, offset)])
+
+
+def write_align_attribute(data, name, beads):
+    write_ints(data / (name + '.alx'), [x for bead in beads for x in bead])
+
+
+@pytest.fixture
+def make_corpus(tmp_path):
+    """
+    returns a function that writes a corpus in the CWB binary format
+    (with p-attributes given as lists of tokens, s-attributes as
+    lists of (start, end, value) regions and alignment attributes as
+    lists of (source start, source end, target start, target end)
+    beads) and returns the registry directory. *charset* is the CWB
+    name of the encoding (utf8 or latin1).
+    """
+    def make(name, p_attrs, s_attrs, a_attrs=(), charset='utf8'):
+        encoding = {'utf8': 'utf-8', 'latin1': 'latin-1'}[charset]
+        data = tmp_path / ('data-' + name)
+        data.mkdir()
+        decls = []
+        for att, tokens in p_attrs:
+            write_pos_attribute(data, att, tokens, encoding)
+            decls.append(u'ATTRIBUTE %s\n' % (att,))
+        for att, regions in s_attrs:
+            write_struc_attribute(data, att, regions, encoding)
+            decls.append(u'STRUCTURE %s\n' % (att,))
+        for att, beads in a_attrs:
+            write_align_attribute(data, att, beads)
+            decls.append(u'ALIGNED %s\n' % (att,))
+        reg = tmp_path / 'registry'
+        if not reg.exists():
+            reg.mkdir()
+        (reg / name).write_text(
+            u'NAME "%s"\nID %s\nHOME "%s"\n'
+            u'##:: charset = "%s"\n%s' % (name, name, data, charset,
+                                           ''.join(decls)))
+        return str(reg)
+    return make
@@ -1,8 +1,95 @@
+import array
+import struct
+
 import pytest
 
-from cwb.cl import Corpus
+from cwb.cl import Corpus, IDList, PackedIDList, ValueIndex, build_value_index, \
+    pattern_affixes, fold_value, IGNORE_CASE, IGNORE_DIAC
 
 
 def test_corpus_with_no_corpus():
     with pytest.raises(KeyError):
         Corpus('foobar')
+
+
+def test_idlist_from_buffer():
+    lst = IDList(array.array('i', [1, 5, 7]))
+    assert list(lst) == [1, 5, 7]
+    assert memoryview(lst).tolist() == [1, 5, 7]
+
+
+def test_idlist_unsorted():
+    with pytest.raises(ValueError):
+        IDList([5, 1])
+    assert list(IDList([5, 1, 5], sort=True)) == [1, 5]
+
+
+def test_idlist_set_operations():
+    small = IDList([3, 500, 999])
+    large = IDList(range(0, 1000, 3))
+    assert list(small & large) == [3, 999]
+    assert list(large & small) == [3, 999]
+    assert list(small - large) == [500]
+    assert len(small | large) == len(large) + 1
+    assert list(IDList.intersect_all([large, small, IDList([999])])) == [999]
+    assert list(IDList.union_all([small, IDList([1, 3])])) == [1, 3, 500, 999]
+
+
+def test_idlist_save_load(tmp_path):
+    lst = IDList([-5, 0, 3, 200, 70000, 2 ** 31 - 1])
+    for compress in (False, True):
+        path = str(tmp_path / 'hits')
+        lst.save(path, compress=compress)
+        assert list(IDList.load(path)) == list(lst)
+        assert list(IDList.load(path, mmap=False)) == list(lst)
+    for magic, n, payload in [(b'CWBIDLS1', 3, b'\0' * 8),
+                              (b'CWBIDLS1', -2, b''),
+                              (b'CWBIDLV1', 2 ** 40, b'\1' * 8),
+                              (b'CWBIDLV1', -1, b'\1'),
+                              (b'CWBIDLV1', 3, b'\1\1')]:
+        with open(path, 'wb') as f:
+            f.write(struct.pack('=8sq', magic, n) + payload)
+        with pytest.raises(ValueError):
+            IDList.load(path)
+
+
+def test_packed_idlist():
+    values = list(range(0, 3000, 7))
+    packed = PackedIDList(values)
+    other = IDList(range(0, 3000, 3))
+    assert len(packed) == len(values) and list(packed) == values
+    assert packed[200] == values[200]
+    assert 1400 in packed and 1401 not in packed
+    assert packed.nbytes < 4 * len(values)
+    assert list(packed & other) == list(range(0, 3000, 21))
+    assert isinstance(packed | other, PackedIDList)
+    assert list(packed | other) == sorted(set(values) | set(other))
+    assert list(other - packed) == [v for v in other if v % 7]
+    assert list(packed.join(other, 1)) == [v for v in values if v % 3 == 2]
+    assert list(packed.unpack()) == values
+
+
+def test_value_index():
+    index = ValueIndex(build_value_index([b'a', b'b', b'a']))
+    assert len(index) == 2
+    assert list(index[b'a']) == [0, 2]
+    assert b'c' not in index
+    with pytest.raises(KeyError):
+        index[b'c']
+
+
+def test_pattern_affixes():
+    assert pattern_affixes('Haus.*') == ('Haus', '', 'prefix')
+    assert pattern_affixes('.*ung') == ('', 'ung', 'suffix')
+    assert pattern_affixes('z\\.B\\.') == ('z.B.', 'z.B.', 'exact')
+    assert pattern_affixes('un[a-z]+bar') == ('un', 'bar', 'regex')
+    assert pattern_affixes('Haus|Hof') is None
+    # escapes other than escaped metacharacters are left to libcl
+    for pat in ('\\x41', 'x\\d+', '\\p{Lu}.*', 'ab\\N', '\\101'):
+        assert pattern_affixes(pat) is None, pat
+
+
+def test_fold_value():
+    assert fold_value(u'Caf\xe9', IGNORE_CASE) == u'caf\xe9'
+    assert fold_value(u'Caf\xe9', IGNORE_DIAC) == u'Cafe'
+    assert fold_value(u'STRA\xdfE', IGNORE_CASE | IGNORE_DIAC) == u'strasse'
@@ -0,0 +1,609 @@
+import array
+import math
+import operator
+import os
+import pickle
+from collections import Counter
+
+import pytest
+
+from cwb import cl, ngrams
+from cwb.cl import Corpus, IDList, PackedIDList, IGNORE_CASE, IGNORE_DIAC, \
+    concordance, fold_value, merge_ngram_runs
+from cwb.parallel import parallel_imap, parallel_map
+from tests.conftest import write_pos_attribute
+
+SENTENCES = [
+    u'the/DT cat/NN sat/VBD on/IN the/DT mat/NN ./.',
+    u'the/DT dog/NN sat/VBD on/IN the/DT cat/NN ./.',
+    u'a/DT big/JJ cat/NN and/CC the/DT dog/NN ./.',
+]
+TOKENS = [token.split('/') for sent in SENTENCES for token in sent.split()]
+WORDS = [word for word, pos in TOKENS]
+TAGS = [pos for word, pos in TOKENS]
+REGIONS = [(0, 6, u's1'), (7, 13, u's2'), (14, 20, u's3')]
+# noun phrases, with tokens between them
+PHRASES = [(0, 1, u'n1'), (4, 5, u'n2'), (7, 8, u'n3'), (11, 12, u'n4'),
+           (14, 16, u'n5'), (18, 19, u'n6')]
+
+
+@pytest.fixture
+def registry(make_corpus):
+    return make_corpus('test', [('word', WORDS), ('pos', TAGS)],
+                       [('s', REGIONS), ('np', PHRASES)])
+
+
+@pytest.fixture
+def corpus(registry):
+    return Corpus('test', registry_dir=registry)
+
+
+def test_bytes_name(registry, tmp_path):
+    corpus = Corpus(b'test', registry_dir=registry.encode('ascii'))
+    s = corpus.attribute(b's', 's')
+    assert list(s.find_value('s2')) == [1]
+    assert list(s.find_all(['s1', 's3'])) == [0, 2]
+    word = corpus.attribute(b'word', 'p')
+    ids = [word.cpos2id(i) for i in range(len(WORDS))]
+    assert list(word.ids(0, 3)) == ids[:3]
+    assert list(word.ids_at(IDList([2, 9]))) == [ids[2], ids[9]]
+    assert [list(chunk) for chunk in word.scan(0, 5, 2)] == [
+        ids[0:2], ids[2:4], ids[4:5]]
+    hits = word.find('cat')
+    assert len(word.collocates(hits, 1, 1, s)[0]) > 0
+    assert list(word.filter_positions(IDList([1, 8, 12]),
+                                      IDList([ids[12]]))) == [1, 12]
+    paths = word.count_ngrams(1, str(tmp_path / 'unigrams'))
+    assert len(merge_ngram_runs(paths, str(tmp_path / 'merged'))) == len(
+        set(WORDS))
+
+
+def test_frequencies_persist(registry, tmp_path):
+    word = Corpus('test', registry_dir=registry).attribute('word', 'p')
+    freqs = list(word.frequencies(persist=True))
+    assert freqs == [WORDS.count(word.getDictionary().get_word(i).decode())
+                     for i in range(len(freqs))]
+    index = tmp_path / 'data-test' / 'word.cnt.idx'
+    with open(str(index), 'r+b') as f:
+        f.truncate(8)
+    word = Corpus('test', registry_dir=registry).attribute('word', 'p')
+    assert list(word.frequencies(persist=True)) == freqs
+
+
+def region_of(cpos, regions=REGIONS):
+    for k, (start, end, _) in enumerate(regions):
+        if start <= cpos <= end:
+            return k
+
+
+def test_collocates(corpus):
+    word = corpus.attribute('word', 'p')
+    s = corpus.attribute('s', 's')
+    hits = word.find('cat')
+    window = set(cpos for hit in hits for cpos in range(hit - 2, hit + 2)
+                 if cpos not in hits and region_of(cpos) == region_of(hit))
+    expected = {}
+    for cpos in window:
+        expected[WORDS[cpos]] = expected.get(WORDS[cpos], 0) + 1
+    ids, scores, counts = word.collocates(hits, 2, 1, s, 'frequency')
+    found = dict((word.getDictionary().get_word(tagid).decode(), count)
+                 for tagid, count in zip(ids, counts))
+    assert found == expected
+    assert list(scores) == sorted(counts, reverse=True)
+    ids, scores, counts = word.collocates(hits, 2, 1, s, 'mi', min_count=2)
+    assert [word.getDictionary().get_word(i) for i in ids] == [b'the']
+    assert scores[0] == pytest.approx(math.log(
+        expected['the'] / (len(window) * WORDS.count('the') / float(len(WORDS))), 2))
+    with pytest.raises(ValueError):
+        word.collocates(hits, measure='dice')
+
+
+def expected_ngrams(word, n):
+    ids = [word.cpos2id(i) for i in range(len(WORDS))]
+    return Counter(tuple(ids[i:i + n]) for i in range(len(ids) - n + 1)
+                   if region_of(i) == region_of(i + n - 1))
+
+
+def test_count_ngrams(corpus, tmp_path):
+    word = corpus.attribute('word', 'p')
+    s = corpus.attribute('s', 's')
+    paths = (word.count_ngrams(2, str(tmp_path / 'a'), 0, 10, s, run_size=3) +
+             word.count_ngrams(2, str(tmp_path / 'b'), 10, None, s,
+                               run_size=3))
+    assert len(paths) > 2
+    expected = expected_ngrams(word, 2)
+    table = merge_ngram_runs(paths, str(tmp_path / 'bigrams'))
+    assert list(table) == sorted(expected.items())
+    table = merge_ngram_runs(paths, str(tmp_path / 'frequent'), min_count=2)
+    assert dict(table) == dict((ngram, count)
+                               for ngram, count in expected.items()
+                               if count >= 2)
+    paths += word.count_ngrams(3, str(tmp_path / 'c'))
+    with pytest.raises(ValueError):
+        merge_ngram_runs(paths, str(tmp_path / 'mixed'))
+
+
+def test_count_ngrams_parallel(registry, corpus, tmp_path):
+    word = corpus.attribute('word', 'p')
+    work = tmp_path / 'work'
+    work.mkdir()
+    table = ngrams.count_ngrams('test', 'word', 3, within='s',
+                                registry_dir=registry, processes=1,
+                                shards=3, out_path=str(tmp_path / 'trigrams'),
+                                tmp_dir=str(work))
+    assert dict(table) == dict(expected_ngrams(word, 3))
+    assert os.listdir(str(work)) == []
+
+
+def test_concordance(corpus):
+    word = corpus.attribute('word', 'p')
+    pos = corpus.attribute('pos', 'p')
+    s = corpus.attribute('s', 's')
+    hits = word.find('sat')
+    assert concordance(hits, [word], 2, 1) == [
+        (u'the cat', u'sat', u'on'), (u'the dog', u'sat', u'on')]
+    assert concordance(IDList([0]), [word, pos], 3, 1, sep='_') == [
+        (u'', u'the_DT', u'cat_NN')]
+    assert concordance(IDList([19]), [word], 1, 5) == [
+        (u'the', u'dog', u'.')]
+    # matches with ends, and structures as context
+    starts = IDList([1, 12])
+    ends = IDList([2, 13])
+    assert concordance(starts, [word], 0, 0, context=s, ends=ends) == [
+        (u'the', u'cat sat', u'on the mat .'),
+        (u'the dog sat on the', u'cat .', u'')]
+    assert concordance(IDList([8]), [word], 1, 1, context=s) == [
+        (u'the cat sat on the mat . the', u'dog',
+         u'sat on the cat . a big cat and the dog .')]
+    word.cache_lexicon()
+    assert concordance(hits, [word], 1, 0) == [(u'cat', u'sat', u''),
+                                               (u'dog', u'sat', u'')]
+    with pytest.raises(ValueError):
+        concordance(starts, [word], ends=IDList([2]))
+    with pytest.raises(IndexError):
+        concordance(IDList([len(WORDS)]), [word])
+
+
+def test_cache_lexicon(corpus):
+    # cached values come back as the same object, values that were
+    # evicted (or never cached) are decoded again
+    word = corpus.attribute('word', 'p')
+    word.cache_lexicon(2)
+    the = word[0]
+    cat = word[1]
+    assert word[4] is the
+    # 'the' was used last, so 'sat' evicts 'cat'
+    assert word[2] == u'sat'
+    assert word[0] is the
+    assert word[12] == u'cat' and word[12] is not cat
+    assert word[0:7] == WORDS[0:7]
+    # the slice leaves 'mat' and '.' in the cache
+    mat = word[5]
+    assert word[5] is mat and word[0] is not the
+    assert word[0:len(WORDS)] == WORDS
+    assert [word[i] for i in range(len(WORDS))] == WORDS
+    assert concordance(word.find('sat'), [word], 1, 1) == [
+        (u'cat', u'sat', u'on'), (u'dog', u'sat', u'on')]
+    word.cache_lexicon(0)
+    assert word[0] == u'the' and word[0] is not word[0]
+    assert word[0:len(WORDS)] == WORDS
+    word.cache_lexicon()
+    assert word[0] is word[4]
+    assert word[0:len(WORDS)] == WORDS
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    # a fresh pattern cache, so that the counts are not affected by
+    # other tests
+    cache = cl.PatternCache(1 << 20)
+    monkeypatch.setattr(cl, 'pattern_cache', cache)
+    return cache
+
+
+def test_pattern_cache(corpus, cache):
+    word = corpus.attribute('word', 'p')
+    pos = corpus.attribute('pos', 'p')
+    # each pattern caches its lexicon ids and its corpus positions
+    cats = word.find_pattern('c.t')
+    assert list(cats) == [1, 12, 16]
+    assert cache.stats() == {'hits': 0, 'misses': 2, 'entries': 2,
+                             'bytes': 16, 'max_bytes': 1 << 20}
+    assert word.find_pattern('c.t') is cats
+    assert (cache.hits, cache.misses) == (1, 2)
+    dogs = word.find_pattern('d.g')
+    assert word.find_pattern('c.t') is cats
+    assert (len(cache), cache.size) == (4, 28)
+    # 'sat' needs 12 bytes: the ids of 'c.t' and 'd.g' are dropped
+    cache.max_bytes = 32
+    word.find_pattern('s.t')
+    assert cache.stats() == {'hits': 2, 'misses': 6, 'entries': 4,
+                             'bytes': 32, 'max_bytes': 32}
+    assert word.find_pattern('d.g') is dogs
+    list(word.cursor_pattern('c.t'))
+    assert (cache.hits, cache.misses) == (3, 7)
+    # the positions of 'c.t' were used least recently
+    assert word.find_pattern('c.t') is not cats
+    assert list(word.find_pattern('c.t')) == list(cats)
+    # only the entries of one attribute are removed
+    cache.max_bytes = 1 << 20
+    nouns = pos.find_pattern('N.')
+    assert len(cache) > 2
+    cache.clear(word)
+    assert (len(cache), cache.size) == (2, 4 + 4 * len(nouns))
+    assert pos.find_pattern('N.') is nouns
+    cache.clear()
+    assert (len(cache), cache.size) == (0, 0)
+    # max_bytes=0 switches the cache off, even for empty results
+    cache.max_bytes = 0
+    assert list(word.find_pattern('x+')) == []
+    assert word.find_pattern('c.t') is not word.find_pattern('c.t')
+    assert (len(cache), cache.size) == (0, 0)
+    pos.find_pattern('N.')
+    cache.max_bytes = 100
+    word.find_pattern('x+')
+    assert len(cache) == 2
+    cache.max_bytes = 0
+    assert len(cache) == 0
+
+
+def test_region_filters(corpus):
+    word = corpus.attribute('word', 'p')
+    pos = corpus.attribute('pos', 'p')
+    np = corpus.attribute('np', 's')
+    positions = IDList([0, 1, 2, 4, 9, 12, 19, 20])
+    phrases = [region_of(cpos, PHRASES) for cpos in positions]
+    assert list(np.cpos2struc_many(positions)) == [
+        -1 if k is None else k for k in phrases]
+    assert list(np.map_idlist(positions)) == sorted(
+        set(k for k in phrases if k is not None))
+    assert list(np.filter_within(positions)) == [
+        cpos for cpos, k in zip(positions, phrases) if k is not None]
+    assert list(np.filter_within(positions, IDList([0, 5]))) == [0, 1, 19]
+    assert list(np.filter_within(word.find('sat'))) == []
+    strucs, lo, hi = np.group_by_region(positions)
+    groups = [(k, [cpos for cpos, k2 in zip(positions, phrases) if k2 == k])
+              for k in sorted(set(k for k in phrases if k is not None))]
+    assert [(k, list(positions)[i:j]) for k, i, j in zip(strucs, lo, hi)] \
+        == groups
+    assert list(np.cooccur(word.find('the'), pos.find('NN'))) == [
+        0, 1, 2, 3, 5]
+    assert list(np.cooccur(word.find('big'), word.find('cat'))) == [4]
+    starts, ends = np.bounds_many(IDList([1, 4]))
+    assert (list(starts), list(ends)) == ([4, 14], [5, 16])
+
+
+# values for lookups with and without the lexicon index
+LEXICON = [u'x41', u'A', u'unbar', u'unsagbar', u'un1bar', u'haus',
+           u'hausbau', u'bau', u'a.b', u'axb', u'd12', u'dd']
+PATTERNS = [u'\\x41', u'x\\d+', u'\\d+', u'un\\w+', u'un[a-z]+bar',
+            u'un.*bar', u'haus.*', u'.*bau', u'a\\.b', u'a.b', u'd[0-9]+',
+            u'd+', u'.*', u'un[0-9]bar']
+
+
+def test_lexicon_index_patterns(make_corpus, cache):
+    registry = make_corpus('lex', [('word', LEXICON)], [])
+
+    def lookup():
+        cache.clear()
+        word = Corpus('lex', registry_dir=registry).attribute('word', 'p')
+        return word, [list(word.find_pattern(pat)) for pat in PATTERNS]
+    word, expected = lookup()
+    assert word.lexicon_index(build=False) is None
+    word.lexicon_index()
+    word, found = lookup()
+    assert word.lexicon_index(build=False) is not None
+    for pat, lst, expected_lst in zip(PATTERNS, found, expected):
+        assert lst == expected_lst, pat
+    assert found[PATTERNS.index(u'un[a-z]+bar')] == [3]
+
+
+FOLD_WORDS = [u'Cat', u'cat', u'CAT', u'caf\xe9', u'Caf\xe9', u'cafe',
+              u'CAFE', u'Stra\xdfe', u'STRASSE', u'na\xefve', u'naive',
+              u'dog']
+
+
+def folded_positions(tag, flags, words=FOLD_WORDS):
+    return [cpos for cpos, value in enumerate(words)
+            if fold_value(value, flags) == fold_value(tag, flags)]
+
+
+def test_folded_lookups(make_corpus, cache):
+    registry = make_corpus('fold', [('word', FOLD_WORDS)], [])
+    word = Corpus('fold', registry_dir=registry).attribute('word', 'p')
+    tags = FOLD_WORDS + [u'CAF\xc9', u'strasse', u'NAIVE']
+    for flags in (IGNORE_CASE, IGNORE_DIAC, IGNORE_CASE | IGNORE_DIAC):
+        index = word.folded_index(flags)
+        for tag in tags:
+            expected = folded_positions(tag, flags)
+            assert list(word.find_pattern(tag, flags)) == expected
+            key = fold_value(tag, flags).encode('utf-8')
+            if not expected:
+                assert key not in index
+                continue
+            # every value has its own id, in the order of the positions
+            assert list(index[key]) == expected, (tag, flags)
+            assert list(word.find(tag, flags)) == expected, (tag, flags)
+        assert list(word.find_list(tags[:5] + [u'nothing'], flags)) == \
+            sorted(set(cpos for tag in tags[:5]
+                       for cpos in folded_positions(tag, flags)))
+        with pytest.raises(KeyError):
+            word.find(u'nothing', flags)
+    assert list(word.find(u'CAF\xc9', IGNORE_CASE)) == [3, 4]
+    assert list(word.find(u'strasse', IGNORE_CASE)) == [7, 8]
+    assert list(word.find(u'Naive', IGNORE_CASE | IGNORE_DIAC)) == [9, 10]
+    # the same as matching with %c in libcl (collect_matching_ids, used
+    # for patterns that are not literal strings)
+    for tag in (u'cat', u'CAFE', u'naive', u'DOG'):
+        assert list(word.find_pattern(tag, IGNORE_CASE)) == list(
+            word.find_pattern(u'(%s)' % (tag,), IGNORE_CASE))
+
+
+def test_folded_index_rebuilt(make_corpus, tmp_path):
+    registry = make_corpus('fold', [('word', FOLD_WORDS)], [])
+    word = Corpus('fold', registry_dir=registry).attribute('word', 'p')
+    assert list(word.find(u'cat', IGNORE_CASE)) == [0, 1, 2]
+    data = tmp_path / 'data-fold'
+    path = data / 'word.fold1.idx'
+    assert path.exists()
+    # the corpus is encoded again, after the index was written
+    words = [u'dog', u'DOG', u'Cat']
+    write_pos_attribute(data, 'word', words)
+    mtime = os.path.getmtime(str(path)) - 10
+    os.utime(str(path), (mtime, mtime))
+    word = Corpus('fold', registry_dir=registry).attribute('word', 'p')
+    assert list(word.find(u'cat', IGNORE_CASE)) == [2]
+    assert list(word.find(u'dog', IGNORE_CASE)) == [0, 1]
+    assert os.path.getmtime(str(path)) > mtime
+
+
+@pytest.fixture
+def packed():
+    # makes find* return PackedIDLists for all non-empty results
+    old = cl.pack_threshold
+    cl.pack_threshold = 0
+    yield
+    cl.pack_threshold = old
+
+
+def test_packed_results(corpus, packed):
+    word = corpus.attribute('word', 'p')
+    pos = corpus.attribute('pos', 'p')
+    s = corpus.attribute('s', 's')
+    np = corpus.attribute('np', 's')
+    hits = word.find('the')
+    assert isinstance(hits, PackedIDList)
+    plain = IDList(hits)
+    ids = IDList([word.cpos2id(0), word.cpos2id(1)])
+    packed_ids = PackedIDList(ids)
+    assert list(word.collocates(hits, 1, 1, s)[2]) == list(
+        word.collocates(plain, 1, 1, s)[2])
+    assert concordance(hits, [word, pos]) == concordance(plain, [word, pos])
+    assert list(word.ids_at(hits)) == list(word.ids_at(plain))
+    assert word.values_at(hits) == [u'the'] * len(plain)
+    assert list(word.filter_positions(hits, packed_ids)) == list(plain)
+    assert list(word.find_ids(packed_ids)) == list(word.find_ids(ids))
+    assert list(word.cursor_ids(packed_ids)) == list(word.find_ids(ids))
+    assert word.total_frequency(packed_ids) == word.total_frequency(ids)
+    assert list(np.filter_within(hits, PackedIDList([0, 2]))) == [0, 7]
+    assert [list(x) for x in np.group_by_region(hits)] == [
+        list(x) for x in np.group_by_region(plain)]
+    assert list(np.map_idlist(hits)) == list(np.map_idlist(plain))
+    assert list(np.cooccur(hits, pos.find('NN'))) == [0, 1, 2, 3, 5]
+    assert list(np.cpos2struc_many(hits)) == list(np.cpos2struc_many(plain))
+    assert [list(x) for x in s.bounds_many(PackedIDList([0, 2]))] == [
+        [0, 14], [6, 20]]
+    with pytest.raises(TypeError):
+        word.find_ids([1, 2])
+
+
+def test_position_cursor(corpus):
+    word = corpus.attribute('word', 'p')
+    pos = corpus.attribute('pos', 'p')
+    assert list(word.cursor('the')) == list(word.find('the'))
+    assert list(word.cursor_list(['the', 'dog'])) == list(
+        word.find_list(['the', 'dog']))
+    assert list(word.cursor_pattern('.a.')) == list(word.find_pattern('.a.'))
+    nouns = [cpos for cpos, tag in enumerate(TAGS) if tag == 'NN']
+    cursor = pos.cursor('NN')
+    assert cursor.skip_to(nouns[1]) == nouns[1]
+    # the position that skip_to returned is consumed
+    assert cursor.skip_to(nouns[1]) == nouns[2]
+    assert next(cursor) == nouns[3]
+    assert cursor.skip_to(nouns[-1] - 1) == nouns[-1]
+    assert cursor.skip_to(0) is None
+    assert list(cursor) == []
+    cursor = pos.cursor('NN')
+    assert list(cursor.read(4)) == nouns[:4]
+    buf = array.array('i', [0] * 4)
+    assert cursor.readinto(buf) == len(nouns) - 4
+    assert list(buf[:len(nouns) - 4]) == nouns[4:]
+    assert list(cursor.read()) == []
+    assert list(word.cursor_ids(IDList([]))) == []
+    with pytest.raises(IndexError):
+        word.cursor_ids(IDList([len(set(WORDS))]))
+    with pytest.raises(KeyError):
+        word.cursor('horse')
+
+
+def test_scan(corpus):
+    word = corpus.attribute('word', 'p')
+    ids = [word.cpos2id(i) for i in range(len(WORDS))]
+    chunks = [list(chunk) for chunk in word.scan(chunk_size=8)]
+    assert [len(chunk) for chunk in chunks] == [8, 8, 5]
+    assert sum(chunks, []) == ids
+    cursor = word.scan(3, 10, 4)
+    assert list(cursor.read(2)) == ids[3:5]
+    assert (cursor.position, cursor.stop) == (5, 10)
+    buf = array.array('i', [0] * 8)
+    assert cursor.readinto(buf) == 5
+    assert list(buf[:5]) == ids[5:10]
+    assert list(cursor.read(2)) == []
+    with pytest.raises(IndexError):
+        word.scan(0, len(WORDS) + 1)
+    with pytest.raises(ValueError):
+        word.scan(chunk_size=0)
+
+
+def test_id_index(registry, corpus, tmp_path):
+    word = corpus.attribute('word', 'p')
+    ids = [word.cpos2id(i) for i in range(len(WORDS))]
+    assert word.id_index(build=False) is None
+    assert list(word.id_index()) == ids
+    # positions are read from the index now
+    assert [word.cpos2id(i) for i in range(len(WORDS))] == ids
+    assert list(word.ids(2, 9)) == ids[2:9]
+    assert list(word.ids_at(IDList([0, 20]))) == [ids[0], ids[20]]
+    assert sum([list(c) for c in word.scan(1, None, 7, True)], []) == ids[1:]
+    word = Corpus('test', registry_dir=registry).attribute('word', 'p')
+    assert list(word.id_index(build=False)) == ids
+    with open(str(tmp_path / 'data-test' / 'word.ids.idx'), 'r+b') as f:
+        f.truncate(20)
+    word = Corpus('test', registry_dir=registry).attribute('word', 'p')
+    with pytest.raises(ValueError):
+        word.id_index()
+
+
+def test_decoding(corpus):
+    value = u'd\xf6g'.encode('utf-8')
+    assert corpus.to_unicode(value) == u'd\xf6g'
+    assert corpus.to_unicode(bytearray(value)) == u'd\xf6g'
+    assert corpus.to_unicode(memoryview(value)) == u'd\xf6g'
+    assert corpus.to_str(u'd\xf6g') == value
+    assert corpus.decode_many([value, bytearray(b'a'), u'b']) == [
+        u'd\xf6g', u'a', u'b']
+    word = corpus.attribute('word', 'p')
+    assert word.values_at(word.find('cat')) == [u'cat'] * 3
+    assert word.values_for(word.ids_at(IDList([0, 1]))) == [u'the', u'cat']
+    with pytest.raises(IndexError):
+        word.values_for(IDList([len(set(WORDS))]))
+
+
+TARGET = [u'le chat etait sur le tapis .', u'le chien etait sur le chat .',
+          u'un grand chat et le chien .']
+TARGET_WORDS = [w for sent in TARGET for w in sent.split()]
+# the second sentence has no alignment
+BEADS = [(0, 6, 0, 6), (14, 20, 14, 20)]
+
+
+@pytest.fixture
+def bitext(make_corpus):
+    make_corpus('tgt', [('word', TARGET_WORDS)],
+                [('s', REGIONS), ('file_id', [(0, 20, u'f1')])])
+    return make_corpus('src', [('word', WORDS)],
+                       [('s', REGIONS), ('file_id', [(0, 20, u'f1')])],
+                       [('tgt', BEADS)])
+
+
+def test_alignment(bitext):
+    align = Corpus('src', registry_dir=bitext).attribute('tgt', 'a')
+    assert len(align) == len(BEADS)
+    assert [align[i] for i in range(len(align))] == BEADS
+    starts1, ends1, starts2, ends2 = align.to_arrays()
+    assert list(zip(starts1, ends1, starts2, ends2)) == BEADS
+    positions = list(range(len(WORDS)))
+    expected = []
+    for cpos in positions:
+        try:
+            expected.append(align.cpos2alg(cpos))
+        except KeyError:
+            expected.append(-1)
+    assert expected == [0] * 7 + [-1] * 7 + [1] * 7
+    assert list(align.cpos2alg_many(IDList(positions))) == expected
+    assert list(align.cpos2alg_many(array.array('i', [20, 3, 9]))) == [
+        1, 0, -1]
+    with pytest.raises(IndexError):
+        align[len(BEADS)]
+
+
+def test_make_bitext(bitext, monkeypatch):
+    from cwb.tools import make_bitext
+    monkeypatch.setattr(make_bitext, 'CQP_REGISTRY', bitext)
+    src = make_bitext.CorpusInfo('src')
+    tgt = make_bitext.CorpusInfo('tgt')
+    assert src['f1'] == 0
+    assert list(make_bitext.get_alignments(src, tgt)) == [
+        (u' '.join(WORDS[0:7]), TARGET[0]),
+        (u' '.join(WORDS[14:21]), TARGET[2])]
+
+
+def test_pickle(bitext):
+    corpus = Corpus('src', registry_dir=bitext)
+    copy = pickle.loads(pickle.dumps(corpus))
+    assert copy.__reduce__() == corpus.__reduce__()
+    assert copy.attribute('word', 'p')[0:len(WORDS)] == WORDS
+    word = pickle.loads(pickle.dumps(corpus.attribute('word', 'p')))
+    assert word[0:len(WORDS)] == WORDS
+    s = pickle.loads(pickle.dumps(corpus.attribute('s', 's')))
+    assert [s[i] for i in range(len(s))] == [
+        (start, end, value.encode('utf-8')) for start, end, value in REGIONS]
+    align = pickle.loads(pickle.dumps(corpus.attribute('tgt', 'a')))
+    assert [align[i] for i in range(len(align))] == BEADS
+    hits = word.find('the')
+    assert list(pickle.loads(pickle.dumps(hits))) == list(hits)
+    assert list(pickle.loads(pickle.dumps(IDList()))) == []
+
+
+def count_values(att, start, stop, value):
+    # module-level, so that worker processes can find it
+    return [att[i] for i in range(start, stop)].count(value)
+
+
+def region_lengths(att, start, stop):
+    return [att[i][1] - att[i][0] + 1 for i in range(start, stop)]
+
+
+def test_parallel_map(corpus):
+    word = corpus.attribute('word', 'p')
+    s = corpus.attribute('s', 's')
+    counts = parallel_map(count_values, word, shards=4, processes=2,
+                          args=('the',))
+    assert len(counts) == 4
+    assert sum(counts) == WORDS.count('the')
+    assert parallel_map(count_values, word, processes=2, args=('cat',),
+                        reduce=operator.add) == WORDS.count('cat')
+    assert parallel_map(count_values, word, start=7, stop=14, processes=2,
+                        args=('the',), reduce=operator.add,
+                        initial=10) == 12
+    # shards of sentence numbers instead of corpus positions
+    assert parallel_map(region_lengths, s, over=s, shards=3, processes=2,
+                        reduce=operator.add) == [7, 7, 7]
+    assert list(parallel_imap(region_lengths, s, over=s, start=1,
+                              shards=2, processes=2)) == [[7], [7]]
+
+
+def test_cqp2conll(registry, monkeypatch, capsys):
+    from cwb.tools import cqp2conll
+    monkeypatch.setattr(cqp2conll, 'CQP_REGISTRY', registry)
+    expected = ''.join(
+        ''.join('\t'.join([str(i - start + 1), WORDS[i], TAGS[i]] +
+                          ['_'] * 12) + '\n'
+                for i in range(start, end + 1)) + '\n'
+        for start, end, _ in REGIONS[1:])
+    for processes in ('1', '2'):
+        cqp2conll.main(['-j', processes, '-P', 'pos', 'test', '1', '3'])
+        assert capsys.readouterr().out == expected
+    cqp2conll.main(['-j', '2', '--fmt', 'line', 'test'])
+    assert capsys.readouterr().out == ''.join(
+        ' '.join(WORDS[start:end + 1]) + '\n' for start, end, _ in REGIONS)
+
+
+def test_latin1(make_corpus):
+    words = [u'5\xa4', u'caf\xe9', u'na\xefve']
+    registry = make_corpus('latin', [('word', words)],
+                           [('s', [(0, 2, u'\xe9t\xe9')])],
+                           charset='latin1')
+    corpus = Corpus('latin', registry_dir=registry)
+    assert corpus.get_encoding() == 'latin1'
+    # ISO-8859-1, where 0xa4 is the currency sign (not the euro sign,
+    # as in ISO-8859-15)
+    assert corpus.to_unicode(b'\xa4') == u'\xa4'
+    assert corpus.to_unicode(bytearray(b'caf\xe9')) == u'caf\xe9'
+    assert corpus.to_str(u'caf\xe9') == b'caf\xe9'
+    assert corpus.decode_many([b'5\xa4', b'x']) == [u'5\xa4', u'x']
+    word = corpus.attribute('word', 'p')
+    assert word[0:len(words)] == words
+    assert word[1] == u'caf\xe9'
+    assert list(word.find(u'na\xefve')) == [2]
+    assert word.values_at(IDList([0])) == [u'5\xa4']
+    assert list(corpus.attribute('s', 's').find_value(u'\xe9t\xe9')) == [0]
@@ -0,0 +1,59 @@
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from cwb.npcl import Corpus, IGNORE_CASE, IGNORE_DIAC  # noqa: E402
+from cwb.registry import corpus_attributes, corpus_properties  # noqa: E402
+
+TOKENS = u'the cat sat on the mat . The d\xf6g sat .'.split()
+SENTENCES = [(0, 6, u'a'), (7, 10, u'b\xe4')]
+
+
+@pytest.fixture
+def corpus(make_corpus):
+    reg = make_corpus('test', [('word', TOKENS)], [('s', SENTENCES)])
+    return Corpus('test', registry_dir=reg)
+
+
+def test_registry(corpus):
+    assert corpus_attributes('test', corpus.registry_dir) == [('word', 'p'),
+                                                              ('s', 's')]
+    assert corpus_properties('test', corpus.registry_dir) == {
+        'charset': 'utf8'}
+    assert corpus.encoding == 'UTF-8'
+
+
+def test_pos_attrib(corpus):
+    word = corpus.attribute('word', 'p')
+    assert len(word) == len(TOKENS)
+    assert word[0:len(TOKENS)] == TOKENS
+    assert word[8] == u'd\xf6g'
+    assert list(word.find('sat')) == [2, 9]
+    assert list(word.find('the', IGNORE_CASE)) == [0, 4, 7]
+    assert list(word.find_pattern('.at')) == [1, 2, 5, 9]
+    assert list(word.find_list(['on', 'mat', 'nothing'])) == [3, 5]
+    assert word.frequency('.') == 2
+    assert word.getDictionary()[u'd\xf6g'] == word.cpos2id(8)
+    assert list(word.ids_at(word.find('sat') - 1)) == list(
+        word.ids_at([1, 8]))
+    with pytest.raises(KeyError):
+        word.find('dog')
+
+
+def test_att_struc(corpus):
+    s = corpus.attribute('s', 's')
+    assert len(s) == 2
+    assert s[1] == (7, 10, u'b\xe4'.encode('utf-8'))
+    assert list(s.cpos2struc_many([0, 6, 7, 10, 11])) == [0, 0, 1, 1, -1]
+    assert list(s.find_value(u'b\xe4')) == [1]
+    assert list(s.find_value_pattern('.*')) == [0, 1]
+    assert s.find_pos(3) == (0, 6, b'a')
+
+
+def test_folding(make_corpus):
+    tokens = [u'Stra\xdfe', u'STRASSE', u'strasse', u'Stra\xdf\xe9']
+    reg = make_corpus('fold', [('word', tokens)], [])
+    word = Corpus('fold', registry_dir=reg).attribute('word', 'p')
+    assert list(word.find(u'stra\xdfe', IGNORE_CASE)) == [0, 1, 2]
+    assert list(word.find(u'STRASSE', IGNORE_CASE | IGNORE_DIAC)) == [
+        0, 1, 2, 3]
@@ -0,0 +1,218 @@
+import random
+import re
+
+import pytest
+
+from cwb import cl
+from cwb.cl import Corpus
+from cwb.query import Node, Term, Eq, In, Match, Gap, evaluate, \
+    find_sequence
+
+VOCABULARY = [(u'the', u'DT'), (u'a', u'DT'), (u'cat', u'NN'),
+              (u'dog', u'NN'), (u'house', u'NN'), (u'houses', u'NNS'),
+              (u'sat', u'VBD'), (u'saw', u'VBD'), (u'on', u'IN'),
+              (u'big', u'JJ'), (u'.', u'.')]
+
+
+@pytest.fixture(scope='module')
+def sample():
+    rnd = random.Random(17)
+    # 'the' is the most frequent word, 'big' a rare one
+    weights = [40, 10, 10, 10, 5, 5, 8, 8, 8, 2, 10]
+    tokens = []
+    for i in range(400):
+        r = rnd.uniform(0, sum(weights))
+        for token, weight in zip(VOCABULARY, weights):
+            r -= weight
+            if r <= 0:
+                break
+        tokens.append(token)
+    regions = [(start, min(start + 9, len(tokens) - 1), u's%d' % (start,))
+               for start in range(0, len(tokens), 10)]
+    return tokens, regions
+
+
+@pytest.fixture(params=[None, 0])
+def attrs(request, make_corpus, sample):
+    # with pack_threshold=0, find* return PackedIDLists
+    old = cl.pack_threshold
+    cl.pack_threshold = request.param
+    request.addfinalizer(lambda: setattr(cl, 'pack_threshold', old))
+    tokens, regions = sample
+    registry = make_corpus('query', [('word', [w for w, p in tokens]),
+                                     ('pos', [p for w, p in tokens])],
+                           [('s', regions)])
+    corpus = Corpus('query', registry_dir=registry)
+    return (corpus.attribute('word', 'p'), corpus.attribute('pos', 'p'),
+            corpus.attribute('s', 's'))
+
+
+def holds(node, values, cpos):
+    # evaluates a query node at a single position, as a reference
+    kind = type(node).__name__
+    if kind in ('Eq', 'In', 'Match'):
+        value = values[node.attr.getName()][cpos]
+        if kind == 'Eq':
+            return value == node.value
+        elif kind == 'In':
+            return value in node.values
+        return re.match('(?:%s)\\Z' % (node.pattern,), value) is not None
+    elif kind == 'And':
+        return all(holds(part, values, cpos) for part in node.parts)
+    elif kind == 'Or':
+        return any(holds(part, values, cpos) for part in node.parts)
+    return not holds(node.part, values, cpos)
+
+
+def values_of(sample):
+    tokens, regions = sample
+    return {'word': [w for w, p in tokens], 'pos': [p for w, p in tokens]}
+
+
+def test_evaluate(attrs, sample):
+    word, pos, s = attrs
+    values = values_of(sample)
+    queries = [
+        Eq(word, 'cat'),
+        Eq(pos, 'DT') & ~Eq(word, 'the'),
+        Match(word, 'house.*') & Eq(pos, 'NN'),
+        Match(word, 's.*') | Eq(pos, 'JJ'),
+        (Eq(pos, 'NN') | Eq(pos, 'JJ')) & ~In(word, ['cat', 'house']),
+        Eq(word, 'the') & ~(Eq(pos, 'NN') | Eq(pos, 'DT')),
+        Eq(pos, 'DT') & Eq(word, 'big'),
+    ]
+    for query in queries:
+        expected = [cpos for cpos in range(len(word))
+                    if holds(query, values, cpos)]
+        for verify_ratio in (0, 1, 8, 1000):
+            assert list(evaluate(query, verify_ratio=verify_ratio)) == \
+                expected, (query, verify_ratio)
+    with pytest.raises(ValueError):
+        evaluate(~Eq(word, 'the'))
+    with pytest.raises(TypeError):
+        evaluate('the')
+
+
+def test_evaluate_plan(attrs):
+    word, pos, s = attrs
+    rare = Eq(pos, 'JJ')
+    frequent = In(word, ['big', 'the'])
+    negated = ~Eq(word, 'a')
+    query = negated & frequent & rare
+    assert rare.estimate() < frequent.estimate()
+    trace = []
+    evaluate(query, trace=trace)
+    # most selective constraint first, the negation last
+    assert [node for step, node, count in trace] == [rare, frequent,
+                                                     negated.part]
+    assert trace[0] == ('lookup', rare, rare.estimate())
+    # few candidates: the other constraints are verified at the
+    # candidate positions instead of being looked up
+    trace = []
+    evaluate(rare & frequent, verify_ratio=1, trace=trace)
+    assert [step for step, node, count in trace] == ['lookup', 'verify']
+    trace = []
+    evaluate(rare & frequent, verify_ratio=len(word), trace=trace)
+    assert [step for step, node, count in trace] == ['lookup', 'lookup']
+
+
+def sequences(parts, gaps, values, size, regions):
+    # all (start, end) matches of the sequence, by brute force
+    def match(i, cpos, start):
+        if not (0 <= cpos < size) or not holds(parts[i], values, cpos):
+            return []
+        if i == len(parts) - 1:
+            return [(start, cpos)]
+        lo, hi = gaps[i]
+        return [m for d in range(lo, hi + 1)
+                for m in match(i + 1, cpos + 1 + d, start)]
+
+    def region(cpos):
+        for k, (start, end, _) in enumerate(regions):
+            if start <= cpos <= end:
+                return k
+    result = sorted(set(m for cpos in range(size)
+                        for m in match(0, cpos, cpos)))
+    if regions is not None:
+        result = [(start, end) for start, end in result
+                  if region(start) == region(end)]
+    return result
+
+
+def sequence_gaps(steps):
+    # the gaps between the constraints of a sequence
+    gaps = []
+    gap = None
+    for step in steps:
+        if isinstance(step, Gap):
+            gap = (gap[0] + step.min_len, gap[1] + step.max_len)
+        else:
+            if gap is not None:
+                gaps.append(gap)
+            gap = (0, 0)
+    return gaps
+
+
+def test_find_sequence(attrs, sample):
+    word, pos, s = attrs
+    regions = sample[1]
+    values = values_of(sample)
+    cases = [
+        [Eq(word, 'the'), Eq(pos, 'NN')],
+        [Eq(pos, 'DT'), Gap(1), Eq(word, 'sat')],
+        [Eq(word, 'the'), Eq(pos, 'NN'), Gap(2), Eq(pos, 'DT')],
+        [Eq(pos, 'DT'), Gap(0, 2), Eq(pos, 'NN')],
+        [Eq(word, 'sat'), Gap(0, 3), Eq(word, 'cat'), Gap(1, 2),
+         Match(word, 'h.*')],
+        [Eq(pos, 'DT'), Gap(0, 1), Gap(1, 2), Eq(word, 'dog')],
+    ]
+    for steps in cases:
+        parts = [step for step in steps if not isinstance(step, Gap)]
+        for within in (None, s):
+            expected = sequences(parts, sequence_gaps(steps), values,
+                                 len(word),
+                                 None if within is None else regions)
+            starts, ends = find_sequence(steps, within=within)
+            assert list(zip(starts, ends)) == expected, (steps, within)
+
+
+def test_find_sequence_idlist(attrs):
+    word, pos, s = attrs
+    starts, ends = find_sequence([word.find('the'), Eq(pos, 'NN')])
+    expected = find_sequence([Eq(word, 'the'), Eq(pos, 'NN')])
+    assert (starts, ends) == expected
+    assert all(end == start + 1 for start, end in zip(starts, ends))
+    for steps in ([], [Gap(1), Eq(word, 'the')], [Eq(word, 'the'), Gap(1)]):
+        with pytest.raises(ValueError):
+            find_sequence(steps)
+    with pytest.raises(ValueError):
+        Gap(2, 1)
+
+
+class Longer(Node):
+    # a node type that evaluate does not know about
+    def __init__(self, attr):
+        self.attr = attr
+
+    def size(self):
+        return len(self.attr)
+
+    def estimate(self):
+        return 1
+
+
+def test_unsupported_nodes(attrs):
+    word, pos, s = attrs
+    # the base classes are abstract
+    with pytest.raises(TypeError):
+        Node()
+    with pytest.raises(TypeError):
+        Term(word)
+    with pytest.raises(TypeError, match='unsupported query node: Longer'):
+        evaluate(Longer(word))
+    with pytest.raises(TypeError, match='unsupported query node: Longer'):
+        evaluate(Eq(word, 'the') & ~Longer(word))
+    with pytest.raises(TypeError, match='unsupported query node: Longer'):
+        find_sequence([Eq(word, 'the'), Longer(word)])
+    with pytest.raises(TypeError, match='not a query'):
+        find_sequence([Eq(word, 'the'), 'cat'])